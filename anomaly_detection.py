@@ -1,93 +1,255 @@
 # anomaly_detection.py: Detección de anomalías en temperatura
 
-import collections
 import time
 import numpy as np
-from sklearn.ensemble import IsolationForest
-from PyQt6.QtCore import pyqtSignal, QObject
 import config
+import utils
+import events
+import model_training
 
-class AnomalyDetector(QObject):
-    alert_signal = pyqtSignal(str)  # Signal para alertas a GUI
-
-    def __init__(self):
-        super().__init__()
-        self.window = collections.deque(maxlen=config.ANOMALY_WINDOW_SIZE)
-        self.timestamps = collections.deque(maxlen=config.ANOMALY_WINDOW_SIZE)
-        self.model = IsolationForest(contamination=0.1, random_state=42)
-        self.last_train_time = 0
-        self.anomaly_start_time = 0
-        self.is_anomaly_active = False
-        self.grace_period_active = False
-        self.last_normal_time = time.time()
-
-    def process_data(self, temperature, timestamp):
-        """Procesa nueva lectura de temperatura y detecta anomalías"""
-        self.window.append(temperature)
-        self.timestamps.append(timestamp)
-        
-        # Necesita ventana completa para análisis
-        if len(self.window) < config.ANOMALY_WINDOW_SIZE:
-            print(f"📊 Recopilando datos iniciales: {len(self.window)}/{config.ANOMALY_WINDOW_SIZE}")
+logger = utils.get_logger(__name__)
+
+# Puntaje del Isolation Forest (decision_function) bajo el cual una lectura es anómala
+ML_SCORE_THRESHOLD = -0.5
+
+def ewma_weights(window_size, alpha):
+    """Pesos del EWMA sobre una ventana ordenada (la más antigua es la semilla)"""
+    exponents = np.arange(window_size - 1, -1, -1)
+    weights = alpha * (1 - alpha) ** exponents
+    weights[0] = (1 - alpha) ** (window_size - 1)
+    return weights
+
+class FleetAnomalyDetector:
+    """Detector de anomalías para toda la flota, vectorizado con NumPy.
+
+    Las ventanas de todos los dispositivos viven en una matriz circular
+    (dispositivos x ANOMALY_WINDOW_SIZE) con un índice de escritura por fila,
+    y la media, la varianza y el EWMA se mantienen con sumas incrementales
+    (las mismas fórmulas que rolling_stats.RollingStats, una columna por
+    dispositivo): cada lectura cuesta O(1), sin desplazar ni recorrer la
+    ventana. El estado de anomalía/periodo de gracia de cada dispositivo se
+    guarda en arrays, indexados por fila.
+
+    El modelo es un Isolation Forest común a la flota, entrenado sobre las
+    lecturas estandarizadas por la media/desviación de la ventana de cada
+    dispositivo, para que un solo modelo sirva a refrigeradores con distintos
+    niveles de temperatura. Cada micro-lote hace una sola llamada al modelo,
+    solo con las lecturas que ya superaron el z-score.
+    """
+
+    def __init__(self, window_size=None, alpha=0.3, initial_capacity=64):
+        self.alert_signal = events.Signal()  # Signal para alertas (GUI u otros)
+        self.window_size = window_size or config.ANOMALY_WINDOW_SIZE
+        self.alpha = alpha
+        self.decay = 1.0 - alpha
+        self.evict_weight = alpha * self.decay ** self.window_size
+        self.oldest_weight = self.decay ** self.window_size
+        # Pesos de la parte "cola" del EWMA (sin la semilla), para recalcular desde la ventana
+        self.tail_weights = alpha * self.decay ** np.arange(self.window_size - 1, -1, -1)
+
+        # Modelo reentrenado en segundo plano (pool de procesos compartido)
+        self.trainer = model_training.get_default_trainer()
+        self.model_key = "fleet"
+        self.max_train_samples = 10000
+
+        self.device_index = {}  # device_id -> fila
+        self.device_ids = []  # fila -> device_id
+        self._allocate(initial_capacity)
+
+    def _allocate(self, capacity):
+        """Crea (o agranda, copiando) los arrays de estado por dispositivo"""
+        old_rows = len(self.device_ids)
+        arrays = {
+            'windows': np.zeros((capacity, self.window_size)),
+            'heads': np.zeros(capacity, dtype=np.int64),  # Próxima posición (= la más antigua si está llena)
+            'counts': np.zeros(capacity, dtype=np.int64),
+            'pushes': np.zeros(capacity, dtype=np.int64),  # Lecturas recibidas (recálculo periódico)
+            'means': np.zeros(capacity),
+            'm2s': np.zeros(capacity),
+            'ewma_tails': np.zeros(capacity),
+            'is_anomaly_active': np.zeros(capacity, dtype=bool),
+            'grace_period_active': np.zeros(capacity, dtype=bool),
+            'anomaly_start_time': np.zeros(capacity),
+            'last_normal_time': np.zeros(capacity),
+        }
+        for name, array in arrays.items():
+            if old_rows:
+                array[:old_rows] = getattr(self, name)[:old_rows]
+            setattr(self, name, array)
+        self.capacity = capacity
+
+    def _rows_for(self, device_ids):
+        rows = np.empty(len(device_ids), dtype=np.int64)
+        index = self.device_index
+        for i, device_id in enumerate(device_ids):
+            row = index.get(device_id)
+            if row is None:
+                row = len(self.device_ids)
+                if row == self.capacity:
+                    self._allocate(self.capacity * 2)
+                index[device_id] = row
+                self.device_ids.append(device_id)
+                self.last_normal_time[row] = time.time()
+            rows[i] = row
+        return rows
+
+    def process_batch(self, device_ids, temperatures, timestamps):
+        """Procesa un micro-lote de lecturas (posiblemente de muchos dispositivos)"""
+        if len(device_ids) == 0:
             return
-        
-        # === MÉTODO 1: Análisis estadístico (EWMA + Z-score) ===
-        data = np.array(self.window)
-        ewma = self.exponential_moving_average(data)
-        std = np.std(data)
-        
-        if std == 0:
-            std = 0.1  # Evita división por cero
-        
-        z_score = (temperature - ewma) / std
-        is_stat_anomaly = abs(z_score) > config.ANOMALY_Z_THRESHOLD
-        
-        # === MÉTODO 2: Machine Learning (Isolation Forest) ===
-        # Re-entrena cada 60 segundos
-        if time.time() - self.last_train_time > 60:
-            self.model.fit(data.reshape(-1, 1))
-            self.last_train_time = time.time()
-            print("🤖 Modelo ML reentrenado")
-        
-        ml_score = self.model.decision_function([[temperature]])[0]
-        is_ml_anomaly = ml_score < -0.5
-        
-        # === DETECCIÓN: Ambos métodos deben coincidir ===
-        is_anomaly = is_stat_anomaly and is_ml_anomaly
-        
-        if is_anomaly:
-            if not self.is_anomaly_active:
-                self.anomaly_start_time = time.time()
-                self.is_anomaly_active = True
-                print(f"🔔 Anomalía detectada: {temperature}°C (Z-score: {z_score:.2f}, ML: {ml_score:.2f})")
-            
-            duration = time.time() - self.anomaly_start_time
-            
-            # Anomalía temporal (posible apertura de puerta)
-            if duration < config.ANOMALY_DURATION_THRESHOLD:
-                if not self.grace_period_active:
-                    alert_msg = f"⚠️ Cambio temporal: {temperature}°C (posible apertura)"
-                    self.alert_signal.emit(alert_msg)
-                    print(alert_msg)
-                    self.grace_period_active = True
-            else:
-                # Anomalía sostenida (problema crítico)
-                alert_msg = f"🚨 ALERTA CRÍTICA: Cambio sostenido ({duration:.0f}s) - {temperature}°C"
-                self.alert_signal.emit(alert_msg)
-                print(alert_msg)
+        rows = self._rows_for(device_ids)
+        temperatures = np.asarray(temperatures, dtype=np.float64)
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+
+        # Un dispositivo puede aparecer varias veces en el lote: se procesa por
+        # "rondas" (k-ésima lectura de cada dispositivo) para respetar el orden
+        order = np.argsort(rows, kind='stable')
+        sorted_rows = rows[order]
+        positions = np.arange(len(rows))
+        is_first = np.ones(len(rows), dtype=bool)
+        is_first[1:] = sorted_rows[1:] != sorted_rows[:-1]
+        group_start = np.maximum.accumulate(np.where(is_first, positions, 0))
+        rank = np.empty(len(rows), dtype=np.int64)
+        rank[order] = positions - group_start
+
+        # === MÉTODO 1: Análisis estadístico (EWMA + Z-score), ronda por ronda ===
+        rounds = []
+        for r in range(int(rank.max()) + 1):
+            selected = rank == r
+            evaluated = self._push_round(rows[selected], temperatures[selected], timestamps[selected])
+            if evaluated is not None:
+                rounds.append(evaluated)
+        if not rounds:
+            return
+
+        # === MÉTODO 2: Machine Learning (Isolation Forest), una llamada por lote ===
+        # Solo hace falta el puntaje de las lecturas que ya superaron el z-score
+        candidates = np.concatenate([standardized[flagged] for *_, standardized, flagged in rounds])
+        # Re-entrena cada MODEL_RETRAIN_INTERVAL seg. sin bloquear la detección; se
+        # consulta en cada lote para que el primer modelo se entrene durante el arranque
+        model = self.trainer.get_model(self.model_key, self.training_data)
+        if model is not None and len(candidates):
+            scores = model.decision_function(candidates.reshape(-1, 1))
         else:
-            # Temperatura normal
-            if self.is_anomaly_active:
-                recovery_time = time.time() - self.anomaly_start_time
-                print(f"✅ Temperatura normalizada después de {recovery_time:.0f}s")
-                self.is_anomaly_active = False
-                self.grace_period_active = False
-            
-            self.last_normal_time = time.time()
-
-    def exponential_moving_average(self, data, alpha=0.3):
-        """Calcula promedio móvil exponencial"""
-        ema = data[0]
-        for val in data[1:]:
-            ema = alpha * val + (1 - alpha) * ema
-        return ema
\ No newline at end of file
+            # Primer modelo todavía en entrenamiento: sin ML no hay alertas (ambos deben coincidir)
+            scores = np.full(len(candidates), np.inf)
+
+        # === DETECCIÓN: Ambos métodos deben coincidir ===
+        position = 0
+        for round_rows, round_temperatures, round_timestamps, z_scores, _, flagged in rounds:
+            ml_scores = np.full(len(round_rows), np.inf)
+            count = int(flagged.sum())
+            ml_scores[flagged] = scores[position:position + count]
+            position += count
+            self._update_state(round_rows, flagged & (ml_scores < ML_SCORE_THRESHOLD),
+                               round_temperatures, round_timestamps, z_scores, ml_scores)
+
+    def _push_round(self, rows, temperatures, timestamps):
+        """Agrega una lectura por fila (sin repetir) y evalúa el z-score de las ventanas completas"""
+        n = self.window_size
+        heads = self.heads[rows]
+        counts = self.counts[rows]
+        full = counts == n
+        old = self.windows[rows, heads]
+        self.windows[rows, heads] = temperatures
+        self.heads[rows] = (heads + 1) % n
+        new_counts = np.minimum(counts + 1, n)
+        self.counts[rows] = new_counts
+
+        # Welford (deslizante si la ventana ya estaba llena: sale la más antigua)
+        means = self.means[rows]
+        delta = np.where(full, temperatures - old, temperatures - means)
+        new_means = means + delta / new_counts
+        self.m2s[rows] += delta * np.where(full, temperatures - new_means + old - means,
+                                           temperatures - new_means)
+        self.means[rows] = new_means
+        self.ewma_tails[rows] = (self.decay * self.ewma_tails[rows] + self.alpha * temperatures
+                                 - np.where(full, self.evict_weight * old, 0.0))
+        pushes = self.pushes[rows] + 1
+        self.pushes[rows] = pushes
+        drifted = rows[pushes % n == 0]
+        if len(drifted):
+            self._recompute(drifted)
+
+        # Necesita ventana completa para análisis
+        full = new_counts == n
+        if not full.any():
+            return None
+        rows = rows[full]
+        temperatures = temperatures[full]
+        timestamps = timestamps[full]
+
+        # La semilla del EWMA es la lectura más antigua, a la que ahora apunta heads
+        ewma = self.ewma_tails[rows] + self.oldest_weight * self.windows[rows, self.heads[rows]]
+        means = self.means[rows]
+        m2s = self.m2s[rows]
+        # Residuo de redondeo en ventanas constantes: 0 exacto, como np.std
+        variance = np.where(m2s <= 1e-12 * (n * means * means + 1.0), 0.0, m2s / n)
+        std = np.sqrt(variance)
+        std[std == 0] = 0.1  # Evita división por cero
+        z_scores = (temperatures - ewma) / std
+        standardized = (temperatures - means) / std
+        flagged = np.abs(z_scores) > config.ANOMALY_Z_THRESHOLD
+        return rows, temperatures, timestamps, z_scores, standardized, flagged
+
+    def _recompute(self, rows):
+        """Recalcula media, M2 y EWMA desde la ventana (corrige deriva numérica)"""
+        order = (self.heads[rows, None] + np.arange(self.window_size)) % self.window_size
+        windows = self.windows[rows[:, None], order]  # Orden cronológico
+        means = windows.mean(axis=1)
+        self.means[rows] = means
+        self.m2s[rows] = ((windows - means[:, None]) ** 2).sum(axis=1)
+        self.ewma_tails[rows] = windows @ self.tail_weights
+
+    def training_data(self):
+        """Datos de entrenamiento: ventanas completas estandarizadas por dispositivo"""
+        full_rows = np.flatnonzero(self.counts[:len(self.device_ids)] >= self.window_size)
+        windows = self.windows[full_rows]
+        std = windows.std(axis=1, keepdims=True)
+        std[std == 0] = 0.1
+        data = ((windows - windows.mean(axis=1, keepdims=True)) / std).ravel()
+        if len(data) > self.max_train_samples:
+            rng = np.random.default_rng(42)
+            data = rng.choice(data, self.max_train_samples, replace=False)
+        return data
+
+    def _update_state(self, rows, is_anomaly, temperatures, timestamps, z_scores, ml_scores):
+        """Máquina de estados anomalía/periodo de gracia, vectorizada por dispositivo"""
+        active = self.is_anomaly_active[rows]
+
+        # Inicio de anomalía
+        started = is_anomaly & ~active
+        if started.any():
+            self.anomaly_start_time[rows[started]] = timestamps[started]
+            self.is_anomaly_active[rows[started]] = True
+            for i in np.flatnonzero(started):
+                logger.warning("🔔 Anomalía detectada [%s]: %s°C (Z-score: %.2f, ML: %.2f)",
+                               self.device_ids[rows[i]], temperatures[i], z_scores[i], ml_scores[i])
+
+        duration = timestamps - self.anomaly_start_time[rows]
+
+        # Anomalía temporal (posible apertura de puerta)
+        temporary = (is_anomaly & (duration < config.ANOMALY_DURATION_THRESHOLD)
+                     & ~self.grace_period_active[rows])
+        for i in np.flatnonzero(temporary):
+            alert_msg = f"⚠️ Cambio temporal [{self.device_ids[rows[i]]}]: {temperatures[i]}°C (posible apertura)"
+            self.alert_signal.emit(alert_msg)
+            logger.warning(alert_msg)
+        self.grace_period_active[rows[temporary]] = True
+
+        # Anomalía sostenida (problema crítico)
+        critical = is_anomaly & (duration >= config.ANOMALY_DURATION_THRESHOLD)
+        for i in np.flatnonzero(critical):
+            alert_msg = (f"🚨 ALERTA CRÍTICA [{self.device_ids[rows[i]]}]: Cambio sostenido "
+                         f"({duration[i]:.0f}s) - {temperatures[i]}°C")
+            self.alert_signal.emit(alert_msg)
+            logger.warning(alert_msg)
+
+        # Temperatura normal
+        recovered = ~is_anomaly & active
+        for i in np.flatnonzero(recovered):
+            logger.info("✅ Temperatura normalizada [%s] después de %.0fs",
+                        self.device_ids[rows[i]], duration[i])
+        self.is_anomaly_active[rows[recovered]] = False
+        self.grace_period_active[rows[recovered]] = False
+        self.last_normal_time[rows[~is_anomaly]] = timestamps[~is_anomaly]
@@ -0,0 +1,247 @@
+# backfill.py: Re-evaluación de anomalías sobre datos históricos guardados (modo offline por bloques)
+
+import argparse
+import time
+from datetime import datetime
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+import config
+import anomaly_detection
+import db_handler
+import model_training
+import utils
+
+logger = utils.get_logger(__name__)
+
+TEMPORARY = "temporary"  # Racha más corta que ANOMALY_DURATION_THRESHOLD (posible apertura)
+CRITICAL = "critical"  # Cambio sostenido
+
+
+class DeviceState:
+    """Lo que un dispositivo arrastra de un bloque al siguiente"""
+    __slots__ = ('tail', 'event')
+
+    def __init__(self):
+        self.tail = np.empty(0)  # Últimas window_size - 1 lecturas (inicio de la próxima ventana)
+        self.event = None  # Racha anómala todavía abierta
+
+
+class BackfillDetector:
+    """Aplica la detección de FleetAnomalyDetector a lecturas guardadas, bloque por bloque.
+
+    Misma regla que en vivo: la ventana incluye la lectura actual, el z-score
+    es contra el EWMA de la ventana y el Isolation Forest debe coincidir. Las
+    ventanas de cada tramo de un dispositivo se arman con sliding_window_view
+    (sin copiar) y el modelo solo puntúa las lecturas que ya superaron el
+    z-score. Las duraciones salen de los timestamps guardados, no del reloj.
+
+    Cada racha de lecturas anómalas consecutivas de un dispositivo es un
+    evento: temporal si dura menos de duration_threshold, crítico si no. Si
+    no se pasa un modelo, se entrena uno con una muestra del primer bloque.
+    """
+
+    def __init__(self, window_size=None, z_threshold=None, duration_threshold=None, alpha=0.3,
+                 model=None, run_id=None):
+        self.window_size = window_size or config.ANOMALY_WINDOW_SIZE
+        self.z_threshold = z_threshold or config.ANOMALY_Z_THRESHOLD
+        self.duration_threshold = duration_threshold or config.ANOMALY_DURATION_THRESHOLD
+        self.weights = anomaly_detection.ewma_weights(self.window_size, alpha)
+        self.model = model
+        self.max_train_samples = 10000
+        self.run_id = run_id or f"backfill-{datetime.now():%Y%m%d-%H%M%S}"
+        self.devices = {}  # device_id -> DeviceState
+        self.rows = 0
+        self.evaluated = 0
+
+    def process_chunk(self, rows):
+        """Evalúa un bloque de StorageBackend.iter_samples; retorna los eventos cerrados en él"""
+        if not rows:
+            return []
+        self.rows += len(rows)
+        device_ids = np.array([row[1] for row in rows], dtype=object)
+        timestamps = np.array([row[2] for row in rows], dtype='datetime64[ms]')
+        temperatures = np.fromiter((row[3] for row in rows), dtype=np.float64, count=len(rows))
+        bounds = np.concatenate(([0], np.flatnonzero(device_ids[1:] != device_ids[:-1]) + 1, [len(rows)]))
+
+        # === MÉTODO 1: EWMA + z-score por tramo de dispositivo ===
+        segments = []
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            device_id = device_ids[start]
+            state = self.devices.get(device_id)
+            if state is None:
+                state = self.devices[device_id] = DeviceState()
+            values = np.concatenate((state.tail, temperatures[start:stop]))
+            state.tail = values[len(values) - (self.window_size - 1):].copy()
+            if len(values) < self.window_size:
+                continue  # Necesita ventana completa para análisis
+            windows = sliding_window_view(values, self.window_size)
+            current = values[self.window_size - 1:]
+            std = windows.std(axis=1)
+            std[std == 0] = 0.1  # Evita división por cero
+            z_scores = (current - windows @ self.weights) / std
+            standardized = (current - windows.mean(axis=1)) / std
+            first = stop - len(current)  # Las lecturas sin ventana completa no se evalúan
+            segments.append((device_id, state, timestamps[first:stop], current, z_scores, standardized))
+        if not segments:
+            return []
+
+        # === MÉTODO 2: Isolation Forest, una llamada por bloque ===
+        if self.model is None:
+            self.model = self._train(np.concatenate([segment[5] for segment in segments]))
+        flagged = [np.abs(segment[4]) > self.z_threshold for segment in segments]
+        candidates = np.concatenate([segment[5][mask] for segment, mask in zip(segments, flagged)])
+        scores = (self.model.decision_function(candidates.reshape(-1, 1))
+                  if len(candidates) else np.empty(0))
+
+        # === DETECCIÓN: ambos métodos deben coincidir ===
+        closed = []
+        position = 0
+        for (device_id, state, segment_times, current, z_scores, _), mask in zip(segments, flagged):
+            ml_scores = np.full(len(current), np.inf)
+            count = int(mask.sum())
+            ml_scores[mask] = scores[position:position + count]
+            position += count
+            is_anomaly = mask & (ml_scores < anomaly_detection.ML_SCORE_THRESHOLD)
+            self.evaluated += len(current)
+            closed.extend(self._update_events(device_id, state, is_anomaly, segment_times,
+                                              current, z_scores, ml_scores))
+        return closed
+
+    def _train(self, standardized):
+        if len(standardized) > self.max_train_samples:
+            rng = np.random.default_rng(42)
+            standardized = rng.choice(standardized, self.max_train_samples, replace=False)
+        logger.info("🤖 Entrenando modelo de backfill con %s lecturas", len(standardized))
+        return model_training.fit_isolation_forest(standardized)
+
+    def _update_events(self, device_id, state, is_anomaly, timestamps, temperatures, z_scores, ml_scores):
+        """Convierte las rachas de lecturas anómalas del tramo en eventos"""
+        closed = []
+        edges = np.diff(np.concatenate(([0], is_anomaly.view(np.int8), [0])))
+        starts = np.flatnonzero(edges == 1)
+        stops = np.flatnonzero(edges == -1)
+        if state.event is not None and not is_anomaly[0]:
+            # La racha del bloque anterior terminó con la primera lectura de este
+            closed.append(self._close(state.event, timestamps[0]))
+            state.event = None
+        for start, stop in zip(starts, stops):
+            if state.event is None:
+                state.event = {
+                    'device_id': device_id, 'started_at': timestamps[start], 'sample_count': 0,
+                    'peak_temperature': 0.0, 'max_abs_z': -1.0, 'min_ml_score': np.inf,
+                }
+            event = state.event
+            peak = start + int(np.argmax(np.abs(z_scores[start:stop])))
+            if abs(z_scores[peak]) > event['max_abs_z']:
+                event['max_abs_z'] = abs(z_scores[peak])
+                event['peak_temperature'] = temperatures[peak]
+            event['min_ml_score'] = min(event['min_ml_score'], ml_scores[start:stop].min())
+            event['sample_count'] += int(stop - start)
+            event['ended_at'] = timestamps[stop - 1]
+            if stop < len(is_anomaly):
+                closed.append(self._close(event, timestamps[stop]))
+                state.event = None
+        return closed
+
+    def _close(self, event, recovered_at):
+        duration = float((event['ended_at'] - event['started_at']) / np.timedelta64(1, 's'))
+        return {
+            'run_id': self.run_id,
+            'device_id': event['device_id'],
+            'started_at': event['started_at'].item(),
+            'ended_at': event['ended_at'].item(),
+            'recovered_at': None if recovered_at is None else recovered_at.item(),
+            'duration_seconds': duration,
+            'sample_count': event['sample_count'],
+            'peak_temperature': float(event['peak_temperature']),
+            'max_abs_z': float(event['max_abs_z']),
+            'min_ml_score': float(event['min_ml_score']),
+            'severity': CRITICAL if duration >= self.duration_threshold else TEMPORARY,
+            'z_threshold': self.z_threshold,
+            'window_size': self.window_size,
+        }
+
+    def finish(self):
+        """Cierra las rachas que siguen abiertas al final del rango (sin hora de recuperación)"""
+        closed = []
+        for state in self.devices.values():
+            if state.event is not None:
+                closed.append(self._close(state.event, None))
+                state.event = None
+        return closed
+
+
+def run_backfill(db, detector=None, start=None, end=None, device_id=None, chunk_size=None,
+                 dry_run=False, replace=False):
+    """Recorre [start, end) y guarda los eventos en anomaly_events; retorna un resumen"""
+    detector = detector or BackfillDetector()
+    if replace and not dry_run:
+        db.delete_anomaly_events(detector.run_id)
+    started = time.perf_counter()
+    found = {TEMPORARY: 0, CRITICAL: 0}
+
+    def save(anomaly_events):
+        for event in anomaly_events:
+            found[event['severity']] += 1
+        if anomaly_events and not dry_run and not db.insert_anomaly_events(anomaly_events):
+            raise RuntimeError("No se pudieron guardar los eventos de anomalía")
+
+    try:
+        for chunk in db.iter_samples(start, end, device_id, chunk_size):
+            save(detector.process_chunk(chunk))
+            elapsed = time.perf_counter() - started
+            logger.info("📊 %s filas (%s/min), %s eventos",
+                        detector.rows, format(detector.rows / elapsed * 60, ',.0f'), sum(found.values()))
+    except Exception as e:
+        # Los eventos ya guardados cubren solo parte del rango
+        logger.error("✗ Backfill %s interrumpido tras %s filas (repetir con --run-id %s --replace): %s",
+                     detector.run_id, detector.rows, detector.run_id, e)
+        raise
+    save(detector.finish())
+
+    elapsed = time.perf_counter() - started
+    return {
+        'run_id': detector.run_id,
+        'rows': detector.rows,
+        'evaluated': detector.evaluated,
+        'devices': len(detector.devices),
+        'temporary_events': found[TEMPORARY],
+        'critical_events': found[CRITICAL],
+        'seconds': elapsed,
+        'rows_per_minute': detector.rows / elapsed * 60 if elapsed else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-evalúa anomalías sobre los datos guardados")
+    parser.add_argument('--start', type=datetime.fromisoformat, help="Inicio del rango (ISO, p. ej. 2025-01-01)")
+    parser.add_argument('--end', type=datetime.fromisoformat, help="Fin del rango, excluido")
+    parser.add_argument('--device', help="Solo este dispositivo")
+    parser.add_argument('--window', type=int, help="Lecturas por ventana (ANOMALY_WINDOW_SIZE)")
+    parser.add_argument('--z-threshold', type=float, help="Umbral de z-score (ANOMALY_Z_THRESHOLD)")
+    parser.add_argument('--duration', type=float,
+                        help="Seg. para considerar una anomalía sostenida (ANOMALY_DURATION_THRESHOLD)")
+    parser.add_argument('--chunk-size', type=int, help="Filas por bloque (BACKFILL_CHUNK_SIZE)")
+    parser.add_argument('--run-id', help="Identificador de la corrida en anomaly_events")
+    parser.add_argument('--replace', action='store_true', help="Borra antes los eventos del mismo run-id")
+    parser.add_argument('--dry-run', action='store_true', help="Solo cuenta los eventos, no los guarda")
+    parser.add_argument('--backend', choices=('mysql', 'sqlite'), help="Backend (por defecto DB_BACKEND)")
+    args = parser.parse_args(argv)
+
+    db = db_handler.create_db_handler(args.backend)
+    detector = BackfillDetector(args.window, args.z_threshold, args.duration, run_id=args.run_id)
+    try:
+        summary = run_backfill(db, detector, args.start, args.end, args.device, args.chunk_size,
+                               dry_run=args.dry_run, replace=args.replace)
+    finally:
+        db.close()
+
+    print(f"✓ Backfill {summary['run_id']}: {summary['rows']:,} filas de {summary['devices']} dispositivos "
+          f"en {summary['seconds']:.1f}s ({summary['rows_per_minute']:,.0f} filas/min)")
+    print(f"   {summary['temporary_events']} eventos temporales, {summary['critical_events']} críticos"
+          + (" (sin guardar)" if args.dry_run else ""))
+    return summary
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+# benchmark.py: Generador de carga y benchmark del pipeline de ingestión (sin broker ni MySQL)
+
+import argparse
+import json
+import logging
+import math
+import random
+import sys
+import time
+import tracemalloc
+import config
+import db_handler
+import metrics
+import payload_codec
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class FakeMessage:
+    """Imita a paho.mqtt.client.MQTTMessage (solo lo que usa on_message)"""
+    __slots__ = ('topic', 'payload')
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class FakeBroker:
+    """Entrega mensajes llamando directo a MQTTClient.on_message, en el hilo del llamador"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def publish(self, topic, payload):
+        self.client.on_message(None, None, FakeMessage(topic, payload))
+
+
+class MemoryStore(db_handler.StorageBackend):
+    """Backend que descarta las filas: mide el pipeline sin el costo de la base"""
+
+    name = "memory"
+
+    def insert_temperature(self, device_id, temperature):
+        return True
+
+    def insert_samples(self, samples):
+        db_handler.record_batch_metrics(samples, 0.0)
+        return True
+
+    def get_historical_data(self, start_date=None, end_date=None):
+        return []
+
+    def get_historical_page(self, start_date=None, end_date=None, after=None,
+                            limit=500, device_id=None):
+        return []
+
+    def get_series(self, device_id, start, end, max_points=2000):
+        return db_handler.choose_resolution(start, end, max_points), []
+
+    def iter_samples(self, start=None, end=None, device_id=None, chunk_size=None):
+        return iter(())
+
+    def iter_export(self, start=None, end=None, device_id=None, chunk_size=None):
+        return iter(())
+
+    def insert_anomaly_events(self, anomaly_events):
+        return True
+
+    def delete_anomaly_events(self, run_id):
+        return True
+
+
+def synthetic_messages(devices, count, binary_ratio=0.0, heartbeat_every=4,
+                       anomaly_ratio=0.001, seed=1):
+    """Genera (tópico, payload) de N refrigeradores simulados, intercalando heartbeats"""
+    rng = random.Random(seed)
+    topics = [
+        (config.MQTT_TOPIC_TEMPERATURE.replace('+', f"fridge-{i:05d}"),
+         config.MQTT_TOPIC_HEARTBEAT.replace('+', f"fridge-{i:05d}"))
+        for i in range(devices)
+    ]
+    heartbeat = payload_codec.json_dumps({'status': 'alive'})
+    base = [rng.uniform(2.0, 6.0) for _ in range(devices)]
+    messages = []
+    timestamp = int(time.time())
+    step = 0
+    while len(messages) < count:
+        device = step % devices
+        if device == 0:
+            timestamp += config.SAMPLE_INTERVAL_SECONDS
+        cycle = step // devices
+        temperature = base[device] + 0.5 * math.sin(cycle / 20.0) + rng.gauss(0, 0.1)
+        if rng.random() < anomaly_ratio:
+            temperature += rng.choice((-1, 1)) * rng.uniform(5, 15)
+        reading = payload_codec.SensorReading(
+            None, timestamp, temperature, 1013.25 + rng.gauss(0, 1),
+            120.0, rng.randint(-90, -40), 'ok'
+        )
+        if rng.random() < binary_ratio:
+            payload = payload_codec.encode_binary(reading)
+        else:
+            data = reading.to_dict()
+            del data['device_id'], data['received_at']
+            payload = payload_codec.json_dumps(data)
+        messages.append((topics[device][0], payload))
+        if heartbeat_every and cycle % heartbeat_every == 0:
+            messages.append((topics[device][1], heartbeat))
+        step += 1
+    return messages[:count]
+
+
+def recorded_messages(path):
+    """Lee payloads grabados: una línea JSON por mensaje con 'topic' y 'payload' (objeto) o 'payload_hex'"""
+    messages = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if 'payload_hex' in record:
+                payload = bytes.fromhex(record['payload_hex'])
+            else:
+                payload = payload_codec.json_dumps(record['payload'])
+            messages.append((record['topic'], payload))
+    return messages
+
+
+def replay(broker, messages, rate=0):
+    """Publica los mensajes a 'rate' mensajes/seg (0 = lo más rápido posible)"""
+    started = time.perf_counter()
+    if rate <= 0:
+        publish = broker.publish
+        for topic, payload in messages:
+            publish(topic, payload)
+    else:
+        interval = 1.0 / rate
+        for i, (topic, payload) in enumerate(messages):
+            delay = started + i * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            broker.publish(topic, payload)
+    return time.perf_counter() - started
+
+
+def memory_usage():
+    """(RSS actual, RSS máximo) en MB, o None si la plataforma no lo expone"""
+    current = peak = None
+    try:
+        with open('/proc/self/statm') as f:
+            current = int(f.read().split()[1]) * 4096 / 1e6
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak = peak / 1e6 if sys.platform == 'darwin' else peak / 1e3
+    return current, peak
+
+
+def latency_summary(histogram):
+    return {
+        'count': histogram.count,
+        'p50_ms': histogram.percentile(0.5) * 1000,
+        'p90_ms': histogram.percentile(0.9) * 1000,
+        'p99_ms': histogram.percentile(0.99) * 1000,
+        'p999_ms': histogram.percentile(0.999) * 1000,
+        'max_ms': histogram.max * 1000,
+    }
+
+
+def run_benchmark(messages, store, rate=0, drain_timeout=60.0, trace_memory=False):
+    """Ejecuta el pipeline completo (MQTT -> bus -> anomalías/DB) con un broker falso"""
+    import mqtt_client
+    import pipeline
+
+    if trace_memory:
+        tracemalloc.start()
+    rss_before, _ = memory_usage()
+
+    ingestion = pipeline.Pipeline(db=store)
+    ingestion.start(connect_mqtt=False)
+    broker = FakeBroker(ingestion.mqtt_instance)
+    sensor_messages = sum(1 for topic, _ in messages if topic.endswith('sensor_data'))
+
+    started = time.perf_counter()
+    publish_seconds = replay(broker, messages, rate)
+
+    # Espera a que las etapas vacíen el bus y el escritor guarde todo lo que no se descartó
+    deadline = time.monotonic() + drain_timeout
+    while time.monotonic() < deadline:
+        expected = sensor_messages - ingestion.db_subscription.dropped
+        idle = all(stage['processed'] + stage['dropped'] >= sensor_messages
+                   for stage in ingestion.stage_stats())
+        if db_handler.db_rows_written.value >= expected and idle:
+            break
+        time.sleep(0.01)
+    total_seconds = time.perf_counter() - started
+
+    rss_after, rss_peak = memory_usage()
+    traced_peak = None
+    if trace_memory:
+        traced_peak = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+    stages = ingestion.stage_stats()
+    rows_written = db_handler.db_rows_written.value
+    ingestion.stop()
+
+    return {
+        'messages': len(messages),
+        'sensor_messages': sensor_messages,
+        'devices': len(ingestion.mqtt_instance.devices),
+        'store': store.name,
+        'rows_written': rows_written,
+        'db_batches': db_handler.db_batch_size.count,
+        'publish_seconds': publish_seconds,
+        'total_seconds': total_seconds,
+        'ingest_rate': len(messages) / publish_seconds if publish_seconds else 0.0,
+        'throughput': rows_written / total_seconds if total_seconds else 0.0,
+        'decode_errors': mqtt_client.decode_errors.value,
+        'stages': stages,
+        'latency': {
+            'decode': latency_summary(mqtt_client.decode_seconds),
+            'anomaly': latency_summary(metrics.stage_latency("anomaly")),
+            'db_stage': latency_summary(metrics.stage_latency("db")),
+            'end_to_end': latency_summary(metrics.stage_latency("db_write")),
+        },
+        'memory_mb': {
+            'rss_before': rss_before,
+            'rss_after': rss_after,
+            'rss_peak': rss_peak,
+            'traced_peak': traced_peak,
+        },
+        'complete': rows_written >= sensor_messages - ingestion.db_subscription.dropped,
+    }
+
+
+def print_report(result):
+    print("=" * 60)
+    print("BENCHMARK DEL PIPELINE DE INGESTIÓN")
+    print("=" * 60)
+    print(f"Mensajes: {result['messages']} ({result['sensor_messages']} sensor_data) "
+          f"de {result['devices']} dispositivos")
+    print(f"Publicación: {result['publish_seconds']:.2f} s ({result['ingest_rate']:,.0f} msg/s)")
+    print(f"Guardado ({result['store']}): {result['rows_written']} filas en {result['db_batches']} lotes, "
+          f"{result['total_seconds']:.2f} s ({result['throughput']:,.0f} lecturas/s)")
+    if result['decode_errors']:
+        print(f"⚠ Errores de decodificación: {result['decode_errors']}")
+    for stage in result['stages']:
+        print(f"  Etapa {stage['name']}: {stage['processed']} procesados, {stage['batches']} lotes, "
+              f"{stage['errors']} errores, {stage['dropped']} descartados")
+    print("\nLatencias (ms):")
+    print(f"  {'':<12}{'p50':>9}{'p90':>9}{'p99':>9}{'p99.9':>9}{'máx':>9}")
+    for name, lat in result['latency'].items():
+        print(f"  {name:<12}{lat['p50_ms']:>9.2f}{lat['p90_ms']:>9.2f}{lat['p99_ms']:>9.2f}"
+              f"{lat['p999_ms']:>9.2f}{lat['max_ms']:>9.2f}")
+    memory = result['memory_mb']
+    print("\nMemoria (MB):")
+    for name, value in memory.items():
+        if value is not None:
+            print(f"  {name}: {value:.1f}")
+    print("✓ Todas las lecturas llegaron a la DB" if result['complete']
+          else "✗ El pipeline no terminó de vaciarse a tiempo")
+
+
+def compare_with_baseline(result, baseline, tolerance):
+    """Retorna la lista de regresiones respecto a un resultado anterior (JSON de --output)"""
+    regressions = []
+    if result['throughput'] < baseline['throughput'] * (1 - tolerance):
+        regressions.append(
+            f"throughput {result['throughput']:,.0f}/s < {baseline['throughput']:,.0f}/s"
+        )
+    current_p99 = result['latency']['end_to_end']['p99_ms']
+    baseline_p99 = baseline['latency']['end_to_end']['p99_ms']
+    if current_p99 > baseline_p99 * (1 + tolerance):
+        regressions.append(f"p99 end-to-end {current_p99:.1f} ms > {baseline_p99:.1f} ms")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark del pipeline de ingestión")
+    parser.add_argument('--devices', type=int, default=1000, help="Refrigeradores simulados")
+    parser.add_argument('--messages', type=int, default=200000, help="Mensajes a publicar")
+    parser.add_argument('--rate', type=float, default=0, help="Mensajes/seg (0 = sin límite)")
+    parser.add_argument('--binary', type=float, default=0.0, help="Fracción de tramas binarias")
+    parser.add_argument('--heartbeat-every', type=int, default=4,
+                        help="Un heartbeat cada N lecturas por dispositivo (0 = ninguno)")
+    parser.add_argument('--anomalies', type=float, default=0.001, help="Fracción de lecturas anómalas")
+    parser.add_argument('--replay', help="Archivo JSONL con mensajes grabados")
+    parser.add_argument('--store', choices=('memory', 'sqlite'), default='memory')
+    parser.add_argument('--sqlite-path', default=":memory:", help="Archivo SQLite (por defecto en memoria)")
+    parser.add_argument('--spool', action='store_true', help="Usa el spool en disco antes de la DB")
+    parser.add_argument('--overflow-policy', default="block",
+                        help="Política del bus durante el benchmark (block mide sin descartes)")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="Mide el pico de memoria con tracemalloc (más lento)")
+    parser.add_argument('--log-level', default="WARNING", help="Nivel de logging durante la corrida")
+    parser.add_argument('--output', help="Guarda el resultado en JSON")
+    parser.add_argument('--baseline', help="JSON de una corrida anterior para detectar regresiones")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Regresión tolerada (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    # El benchmark no expone métricas por HTTP ni toca el spool de producción
+    config.METRICS_ENABLED = False
+    config.METRICS_FILE = None
+    config.MQTT_ASYNC = False  # El broker falso llama a on_message en el hilo del generador
+    logging.getLogger().setLevel(args.log_level.upper())
+    config.SPOOL_ENABLED = args.spool
+    config.BUS_OVERFLOW_POLICY = args.overflow_policy
+    if args.spool:
+        import tempfile
+        config.SPOOL_DIR = tempfile.mkdtemp(prefix="bench-spool-")
+
+    if args.replay:
+        messages = recorded_messages(args.replay)
+    else:
+        messages = synthetic_messages(args.devices, args.messages, args.binary,
+                                      args.heartbeat_every, args.anomalies)
+    if args.store == 'sqlite':
+        import sqlite_backend
+        store = sqlite_backend.SQLiteHandler(args.sqlite_path)
+    else:
+        store = MemoryStore()
+
+    result = run_benchmark(messages, store, args.rate, trace_memory=args.trace_memory)
+    print_report(result)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_with_baseline(result, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"✗ Regresión: {regression}")
+        if regressions:
+            return 1
+    return 0 if result['complete'] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
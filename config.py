@@ -5,14 +5,55 @@ MQTT_BROKER = "192.168.0.2"  # Cambia a tu host real
 MQTT_PORT = 1883
 MQTT_USERNAME = None  # Si requiere auth, agrega usuario
 MQTT_PASSWORD = None  # Si requiere auth, agrega password
-MQTT_TOPIC_TEMPERATURE = "fridge/esp32-fridge-001/sensor_data"
-MQTT_TOPIC_HEARTBEAT = "fridge/esp32-fridge-001/heartbeat"
+# Suscripciones con comodín: el '+' corresponde al device_id de cada refrigerador
+MQTT_TOPIC_TEMPERATURE = "fridge/+/sensor_data"
+MQTT_TOPIC_HEARTBEAT = "fridge/+/heartbeat"
+# Núcleo asyncio: el socket lo atiende un event loop propio en vez del hilo de paho
+MQTT_ASYNC = True
+MQTT_INGEST_QUEUE_SIZE = 10000  # Mensajes crudos en espera de decodificar (cola acotada)
+MQTT_INGEST_LOW_WATERMARK = 0.5  # Fracción de la cola bajo la que se reanuda la lectura del socket
+MQTT_DECODE_BATCH = 256  # Mensajes decodificados por turno antes de ceder el loop
+MQTT_RECONNECT_BASE_DELAY = 0.5  # Seg. del primer reintento de conexión al broker (se duplica)
+MQTT_RECONNECT_MAX_DELAY = 30  # Tope del backoff de reconexión al broker (seg.)
+
+# Backend de almacenamiento: "mysql" (servidor MariaDB/MySQL) o "sqlite" (embebido, sin servicios externos)
+DB_BACKEND = "mysql"
+SQLITE_PATH = "refrigerator.db"  # Archivo de la base embebida (modo WAL)
 
 # Base de Datos MariaDB/MySQL
 DB_HOST = "localhost"  # O "127.0.0.1"
 DB_USER = "root"
 DB_PASSWORD = "7843"  #
 DB_NAME = "refrigerator_db"
+DB_WRITER_POOL_SIZE = 2  # Conexiones para ingestión (inserciones por lote)
+DB_READER_POOL_SIZE = 3  # Conexiones para consultas (GUI, reportes)
+DB_RECONNECT_ATTEMPTS = 5  # Reintentos al perder la conexión
+DB_RECONNECT_BASE_DELAY = 0.5  # Seg. del primer reintento (se duplica en cada intento)
+DB_RECONNECT_MAX_DELAY = 30  # Tope del backoff en segundos
+DB_STARTUP_WAIT = 30  # Seg. que una operación espera a la conexión inicial en segundo plano
+QUERY_CACHE_MAX_ENTRIES = 256  # Consultas históricas cacheadas (LRU)
+QUERY_CACHE_MAX_ROWS = 200000  # Tope de filas en la caché (acota la memoria)
+QUERY_CACHE_OPEN_TTL = 10  # Seg. que vale un rango que incluye el presente (otros procesos insertan)
+EXPORT_CHUNK_SIZE = 50000  # Filas por fetchmany al exportar a CSV/Parquet (export.py)
+
+# Particiones por mes y retención (MySQL: particiones de tabla; SQLite: sensor_samples_YYYYMM)
+DB_PARTITIONS_AHEAD = 3  # Meses futuros con partición creada de antemano
+DB_RETENTION_MONTHS = {  # Meses completos a conservar además del actual (None = sin límite)
+    "sensor_samples": 12,  # Lecturas crudas
+    "sensor_rollup_1m": 24,  # ~4 veces más chico que las crudas
+    "sensor_rollup_1h": 120,
+    "sensor_rollup_1d": None,  # Una fila por dispositivo y día: se conserva siempre
+}
+DB_MAINTENANCE_INTERVAL = 6 * 3600  # Seg. entre ejecuciones del mantenimiento (0 = desactivado)
+DB_MIGRATION_LOCK_TIMEOUT = 600  # Seg. que un proceso espera a que otro termine de migrar el esquema
+
+# Logging y métricas
+LOG_LEVEL = "INFO"  # DEBUG muestra cada lectura recibida
+METRICS_ENABLED = True
+METRICS_HOST = "127.0.0.1"  # "0.0.0.0" expone /metrics (sin autenticación) en todas las interfaces
+METRICS_PORT = 9108  # Endpoint Prometheus en /metrics
+METRICS_FILE = None  # Ruta para volcar métricas a archivo (p. ej. textfile de node_exporter)
+METRICS_DUMP_INTERVAL = 15  # Seg. entre volcados a archivo
 
 # Heartbeat
 HEARTBEAT_INTERVAL = 5
@@ -20,8 +61,45 @@ HEARTBEAT_TIMEOUT = 10
 
 # Guardado en DB
 SAVE_INTERVAL = "hourly"
+DB_BATCH_SIZE = 500  # Filas por lote de INSERT (flush al llegar a N filas...)
+DB_BATCH_INTERVAL_MS = 1000  # ...o al pasar T milisegundos, lo que ocurra primero
+DB_MAX_PENDING_ROWS = 100000  # Sin spool: filas en memoria como máximo (descarta las más viejas)
+SAMPLE_INTERVAL_SECONDS = 15  # Intervalo típico entre lecturas (para elegir resolución)
 
 # Detección de anomalías
 ANOMALY_WINDOW_SIZE = 20  # ~5 min con datos cada 15 seg
 ANOMALY_Z_THRESHOLD = 2.5  # Umbral de Z-score
-ANOMALY_DURATION_THRESHOLD = 120  # 2 min para considerar anomalía sostenida vs temporal
\ No newline at end of file
+ANOMALY_DURATION_THRESHOLD = 120  # 2 min para considerar anomalía sostenida vs temporal
+ANOMALY_MAX_BATCH = 5000  # Máximo de lecturas por micro-lote del detector
+BACKFILL_CHUNK_SIZE = 100000  # Filas por bloque al re-evaluar datos históricos (backfill.py)
+
+# Bus de mensajes (fan-out a GUI, DB y detector de anomalías)
+BUS_BUFFER_SIZE = 1000  # Tamaño del buffer circular por suscriptor
+BUS_OVERFLOW_POLICY = "drop_oldest"  # "drop_oldest", "block" o "coalesce_latest"
+BUS_BLOCK_TIMEOUT = 1.0  # Seg. máximos de espera con la política "block"
+
+# Gráfico en tiempo real
+PLOT_WINDOW_SECONDS = 24 * 3600  # Ventana visible (24 h)
+PLOT_BUFFER_POINTS = 86400  # Puntos por serie (24 h a 1 Hz)
+PLOT_MAX_DEVICES = 10  # Dispositivos graficados como máximo
+PLOT_MAX_FPS = 10  # Redibujados por segundo como máximo
+
+# Reentrenamiento de modelos ML (en un pool de procesos)
+MODEL_RETRAIN_INTERVAL = 60  # Seg. entre reentrenamientos de cada modelo
+MODEL_STALENESS_BUDGET = 300  # Seg. usando un modelo viejo antes de pedir otro fuera de calendario
+MODEL_TRAINING_WORKERS = 1  # Procesos del pool de entrenamiento
+
+# Spool local en disco (write-ahead) entre MQTT y la DB
+SPOOL_ENABLED = True
+SPOOL_DIR = "spool"  # Directorio de segmentos y offsets
+SPOOL_SEGMENT_SIZE = 16 * 1024 * 1024  # Bytes por segmento (rota al llenarse)
+SPOOL_FSYNC = True  # Sincroniza a disco en cada lote (más seguro ante cortes de energía)
+
+# Modo multiproceso (headless): un supervisor recibe MQTT y reparte por dispositivo entre workers
+SHARD_WORKERS = 1  # Procesos worker (1 = todo en un solo proceso, sin supervisor)
+SHARD_RING_SIZE = 8 * 1024 * 1024  # Bytes del anillo en memoria compartida de cada worker
+SHARD_VIRTUAL_NODES = 64  # Puntos por worker en el hash consistente
+SHARD_READ_BATCH = 256  # Mensajes que un worker toma del anillo por vuelta
+SHARD_POLL_INTERVAL = 0.05  # Seg. máximos que un worker duerme sin aviso del supervisor
+SHARD_HEALTH_INTERVAL = 2  # Seg. entre reportes de estado de cada worker
+SHARD_HEALTH_TIMEOUT = 15  # Seg. sin reportes tras los que se reinicia un worker
@@ -2,21 +2,37 @@
 
 from PyQt6.QtWidgets import (QWidget, QVBoxLayout, QLabel, QTabWidget, 
                               QMessageBox, QMainWindow, QDateEdit, QPushButton, 
-                              QHBoxLayout, QTableWidget, QTableWidgetItem)
-from PyQt6.QtCore import QTimer, QDate
+                              QHBoxLayout, QTableView, QComboBox)
+from PyQt6.QtCore import QTimer, QDate, QObject, pyqtSignal
 from PyQt6.QtGui import QFont
 import queue
 import datetime
 import db_handler
+import message_bus
 import mqtt_client
+import utils
 import widgets
 
+logger = utils.get_logger(__name__)
+
+class AlertBridge(QObject):
+    """Reenvía las alertas (events.Signal, emitidas desde hilos de trabajo) al hilo de la GUI"""
+    mqtt_alert = pyqtSignal(str)
+    anomaly_alert = pyqtSignal(str)
+    db_state = pyqtSignal(str, str)  # (estado, detalle) de db_handler.DeferredStorage
+
 class Dashboard(QMainWindow):
+    ALL_DEVICES = "Todos"
+
     def __init__(self, mqtt_client_instance, anomaly_detector, db_instance):
         super().__init__()
         self.mqtt_client = mqtt_client_instance
         self.anomaly_detector = anomaly_detector
         self.db = db_instance
+        # Suscripción propia al bus: la GUI ve todas las lecturas sin competir con DB/anomalías
+        self.temperature_subscription = mqtt_client.temperature_bus.subscribe(
+            "dashboard", policy=message_bus.DROP_OLDEST
+        )
         
         self.setWindowTitle("Refrigerator Monitor Dashboard")
         self.setGeometry(100, 100, 1000, 700)
@@ -42,6 +58,7 @@ class Dashboard(QMainWindow):
         self.alert_label = QLabel("⚠️ Alertas: Ninguna")
         self.alert_label.setStyleSheet("color: green; font-weight: bold; font-size: 12pt;")
         self.save_label = QLabel("💾 Último guardado en DB: N/A")
+        self.db_label = QLabel("🗄️ DB: Conectando...")
         
         # Gráfico de temperatura
         self.plot = widgets.TemperaturePlot()
@@ -52,6 +69,7 @@ class Dashboard(QMainWindow):
         self.dashboard_layout.addWidget(self.status_label)
         self.dashboard_layout.addWidget(self.alert_label)
         self.dashboard_layout.addWidget(self.save_label)
+        self.dashboard_layout.addWidget(self.db_label)
         self.dashboard_layout.addWidget(self.plot)
         
         self.tabs.addTab(self.dashboard_tab, "📊 Dashboard")
@@ -70,24 +88,35 @@ class Dashboard(QMainWindow):
         self.end_date_edit.setCalendarPopup(True)
         self.end_date_edit.setDate(QDate.currentDate())
         
-        load_button = QPushButton("🔍 Cargar Datos")
-        load_button.clicked.connect(self.load_historical_data)
+        # Dispositivo: los vistos en vivo; "Todos" grafica cada uno (hasta PLOT_MAX_DEVICES)
+        self.device_combo = QComboBox()
+        self.device_combo.setEditable(True)
+        self.device_combo.addItem(self.ALL_DEVICES)
+        self.known_devices = set()
+
+        self.load_button = QPushButton("🔍 Cargar Datos")
+        self.load_button.clicked.connect(self.load_historical_data)
         
         filter_layout.addWidget(QLabel("Desde:"))
         filter_layout.addWidget(self.start_date_edit)
         filter_layout.addWidget(QLabel("Hasta:"))
         filter_layout.addWidget(self.end_date_edit)
-        filter_layout.addWidget(load_button)
+        filter_layout.addWidget(QLabel("Dispositivo:"))
+        filter_layout.addWidget(self.device_combo)
+        filter_layout.addWidget(self.load_button)
         filter_layout.addStretch()
         
         self.historical_layout.addLayout(filter_layout)
+
+        # Gráfico del rango (resolución elegida por la DB según el ancho)
+        self.historical_plot = widgets.HistoricalPlot(self.db)
+        self.historical_layout.addWidget(self.historical_plot)
         
-        # Tabla de datos
-        self.historical_table = QTableWidget()
-        self.historical_table.setColumnCount(4)
-        self.historical_table.setHorizontalHeaderLabels([
-            "ID", "Device ID", "Fecha/Hora", "Temperatura (°C)"
-        ])
+        # Tabla de datos (virtualizada: carga páginas al hacer scroll)
+        self.historical_model = widgets.HistoricalTableModel(self.db, parent=self)
+        self.historical_model.loaded.connect(self.on_historical_loaded)
+        self.historical_table = QTableView()
+        self.historical_table.setModel(self.historical_model)
         self.historical_table.setColumnWidth(0, 50)
         self.historical_table.setColumnWidth(1, 150)
         self.historical_table.setColumnWidth(2, 200)
@@ -103,69 +132,112 @@ class Dashboard(QMainWindow):
         self.update_timer.start(500)  # Actualiza cada 500ms
         
         # === Conecta signals para alertas ===
-        self.mqtt_client.alert_signal.connect(self.show_alert)
-        self.anomaly_detector.alert_signal.connect(self.show_anomaly_alert)
+        # El bridge vive en el hilo de la GUI: emitir desde otro hilo usa conexión encolada
+        self.alert_bridge = AlertBridge(self)
+        self.alert_bridge.mqtt_alert.connect(self.show_alert)
+        self.alert_bridge.anomaly_alert.connect(self.show_anomaly_alert)
+        self.mqtt_client.alert_signal.connect(self.alert_bridge.mqtt_alert.emit)
+        self.anomaly_detector.alert_signal.connect(self.alert_bridge.anomaly_alert.emit)
+        self.alert_bridge.db_state.connect(self.on_db_state)
+
+        # Estado de la conexión a la DB (si se conecta en segundo plano)
+        if isinstance(self.db, db_handler.DeferredStorage):
+            self.db.state_changed.connect(self.alert_bridge.db_state.emit)
+            # Por si se conectó antes de suscribirse
+            self.on_db_state(self.db.state, self.db.name if self.db.ready.is_set() else "")
+        else:
+            self.on_db_state(db_handler.DeferredStorage.READY, self.db.name or "")
         
         self.current_status = "offline"
+        self.device_status = {}  # device_id -> "online" | "offline"
         self.last_alert_message = ""
 
+    def on_db_state(self, state, detail):
+        """Muestra el estado de la conexión a la DB y habilita las consultas al conectar"""
+        if state == db_handler.DeferredStorage.READY:
+            self.db_label.setText(f"🗄️ DB: ✅ Conectada ({detail})")
+            self.db_label.setStyleSheet("color: green;")
+        elif state == db_handler.DeferredStorage.RETRYING:
+            self.db_label.setText(f"🗄️ DB: ❌ Sin conexión, reintentando... ({detail})")
+            self.db_label.setStyleSheet("color: red;")
+        else:
+            self.db_label.setText("🗄️ DB: ⏳ Conectando...")
+            self.db_label.setStyleSheet("color: orange;")
+        self.load_button.setEnabled(state == db_handler.DeferredStorage.READY)
+
     def load_historical_data(self):
-        """Carga datos históricos desde la DB"""
+        """Carga datos históricos desde la DB (por páginas, fuera del hilo de la GUI)"""
         start_date = self.start_date_edit.date().toPyDate()
         end_date = self.end_date_edit.date().toPyDate()
-        
-        data = self.db.get_historical_data(start_date=start_date, end_date=end_date)
-        
-        self.historical_table.setRowCount(len(data))
-        for row, item in enumerate(data):
-            self.historical_table.setItem(row, 0, QTableWidgetItem(str(item['id'])))
-            self.historical_table.setItem(row, 1, QTableWidgetItem(item['device_id']))
-            self.historical_table.setItem(row, 2, QTableWidgetItem(str(item['timestamp'])))
-            self.historical_table.setItem(row, 3, QTableWidgetItem(f"{item['temperature']:.2f}"))
-        
-        print(f"✓ Cargados {len(data)} registros históricos")
+        device_id = self.device_combo.currentText().strip()
+        if device_id in ("", self.ALL_DEVICES):
+            device_id = None
+
+        self.historical_model.set_query(start_date, end_date, device_id)
+        devices = [device_id] if device_id else sorted(self.known_devices)
+        self.historical_plot.set_query(start_date, end_date, devices)
+
+    def remember_device(self, device_id):
+        """Agrega un dispositivo visto en vivo al filtro del histórico"""
+        if device_id not in self.known_devices:
+            self.known_devices.add(device_id)
+            self.device_combo.addItem(device_id)
+
+    def on_historical_loaded(self, count, has_more):
+        suffix = " (desplázate para cargar más)" if has_more else ""
+        logger.info("✓ Cargados %s registros históricos%s", count, suffix)
 
     def update_ui(self):
         """Actualiza la interfaz con nuevos datos"""
-        # Actualiza temperatura desde la queue
-        try:
-            data = mqtt_client.temperature_queue.get_nowait()
-            temp = data['temperature']
-            rssi = data['rssi']
-            status = data['status']
-            
-            self.temp_label.setText(f"🌡️ Temperatura actual: {temp}°C")
-            self.rssi_label.setText(f"📶 RSSI: {rssi} dBm")
+        # Actualiza temperatura con todas las lecturas pendientes del bus
+        readings = self.temperature_subscription.drain()
+        if readings:
+            for data in readings:
+                self.plot.add_reading(data)
+                self.remember_device(data.device_id)
             
-            # Actualiza gráfico
-            self.plot.update_plot(temp)
-        except queue.Empty:
-            pass
-        
-        # Actualiza status de heartbeat
-        try:
-            hb_status = mqtt_client.heartbeat_status_queue.get_nowait()
-            self.current_status = hb_status
+            latest = readings[-1]
+            self.temp_label.setText(
+                f"🌡️ Temperatura actual [{latest.device_id}]: {latest.temperature}°C"
+            )
+            self.rssi_label.setText(f"📶 RSSI: {latest.rssi} dBm")
+        
+        # Actualiza status de heartbeat (por dispositivo)
+        status_changed = False
+        while True:
+            try:
+                device_id, hb_status = mqtt_client.heartbeat_status_queue.get_nowait()
+            except queue.Empty:
+                break
+            self.device_status[device_id] = hb_status
+            self.remember_device(device_id)
+            status_changed = True
+
+        if status_changed:
+            offline = sum(1 for st in self.device_status.values() if st != "online")
+            online = len(self.device_status) - offline
+            self.current_status = "online" if offline == 0 else "offline"
             
-            if hb_status == "online":
-                self.status_label.setText("🔌 Status: ✅ Online")
+            if offline == 0:
+                self.status_label.setText(f"🔌 Status: ✅ Online ({online} dispositivos)")
                 self.status_label.setStyleSheet("color: green;")
                 # Limpia alerta de offline si había
                 if "offline" in self.last_alert_message.lower():
                     self.alert_label.setText("⚠️ Alertas: Ninguna")
                     self.alert_label.setStyleSheet("color: green; font-weight: bold; font-size: 12pt;")
             else:
-                self.status_label.setText("🔌 Status: ❌ Offline")
+                self.status_label.setText(f"🔌 Status: ❌ {offline} offline / ✅ {online} online")
                 self.status_label.setStyleSheet("color: red;")
-        except queue.Empty:
-            pass
 
-        # Chequea notificaciones de guardado en DB
-        try:
-            save_ts = db_handler.save_queue.get_nowait()
+        # Chequea notificaciones de guardado en DB (muestra la más reciente)
+        save_ts = None
+        while True:
+            try:
+                save_ts = db_handler.save_queue.get_nowait()
+            except queue.Empty:
+                break
+        if save_ts is not None:
             self.save_label.setText(f"💾 Último guardado en DB: {save_ts}")
-        except queue.Empty:
-            pass
 
     def show_alert(self, message):
         """Muestra alerta de dispositivo offline"""
@@ -1,116 +1,1248 @@
-# db_handler.py: Lógica de base de datos MySQL
+# db_handler.py: Lógica de base de datos (interfaz de almacenamiento y backend MySQL)
 
-import mysql.connector
-from mysql.connector import Error
 from datetime import datetime
+import abc
+import contextlib
 import queue
+import threading
+import time
 import config
+import events
+import metrics
+import query_cache
+import utils
 
-# Queue global para notificar a la GUI cuando se guarda en DB
-save_queue = queue.Queue()
+logger = utils.get_logger(__name__)
+
+# mysql.connector se importa al crear el primer DBHandler: no pesa en el arranque
+# y no hace falta instalarlo con DB_BACKEND = "sqlite"
+mysql = None
+
+def _import_mysql():
+    global mysql, Error, pooling, InterfaceError, OperationalError, PoolError
+    if mysql is None:
+        import mysql.connector
+        from mysql.connector import Error, pooling
+        from mysql.connector.errors import InterfaceError, OperationalError, PoolError
+
+# Queue global para notificar a la GUI cuando se guarda en DB. Acotada: sin
+# GUI (headless, workers) nadie la vacía y las notificaciones se descartan
+save_queue = queue.Queue(maxsize=100)
+
+def notify_saved(rows):
+    """Avisa a la GUI de un lote guardado (se descarta si la queue está llena)"""
+    try:
+        save_queue.put_nowait(f"{time.strftime('%Y-%m-%d %H:%M:%S')} ({rows} lecturas)")
+    except queue.Full:
+        pass
+
+# Métricas de escritura
+db_batch_size = metrics.registry.histogram("db_batch_size", "Filas por lote insertado", unit_scale=1)
+db_flush_seconds = metrics.registry.histogram("db_flush_seconds", "Duración de cada INSERT por lote")
+db_rows_written = metrics.registry.counter("db_rows_written_total", "Filas insertadas en sensor_samples")
+db_failed_batches = metrics.registry.counter("db_failed_batches_total", "Lotes que fallaron al insertar")
+db_dropped_rows = metrics.registry.counter("db_dropped_rows_total",
+                                           "Lecturas descartadas sin guardar (lote fallido o buffer lleno)")
+db_latency = metrics.stage_latency("db_write")
+db_partitions_dropped = metrics.registry.counter("db_partitions_dropped_total",
+                                                 "Particiones mensuales eliminadas por retención")
+metrics.registry.gauge("save_queue_depth", "Notificaciones de guardado pendientes para la GUI",
+                       fn=save_queue.qsize)
+
+def record_batch_metrics(samples, flush_seconds):
+    """Métricas de un lote insertado con éxito (común a todos los backends)"""
+    db_flush_seconds.record(flush_seconds)
+    db_batch_size.record(len(samples))
+    db_rows_written.inc(len(samples))
+    metrics.record_latencies(db_latency, samples)
+
+# Columnas de sensor_samples que entrega iter_export, en orden
+EXPORT_COLUMNS = ('id', 'device_id', 'timestamp', 'device_timestamp', 'temperature',
+                  'pressure', 'altitude', 'rssi', 'status')
+
+# Resoluciones de rollup: nombre -> (tabla, segundos por bucket, truncado del timestamp)
+ROLLUPS = {
+    '1m': ('sensor_rollup_1m', 60, lambda ts: ts.replace(second=0, microsecond=0)),
+    '1h': ('sensor_rollup_1h', 3600, lambda ts: ts.replace(minute=0, second=0, microsecond=0)),
+    '1d': ('sensor_rollup_1d', 86400, lambda ts: ts.replace(hour=0, minute=0, second=0, microsecond=0)),
+}
+
+# Rollups que se parten por mes y tienen retención propia; 1d es chico y se conserva entero
+PARTITIONED_ROLLUPS = ('1m', '1h')
+
+def choose_resolution(start, end, max_points):
+    """Elige la resolución más fina cuyo número de puntos en [start, end) cabe en max_points.
+
+    Se saltean las resoluciones cuya retención ya eliminó el inicio del rango.
+    """
+    span = (end - start).total_seconds()
+    if span / config.SAMPLE_INTERVAL_SECONDS <= max_points and _retains('sensor_samples', start):
+        return 'raw'
+    for name, (table, seconds, _) in ROLLUPS.items():
+        if span / seconds <= max_points and _retains(table, start):
+            return name
+    return '1d'
+
+def _retains(table, start):
+    months = config.DB_RETENTION_MONTHS.get(table)
+    return months is None or start >= retention_cutoff(months)
+
+def aggregate_rollup_rows(rows, truncate):
+    """Agrega filas de sensor_samples en (device_id, bucket, min, max, sum, count, last, last_ts)"""
+    buckets = {}
+    for device_id, ts, _, temperature, *_ in rows:
+        if temperature is None:
+            continue
+        key = (device_id, truncate(ts))
+        bucket = buckets.get(key)
+        if bucket is None:
+            buckets[key] = [temperature, temperature, temperature, 1, temperature, ts]
+        else:
+            if temperature < bucket[0]:
+                bucket[0] = temperature
+            if temperature > bucket[1]:
+                bucket[1] = temperature
+            bucket[2] += temperature
+            bucket[3] += 1
+            if ts >= bucket[5]:
+                bucket[4] = temperature
+                bucket[5] = ts
+    return [key + tuple(values) for key, values in buckets.items()]
+
+# Tablas particionadas por mes en MySQL (RANGE COLUMNS): tabla -> columna de
+# partición. En sensor_samples la clave primaria (device_id, timestamp, id)
+# agrupa físicamente las lecturas de cada dispositivo en orden cronológico; en
+# los rollups ya lo hace (device_id, bucket_start). pmax recibe lo que caiga
+# fuera de las particiones creadas y se divide cuando se agregan meses nuevos
+PARTITIONED_TABLES = {
+    'sensor_samples': 'timestamp',
+    **{ROLLUPS[name][0]: 'bucket_start' for name in PARTITIONED_ROLLUPS},
+}
+
+def month_start(value):
+    return datetime(value.year, value.month, 1)
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+def retention_cutoff(months, now=None):
+    """Inicio del mes más viejo que se conserva (los meses completos anteriores se eliminan)"""
+    return add_months(month_start(now or datetime.now()), -months)
+
+def _partition_clause(month):
+    return f"PARTITION p{month:%Y%m} VALUES LESS THAN ('{add_months(month, 1):%Y-%m-%d}')"
+
+def _partition_names(cursor, table):
+    """Particiones de table en orden (vacío si no está particionada)"""
+    cursor.execute("""
+        SELECT PARTITION_NAME FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL
+        ORDER BY PARTITION_ORDINAL_POSITION
+    """, (config.DB_NAME, table))
+    return [name for (name,) in cursor.fetchall()]
+
+def _partition_months(names):
+    return [datetime.strptime(name[1:], '%Y%m') for name in names if name != 'pmax']
+
+def _migration_base_schema(cursor):
+    # hourly_temperatures es heredada: solo la escribe insert_temperature (API
+    # anterior a sensor_samples, que ya no usa el pipeline). Se conserva para no
+    # perder esos datos, pero queda fuera del mantenimiento de particiones
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS hourly_temperatures (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            device_id VARCHAR(50) NOT NULL,
+            timestamp DATETIME NOT NULL,
+            temperature FLOAT NOT NULL,
+            INDEX idx_timestamp (timestamp),
+            INDEX idx_device (device_id)
+        )
+    """)
+
+    # Tabla de muestras crudas: todas las lecturas con todos sus campos
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sensor_samples (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            device_id VARCHAR(50) NOT NULL,
+            timestamp DATETIME(3) NOT NULL,
+            device_timestamp VARCHAR(32),
+            temperature FLOAT,
+            pressure FLOAT,
+            altitude FLOAT,
+            rssi INT,
+            status VARCHAR(20),
+            INDEX idx_samples_device_ts (device_id, timestamp),
+            INDEX idx_samples_timestamp (timestamp)
+        )
+    """)
+
+    # Tablas de rollup (1 min, 1 h, 1 día) por dispositivo
+    for table, _, _ in ROLLUPS.values():
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                device_id VARCHAR(50) NOT NULL,
+                bucket_start DATETIME NOT NULL,
+                min_temp FLOAT NOT NULL,
+                max_temp FLOAT NOT NULL,
+                sum_temp DOUBLE NOT NULL,
+                sample_count INT NOT NULL,
+                last_temp FLOAT NOT NULL,
+                last_ts DATETIME(3) NOT NULL,
+                PRIMARY KEY (device_id, bucket_start)
+            )
+        """)
+
+    # Eventos de anomalía encontrados al re-evaluar datos históricos (backfill.py)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS anomaly_events (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            run_id VARCHAR(64) NOT NULL,
+            device_id VARCHAR(50) NOT NULL,
+            started_at DATETIME(3) NOT NULL,
+            ended_at DATETIME(3) NOT NULL,
+            recovered_at DATETIME(3),
+            duration_seconds DOUBLE NOT NULL,
+            sample_count INT NOT NULL,
+            peak_temperature FLOAT NOT NULL,
+            max_abs_z FLOAT NOT NULL,
+            min_ml_score FLOAT NOT NULL,
+            severity VARCHAR(20) NOT NULL,
+            z_threshold FLOAT NOT NULL,
+            window_size INT NOT NULL,
+            INDEX idx_anomaly_device_start (device_id, started_at),
+            INDEX idx_anomaly_run (run_id)
+        )
+    """)
+
+def _partition_by_month(cursor, table, column):
+    """Particiona table por mes desde su dato más viejo hasta DB_PARTITIONS_AHEAD meses adelante"""
+    if _partition_names(cursor, table):
+        return
+    cursor.execute(f"SELECT MIN({column}) FROM {table}")
+    oldest = cursor.fetchone()[0]
+    now = month_start(datetime.now())
+    month = month_start(oldest) if oldest is not None and oldest < now else now
+    clauses = []
+    while month <= add_months(now, config.DB_PARTITIONS_AHEAD):
+        clauses.append(_partition_clause(month))
+        month = add_months(month, 1)
+    clauses.append("PARTITION pmax VALUES LESS THAN (MAXVALUE)")
+    cursor.execute(f"ALTER TABLE {table} PARTITION BY RANGE COLUMNS({column}) ({', '.join(clauses)})")
+
+def _migration_monthly_partitions(cursor):
+    """Clave (device_id, timestamp, id) y una partición por mes desde el dato más viejo.
+
+    Reescribe las tablas completas: en una base grande conviene aplicarla en
+    una ventana de mantenimiento. Cada paso verifica el estado actual, así que
+    si se corta a mitad de camino se puede volver a ejecutar.
+    """
+    for table, id_index in (('hourly_temperatures', 'idx_hourly_id'), ('sensor_samples', 'idx_samples_id')):
+        cursor.execute("""
+            SELECT COLUMN_NAME FROM information_schema.STATISTICS
+            WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s AND INDEX_NAME = 'PRIMARY'
+            ORDER BY SEQ_IN_INDEX
+        """, (config.DB_NAME, table))
+        if [column for (column,) in cursor.fetchall()] != ['device_id', 'timestamp', 'id']:
+            # MySQL exige que la columna de partición esté en toda clave única;
+            # id sigue indexado aparte (AUTO_INCREMENT) y el índice por
+            # dispositivo queda cubierto por el prefijo de la clave primaria
+            redundant = 'idx_device' if table == 'hourly_temperatures' else 'idx_samples_device_ts'
+            cursor.execute(f"""
+                ALTER TABLE {table}
+                    DROP PRIMARY KEY,
+                    ADD PRIMARY KEY (device_id, timestamp, id),
+                    ADD INDEX {id_index} (id),
+                    DROP INDEX {redundant}
+            """)
+        _partition_by_month(cursor, table, 'timestamp')
+
+def _migration_rollup_partitions(cursor):
+    """Particiones mensuales de los rollups 1m y 1h (la clave ya incluye bucket_start)"""
+    for name in PARTITIONED_ROLLUPS:
+        _partition_by_month(cursor, ROLLUPS[name][0], 'bucket_start')
+
+# Migraciones del esquema MySQL, en orden: (versión, descripción, función(cursor)).
+# Las aplicadas quedan registradas en schema_migrations; nunca se editan, los
+# cambios nuevos van en una versión nueva al final
+MIGRATIONS = [
+    (1, "Esquema base (lecturas, rollups, eventos de anomalía)", _migration_base_schema),
+    (2, "Particiones mensuales y clave (device_id, timestamp)", _migration_monthly_partitions),
+    (3, "Particiones mensuales de los rollups 1m y 1h", _migration_rollup_partitions),
+]
+
+class StorageBackend(abc.ABC):
+    """Interfaz común de almacenamiento que usan el pipeline, la GUI y los escritores por lote.
+
+    Los métodos de escritura retornan True/False y los de lectura retornan
+    filas como diccionarios (timestamps como datetime); ante un error de la
+    base se registra en el log y se retorna un resultado vacío, sin excepciones.
+    Un backend que no implementa todos los métodos abstractos falla al crearse.
+    """
+
+    name = None
+
+    @abc.abstractmethod
+    def insert_temperature(self, device_id, temperature):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def insert_samples(self, samples):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_historical_data(self, start_date=None, end_date=None):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_historical_page(self, start_date=None, end_date=None, after=None,
+                            limit=500, device_id=None):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_series(self, device_id, start, end, max_points=2000):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def iter_samples(self, start=None, end=None, device_id=None, chunk_size=None):
+        """Recorre las lecturas con temperatura de [start, end) en bloques de hasta chunk_size.
+
+        Cada bloque es una lista de tuplas (id, device_id, timestamp, temperatura),
+        agrupadas por dispositivo y en orden cronológico dentro de cada uno. Los
+        bloques se piden por clave, así que la memoria no depende del rango.
+        Como en iter_export, un error a mitad de camino se propaga: un recorrido
+        truncado no debe parecer completo.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def iter_export(self, start=None, end=None, device_id=None, chunk_size=None):
+        """Todas las columnas (EXPORT_COLUMNS) de [start, end) en orden cronológico, en bloques.
+
+        Una sola consulta cuyo resultado se lee del servidor de a chunk_size
+        filas (fetchmany), sin cargarlo completo en memoria. A diferencia de
+        los demás métodos de lectura, un error a mitad de camino se propaga:
+        un export incompleto no debe parecer terminado.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def insert_anomaly_events(self, anomaly_events):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def delete_anomaly_events(self, run_id):
+        raise NotImplementedError
+
+    def maintain_partitions(self, now=None):
+        """Crea las particiones de los próximos meses y elimina las vencidas (DB_RETENTION_MONTHS).
+
+        Retorna los nombres de las particiones eliminadas; los backends sin
+        particiones no hacen nada.
+        """
+        return []
+
+    def is_available(self):
+        """True si la base responde ahora mismo.
+
+        Tras un insert_samples fallido distingue una caída (reintentar más
+        tarde) de un lote rechazado por sus datos.
+        """
+        return True
+
+    def close(self):
+        pass
+
+def create_db_handler(backend=None):
+    """Crea el backend configurado en DB_BACKEND ("mysql" o "sqlite")"""
+    backend = backend or config.DB_BACKEND
+    if backend == "mysql":
+        return DBHandler()
+    if backend == "sqlite":
+        import sqlite_backend
+        return sqlite_backend.SQLiteHandler()
+    raise ValueError(f"DB_BACKEND desconocido: {backend!r}")
+
+def start_maintenance_job(db, interval=None):
+    """Ejecuta db.maintain_partitions() al iniciar y cada interval seg.; retorna el Event que lo detiene"""
+    interval = interval or config.DB_MAINTENANCE_INTERVAL
+    stop_event = threading.Event()
+
+    def run():
+        while not stop_event.is_set():
+            try:
+                db_partitions_dropped.inc(len(db.maintain_partitions()))
+            except Exception as e:
+                logger.error("✗ Error en el mantenimiento de particiones: %s", e)
+            stop_event.wait(interval)
+
+    threading.Thread(target=run, name="db-maintenance", daemon=True).start()
+    return stop_event
+
+class DeferredStorage(StorageBackend):
+    """Backend que se conecta en segundo plano, para no bloquear el arranque de la GUI.
+
+    El hilo de conexión crea el backend real con factory() (conexión y
+    verificación del esquema) y reintenta con backoff si falla. Mientras
+    tanto las operaciones esperan hasta wait_timeout segundos a que esté
+    listo; si no, fallan como una caída de la DB (False o resultado vacío).
+    state_changed emite (estado, detalle) en cada cambio de estado.
+    """
+
+    CONNECTING = "connecting"
+    RETRYING = "retrying"
+    READY = "ready"
+
+    def __init__(self, factory=None, wait_timeout=None):
+        self.factory = factory or create_db_handler
+        self.wait_timeout = config.DB_STARTUP_WAIT if wait_timeout is None else wait_timeout
+        self.backend = None
+        self.state = self.CONNECTING
+        self.error = None
+        self.connect_seconds = None
+        self.ready = threading.Event()
+        self.state_changed = events.Signal()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="db-connect", daemon=True)
+        self._thread.start()
+
+    @property
+    def name(self):
+        return self.backend.name if self.backend is not None else config.DB_BACKEND
+
+    def _set_state(self, state, detail=""):
+        self.state = state
+        self.state_changed.emit(state, detail)
+
+    def _run(self):
+        started = time.perf_counter()
+        delay = config.DB_RECONNECT_BASE_DELAY
+        while not self._closed.is_set():
+            try:
+                backend = self.factory()
+            except Exception as e:
+                self.error = str(e)
+                logger.warning("⚠ DB no disponible, reintentando en %.1fs: %s", delay, e)
+                self._set_state(self.RETRYING, self.error)
+                if self._closed.wait(delay):
+                    return
+                delay = min(delay * 2, config.DB_RECONNECT_MAX_DELAY)
+                continue
+            self.backend = backend
+            self.connect_seconds = time.perf_counter() - started
+            metrics.registry.gauge("startup_seconds", "Duración de cada etapa del arranque",
+                                   {'stage': 'db_connect'}).set(self.connect_seconds)
+            logger.info("✓ DB lista (%s) en %.2f s", backend.name, self.connect_seconds)
+            self.ready.set()
+            self._set_state(self.READY, backend.name)
+            return
+
+    def _backend(self):
+        if self.ready.wait(self.wait_timeout):
+            return self.backend
+        logger.warning("⚠ DB todavía no conectada, se omite la operación")
+        return None
+
+    def insert_temperature(self, device_id, temperature):
+        backend = self._backend()
+        return False if backend is None else backend.insert_temperature(device_id, temperature)
+
+    def insert_samples(self, samples):
+        backend = self._backend()
+        if backend is None:
+            db_failed_batches.inc()
+            return False
+        return backend.insert_samples(samples)
+
+    def get_historical_data(self, start_date=None, end_date=None):
+        backend = self._backend()
+        return [] if backend is None else backend.get_historical_data(start_date, end_date)
+
+    def get_historical_page(self, start_date=None, end_date=None, after=None,
+                            limit=500, device_id=None):
+        backend = self._backend()
+        if backend is None:
+            return []
+        return backend.get_historical_page(start_date, end_date, after, limit, device_id)
+
+    def get_series(self, device_id, start, end, max_points=2000):
+        backend = self._backend()
+        if backend is None:
+            return choose_resolution(start, end, max_points), []
+        return backend.get_series(device_id, start, end, max_points)
+
+    def iter_samples(self, start=None, end=None, device_id=None, chunk_size=None):
+        backend = self._backend()
+        if backend is None:
+            raise ConnectionError("La DB no está conectada")
+        yield from backend.iter_samples(start, end, device_id, chunk_size)
+
+    def iter_export(self, start=None, end=None, device_id=None, chunk_size=None):
+        backend = self._backend()
+        if backend is None:
+            raise ConnectionError("La DB no está conectada")
+        yield from backend.iter_export(start, end, device_id, chunk_size)
+
+    def insert_anomaly_events(self, anomaly_events):
+        backend = self._backend()
+        return False if backend is None else backend.insert_anomaly_events(anomaly_events)
+
+    def delete_anomaly_events(self, run_id):
+        backend = self._backend()
+        return False if backend is None else backend.delete_anomaly_events(run_id)
+
+    def maintain_partitions(self, now=None):
+        backend = self._backend()
+        return [] if backend is None else backend.maintain_partitions(now)
+
+    def is_available(self):
+        return self.ready.is_set() and self.backend.is_available()
+
+    def close(self):
+        self._closed.set()
+        if self.backend is not None:
+            self.backend.close()
+
+class DBHandler(StorageBackend):
+    """Acceso a MySQL thread-safe con pools separados para escritura y lectura.
+
+    Cada operación toma su propia conexión del pool correspondiente, así una
+    consulta histórica lenta no bloquea las inserciones de ingestión (y al revés).
+    Las conexiones se verifican al tomarlas y se reconectan con backoff exponencial.
+    Las tablas de lecturas están particionadas por mes (ver MIGRATIONS): la
+    retención elimina particiones completas en lugar de borrar fila por fila.
+    """
+
+    name = "mysql"
 
-class DBHandler:
     def __init__(self):
-        self.connection = None
+        try:
+            _import_mysql()
+        except ImportError as e:
+            raise ImportError("mysql-connector-python no está instalado (requerido con DB_BACKEND = 'mysql')") from e
+        self.writer_pool = None
+        self.reader_pool = None
         self.last_saved_hour = None
+        self._hour_lock = threading.Lock()
+        # Resultados de consultas históricas; insert_samples invalida lo afectado
+        self.cache = query_cache.QueryCache()
         self.connect()
         self.create_database_and_table()
+        self.create_pools()
+
+    def _connection_params(self, with_database=True):
+        params = {
+            'host': config.DB_HOST,
+            'user': config.DB_USER,
+            'password': config.DB_PASSWORD,
+        }
+        if with_database:
+            params['database'] = config.DB_NAME
+        return params
 
     def connect(self):
+        """Conexión inicial (sin pool), solo para verificar/crear DB y tablas"""
         try:
-            self.connection = mysql.connector.connect(
-                host=config.DB_HOST,
-                user=config.DB_USER,
-                password=config.DB_PASSWORD,
-                database=config.DB_NAME
-            )
-            print("✓ Conectado a MySQL")
+            connection = mysql.connector.connect(**self._connection_params())
+            logger.info("✓ Conectado a MySQL")
         except Error as e:
             if "Unknown database" in str(e):
                 # Si DB no existe, conecta sin DB para crearla
-                self.connection = mysql.connector.connect(
-                    host=config.DB_HOST,
-                    user=config.DB_USER,
-                    password=config.DB_PASSWORD
-                )
-                print("⚠ DB no existe, se creará automáticamente")
+                connection = mysql.connector.connect(**self._connection_params(with_database=False))
+                logger.warning("⚠ DB no existe, se creará automáticamente")
             else:
-                print(f"✗ Error conectando a MySQL: {e}")
+                logger.error("✗ Error conectando a MySQL: %s", e)
                 raise
+        self._bootstrap_connection = connection
+
+    def create_pools(self):
+        self.writer_pool = pooling.MySQLConnectionPool(
+            pool_name="writer_pool",
+            pool_size=config.DB_WRITER_POOL_SIZE,
+            **self._connection_params()
+        )
+        self.reader_pool = pooling.MySQLConnectionPool(
+            pool_name="reader_pool",
+            pool_size=config.DB_READER_POOL_SIZE,
+            **self._connection_params()
+        )
+        logger.info("✓ Pools MySQL creados (escritura: %s, lectura: %s)",
+                    config.DB_WRITER_POOL_SIZE, config.DB_READER_POOL_SIZE)
+
+    @contextlib.contextmanager
+    def _connection(self, pool):
+        """Toma una conexión sana del pool y la devuelve al salir"""
+        connection = self._checkout(pool)
+        try:
+            yield connection
+        finally:
+            connection.close()  # En conexiones de pool, close() la devuelve al pool
+
+    def _checkout(self, pool):
+        delay = config.DB_RECONNECT_BASE_DELAY
+        for attempt in range(config.DB_RECONNECT_ATTEMPTS):
+            try:
+                connection = pool.get_connection()
+            except PoolError:
+                # Pool agotado: espera a que otro hilo devuelva una conexión
+                time.sleep(min(delay, config.DB_RECONNECT_MAX_DELAY))
+                delay *= 2
+                continue
+            try:
+                # Health check: si la conexión cayó, reconecta con backoff
+                if not connection.is_connected():
+                    connection.reconnect(attempts=1, delay=0)
+                return connection
+            except Error as e:
+                logger.warning("⚠ Conexión MySQL caída (%s), reintento %s: %s",
+                               pool.pool_name, attempt + 1, e)
+                connection.close()
+                time.sleep(min(delay, config.DB_RECONNECT_MAX_DELAY))
+                delay *= 2
+        raise PoolError(f"No hay conexión disponible en {pool.pool_name}")
+
+    def _run(self, pool, operation):
+        """Ejecuta operation(connection), reintentando si la conexión se pierde"""
+        delay = config.DB_RECONNECT_BASE_DELAY
+        for attempt in range(config.DB_RECONNECT_ATTEMPTS):
+            try:
+                with self._connection(pool) as connection:
+                    return operation(connection)
+            except (OperationalError, InterfaceError) as e:
+                if attempt + 1 == config.DB_RECONNECT_ATTEMPTS:
+                    raise
+                logger.warning("⚠ Conexión perdida en %s, reintentando en %.1fs: %s",
+                               pool.pool_name, delay, e)
+                time.sleep(min(delay, config.DB_RECONNECT_MAX_DELAY))
+                delay *= 2
+
+    def is_available(self):
+        """Verifica que el pool de escritura entregue una conexión sana (ping)"""
+        try:
+            self._run(self.writer_pool, lambda connection: None)
+        except Error:
+            return False
+        return True
 
     def create_database_and_table(self):
-        cursor = self.connection.cursor()
+        """Crea la DB si no existe y aplica las migraciones pendientes (MIGRATIONS) en orden"""
+        connection = self._bootstrap_connection
+        cursor = connection.cursor()
         try:
             # Crea DB si no existe
             cursor.execute(f"CREATE DATABASE IF NOT EXISTS {config.DB_NAME}")
             cursor.execute(f"USE {config.DB_NAME}")
             
-            # Crea tabla si no existe
             cursor.execute("""
-                CREATE TABLE IF NOT EXISTS hourly_temperatures (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    device_id VARCHAR(50) NOT NULL,
-                    timestamp DATETIME NOT NULL,
-                    temperature FLOAT NOT NULL,
-                    INDEX idx_timestamp (timestamp),
-                    INDEX idx_device (device_id)
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INT PRIMARY KEY,
+                    description VARCHAR(200) NOT NULL,
+                    applied_at DATETIME NOT NULL
                 )
             """)
-            self.connection.commit()
-            print("✓ DB y tabla verificadas/creadas")
+            if self._pending_migrations(cursor):
+                self._apply_migrations(connection, cursor)
+            logger.info("✓ DB y tablas verificadas (esquema v%s)", MIGRATIONS[-1][0])
         except Error as e:
-            print(f"✗ Error creando DB/tabla: {e}")
+            # Sin esquema completo no se conecta: DeferredStorage reintenta
+            logger.error("✗ Error creando DB/tablas: %s", e)
+            raise
         finally:
             cursor.close()
+            connection.close()
+            self._bootstrap_connection = None
+
+    def _pending_migrations(self, cursor):
+        cursor.execute("SELECT version FROM schema_migrations")
+        applied = {version for (version,) in cursor.fetchall()}
+        return [migration for migration in MIGRATIONS if migration[0] not in applied]
+
+    def _apply_migrations(self, connection, cursor):
+        """Aplica las migraciones pendientes con un lock de MySQL tomado.
+
+        Varios procesos (p. ej. los workers de sharding) arrancan a la vez: el
+        primero que toma el lock migra y los demás, al tomarlo, vuelven a leer
+        schema_migrations y ya no encuentran nada pendiente.
+        """
+        lock = f"{config.DB_NAME}.schema_migrations"
+        cursor.execute("SELECT GET_LOCK(%s, %s)", (lock, config.DB_MIGRATION_LOCK_TIMEOUT))
+        if cursor.fetchone()[0] != 1:
+            raise Error(msg=f"No se obtuvo el lock de migraciones en {config.DB_MIGRATION_LOCK_TIMEOUT}s")
+        try:
+            for version, description, migrate in self._pending_migrations(cursor):
+                logger.info("🔧 Aplicando migración %s: %s", version, description)
+                # El DDL de MySQL confirma solo: la versión se registra al terminar
+                migrate(cursor)
+                cursor.execute(
+                    "INSERT INTO schema_migrations (version, description, applied_at) VALUES (%s, %s, %s)",
+                    (version, description, datetime.now())
+                )
+                connection.commit()
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (lock,))
+            cursor.fetchall()
 
     def insert_temperature(self, device_id, temperature):
         now = datetime.now()
         hour_timestamp = now.replace(minute=0, second=0, microsecond=0)
         
-        # Evita duplicados en la misma hora
-        if self.last_saved_hour == hour_timestamp:
-            print("⚠ Ya guardado en esta hora, omitiendo...")
-            return
-        
-        cursor = self.connection.cursor()
-        try:
-            query = """
-                INSERT INTO hourly_temperatures (device_id, timestamp, temperature)
-                VALUES (%s, %s, %s)
-            """
-            cursor.execute(query, (device_id, hour_timestamp, temperature))
-            self.connection.commit()
-            self.last_saved_hour = hour_timestamp
-            print(f"✓ Guardado en DB: {temperature}°C a las {hour_timestamp.strftime('%H:%M')}")
+        with self._hour_lock:
+            # Evita duplicados en la misma hora
+            if self.last_saved_hour == hour_timestamp:
+                logger.warning("⚠ Ya guardado en esta hora, omitiendo...")
+                return
+
+            def operation(connection):
+                cursor = connection.cursor()
+                try:
+                    query = """
+                        INSERT INTO hourly_temperatures (device_id, timestamp, temperature)
+                        VALUES (%s, %s, %s)
+                    """
+                    cursor.execute(query, (device_id, hour_timestamp, temperature))
+                    connection.commit()
+                finally:
+                    cursor.close()
+
+            try:
+                self._run(self.writer_pool, operation)
+                self.last_saved_hour = hour_timestamp
+                logger.info("✓ Guardado en DB: %s°C a las %s", temperature, hour_timestamp.strftime('%H:%M'))
+                return True
+            except Error as e:
+                logger.error("✗ Error insertando en DB: %s", e)
+                return False
+
+    def insert_samples(self, samples):
+        """Inserta un lote de lecturas con executemany en una sola transacción.
+
+        En la misma transacción actualiza los rollups de 1 min, 1 h y 1 día con
+        los agregados del lote (upsert por dispositivo y bucket).
+        """
+        if not samples:
             return True
-        except Error as e:
-            print(f"✗ Error insertando en DB: {e}")
+        try:
+            rows = [
+                (
+                    s.device_id,
+                    datetime.fromtimestamp(s.received_at or time.time()),
+                    None if s.timestamp is None else str(s.timestamp),
+                    s.temperature,
+                    s.pressure,
+                    s.altitude,
+                    s.rssi,
+                    s.status,
+                )
+                for s in samples
+            ]
+            rollups = [(table, aggregate_rollup_rows(rows, truncate))
+                       for table, _, truncate in ROLLUPS.values()]
+        except (TypeError, ValueError) as e:
+            # Valores que no se pueden convertir ni agregar (p. ej. temperatura no numérica)
+            db_failed_batches.inc()
+            logger.error("✗ Lote con valores inválidos (%s filas): %s", len(samples), e)
             return False
-        finally:
-            cursor.close()
+
+        def operation(connection):
+            cursor = connection.cursor()
+            try:
+                cursor.executemany("""
+                    INSERT INTO sensor_samples
+                        (device_id, timestamp, device_timestamp, temperature,
+                         pressure, altitude, rssi, status)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                """, rows)
+                for table, rollup_rows in rollups:
+                    if rollup_rows:
+                        # last_temp se asigna antes que last_ts (MySQL evalúa en orden)
+                        cursor.executemany(f"""
+                            INSERT INTO {table}
+                                (device_id, bucket_start, min_temp, max_temp, sum_temp,
+                                 sample_count, last_temp, last_ts)
+                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                            ON DUPLICATE KEY UPDATE
+                                min_temp = LEAST(min_temp, VALUES(min_temp)),
+                                max_temp = GREATEST(max_temp, VALUES(max_temp)),
+                                sum_temp = sum_temp + VALUES(sum_temp),
+                                sample_count = sample_count + VALUES(sample_count),
+                                last_temp = IF(VALUES(last_ts) >= last_ts, VALUES(last_temp), last_temp),
+                                last_ts = GREATEST(last_ts, VALUES(last_ts))
+                        """, rollup_rows)
+                connection.commit()
+            except Exception:
+                # Ante cualquier error la conexión vuelve al pool sin la transacción a medias
+                try:
+                    connection.rollback()
+                except Error:
+                    pass
+                raise
+            finally:
+                cursor.close()
+
+        started = time.perf_counter()
+        try:
+            self._run(self.writer_pool, operation)
+        except (Error, TypeError, ValueError) as e:
+            db_failed_batches.inc()
+            logger.error("✗ Error insertando lote en DB (%s filas): %s", len(rows), e)
+            return False
+        record_batch_metrics(samples, time.perf_counter() - started)
+        timestamps = [row[1] for row in rows]
+        self.cache.invalidate({row[0] for row in rows}, min(timestamps), max(timestamps))
+        return True
 
     def get_historical_data(self, start_date=None, end_date=None):
-        cursor = self.connection.cursor(dictionary=True)
-        query = "SELECT * FROM hourly_temperatures"
+        start, end = query_cache.day_range(start_date, end_date)
+        try:
+            return self.cache.fetch(
+                ('history', start_date, end_date),
+                lambda since: self._query_historical_data(start_date, end_date, since),
+                start=start, end=end, descending=True
+            )
+        except Error as e:
+            logger.error("✗ Error obteniendo datos históricos: %s", e)
+            return []
+
+    def _query_historical_data(self, start_date, end_date, since=None):
+        query = "SELECT id, device_id, timestamp, temperature FROM sensor_samples"
+        conditions = []
         params = []
         
         if start_date:
-            query += " WHERE timestamp >= %s"
+            conditions.append("timestamp >= %s")
             params.append(start_date.strftime('%Y-%m-%d 00:00:00'))
         
         if end_date:
-            clause = " AND" if "WHERE" in query else " WHERE"
-            query += f"{clause} timestamp < %s"
+            conditions.append("timestamp < %s")
             params.append(end_date.strftime('%Y-%m-%d 23:59:59'))
         
+        if since is not None:
+            # Solo la cola nueva (ver query_cache.QueryCache)
+            conditions.append("timestamp >= %s")
+            params.append(since)
+
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
         query += " ORDER BY timestamp DESC"
         
+        def operation(connection):
+            cursor = connection.cursor(dictionary=True)
+            try:
+                cursor.execute(query, params)
+                return cursor.fetchall()
+            finally:
+                cursor.close()
+
+        return self._run(self.reader_pool, operation)
+
+    def get_historical_page(self, start_date=None, end_date=None, after=None,
+                            limit=500, device_id=None):
+        """Página de datos históricos con paginación por clave (keyset).
+
+        Ordena por (timestamp, id) descendente; after es el (timestamp, id) de
+        la última fila de la página anterior. Cada página usa el índice en vez
+        de saltar filas con OFFSET, así el costo no crece al avanzar.
+        """
+        start, end = query_cache.day_range(start_date, end_date)
+        if after is not None:
+            # Las páginas siguientes solo contienen filas más viejas que el cursor
+            end = after[0] if end is None else min(end, after[0])
         try:
-            cursor.execute(query, params)
-            results = cursor.fetchall()
-            return results
+            return self.cache.fetch(
+                ('page', start_date, end_date, after, limit, device_id),
+                lambda since: self._query_historical_page(
+                    start_date, end_date, after, limit, device_id, since),
+                device_id=device_id, start=start, end=end, descending=True, limit=limit
+            )
         except Error as e:
-            print(f"✗ Error obteniendo datos históricos: {e}")
+            logger.error("✗ Error obteniendo página de datos históricos: %s", e)
             return []
-        finally:
-            cursor.close()
\ No newline at end of file
+
+    def _query_historical_page(self, start_date, end_date, after, limit, device_id, since=None):
+        query = "SELECT id, device_id, timestamp, temperature FROM sensor_samples"
+        conditions = []
+        params = []
+
+        if device_id:
+            conditions.append("device_id = %s")
+            params.append(device_id)
+
+        if start_date:
+            conditions.append("timestamp >= %s")
+            params.append(start_date.strftime('%Y-%m-%d 00:00:00'))
+
+        if end_date:
+            conditions.append("timestamp < %s")
+            params.append(end_date.strftime('%Y-%m-%d 23:59:59'))
+
+        if after is not None:
+            after_timestamp, after_id = after
+            conditions.append("(timestamp < %s OR (timestamp = %s AND id < %s))")
+            params.extend([after_timestamp, after_timestamp, after_id])
+
+        if since is not None:
+            conditions.append("timestamp >= %s")
+            params.append(since)
+
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY timestamp DESC, id DESC LIMIT %s"
+        params.append(limit)
+
+        def operation(connection):
+            cursor = connection.cursor(dictionary=True)
+            try:
+                cursor.execute(query, params)
+                return cursor.fetchall()
+            finally:
+                cursor.close()
+
+        return self._run(self.reader_pool, operation)
+
+    def get_series(self, device_id, start, end, max_points=2000):
+        """Serie de temperatura de un dispositivo en [start, end) con a lo sumo ~max_points.
+
+        Usa los datos crudos si caben en el presupuesto de puntos y, si no, el
+        rollup más fino que quepa. Cada punto tiene bucket_start, min, max, avg,
+        count y last; retorna (resolución, puntos).
+        """
+        resolution = choose_resolution(start, end, max_points)
+        try:
+            return resolution, self.cache.fetch(
+                ('series', device_id, start, end, resolution),
+                lambda since: self._query_series(device_id, start, end, resolution, since),
+                device_id=device_id, start=start, end=end, time_key='bucket_start'
+            )
+        except Error as e:
+            logger.error("✗ Error obteniendo serie (%s): %s", resolution, e)
+            return resolution, []
+
+    def _query_series(self, device_id, start, end, resolution, since=None):
+        if since is not None:
+            start = max(start, since)  # Desde el último bucket cacheado, inclusive
+        if resolution == 'raw':
+            query = """
+                SELECT timestamp AS bucket_start, temperature AS min, temperature AS max,
+                       temperature AS avg, 1 AS count, temperature AS last
+                FROM sensor_samples
+                WHERE device_id = %s AND timestamp >= %s AND timestamp < %s
+                    AND temperature IS NOT NULL
+                ORDER BY timestamp
+            """
+        else:
+            table = ROLLUPS[resolution][0]
+            query = f"""
+                SELECT bucket_start, min_temp AS min, max_temp AS max,
+                       sum_temp / sample_count AS avg, sample_count AS count, last_temp AS last
+                FROM {table}
+                WHERE device_id = %s AND bucket_start >= %s AND bucket_start < %s
+                ORDER BY bucket_start
+            """
+
+        def operation(connection):
+            cursor = connection.cursor(dictionary=True)
+            try:
+                cursor.execute(query, (device_id, start, end))
+                return cursor.fetchall()
+            finally:
+                cursor.close()
+
+        return self._run(self.reader_pool, operation)
+
+    def iter_samples(self, start=None, end=None, device_id=None, chunk_size=None):
+        chunk_size = chunk_size or config.BACKFILL_CHUNK_SIZE
+        after = None
+        while True:
+            chunk = self._query_sample_chunk(start, end, device_id, after, chunk_size)
+            if chunk:
+                yield chunk
+            if len(chunk) < chunk_size:
+                return
+            last_id, last_device, last_timestamp, _ = chunk[-1]
+            after = (last_device, last_timestamp, last_id)
+
+    def _query_sample_chunk(self, start, end, device_id, after, limit):
+        # Recorre el índice (device_id, timestamp); id desempata timestamps iguales
+        query = "SELECT id, device_id, timestamp, temperature FROM sensor_samples"
+        conditions = ["temperature IS NOT NULL"]
+        params = []
+
+        if device_id:
+            conditions.append("device_id = %s")
+            params.append(device_id)
+
+        if start is not None:
+            conditions.append("timestamp >= %s")
+            params.append(start)
+
+        if end is not None:
+            conditions.append("timestamp < %s")
+            params.append(end)
+
+        if after is not None:
+            after_device, after_timestamp, after_id = after
+            conditions.append("(device_id > %s OR (device_id = %s AND "
+                              "(timestamp > %s OR (timestamp = %s AND id > %s))))")
+            params.extend([after_device, after_device, after_timestamp, after_timestamp, after_id])
+
+        query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY device_id, timestamp, id LIMIT %s"
+        params.append(limit)
+
+        def operation(connection):
+            cursor = connection.cursor()
+            try:
+                cursor.execute(query, params)
+                return cursor.fetchall()
+            finally:
+                cursor.close()
+
+        return self._run(self.reader_pool, operation)
+
+    def iter_export(self, start=None, end=None, device_id=None, chunk_size=None):
+        chunk_size = chunk_size or config.EXPORT_CHUNK_SIZE
+        query = f"SELECT {', '.join(EXPORT_COLUMNS)} FROM sensor_samples"
+        conditions = []
+        params = []
+
+        if device_id:
+            conditions.append("device_id = %s")
+            params.append(device_id)
+
+        if start is not None:
+            conditions.append("timestamp >= %s")
+            params.append(start)
+
+        if end is not None:
+            conditions.append("timestamp < %s")
+            params.append(end)
+
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY timestamp, id"
+
+        with self._connection(self.reader_pool) as connection:
+            # Cursor sin buffer: las filas quedan en el servidor hasta cada fetchmany
+            cursor = connection.cursor(buffered=False)
+            try:
+                cursor.execute(query, params)
+                while True:
+                    chunk = cursor.fetchmany(chunk_size)
+                    if not chunk:
+                        return
+                    yield chunk
+            finally:
+                if connection.unread_result:
+                    # Export interrumpido: descartar el resto implicaría leerlo todo
+                    connection.reconnect(attempts=1, delay=0)
+                else:
+                    cursor.close()
+
+    def insert_anomaly_events(self, anomaly_events):
+        if not anomaly_events:
+            return True
+        rows = [
+            (e['run_id'], e['device_id'], e['started_at'], e['ended_at'], e['recovered_at'],
+             e['duration_seconds'], e['sample_count'], e['peak_temperature'], e['max_abs_z'],
+             e['min_ml_score'], e['severity'], e['z_threshold'], e['window_size'])
+            for e in anomaly_events
+        ]
+
+        def operation(connection):
+            cursor = connection.cursor()
+            try:
+                cursor.executemany("""
+                    INSERT INTO anomaly_events
+                        (run_id, device_id, started_at, ended_at, recovered_at, duration_seconds,
+                         sample_count, peak_temperature, max_abs_z, min_ml_score, severity,
+                         z_threshold, window_size)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                """, rows)
+                connection.commit()
+            finally:
+                cursor.close()
+
+        try:
+            self._run(self.writer_pool, operation)
+            return True
+        except Error as e:
+            logger.error("✗ Error guardando eventos de anomalía (%s): %s", len(rows), e)
+            return False
+
+    def delete_anomaly_events(self, run_id):
+        def operation(connection):
+            cursor = connection.cursor()
+            try:
+                cursor.execute("DELETE FROM anomaly_events WHERE run_id = %s", (run_id,))
+                connection.commit()
+            finally:
+                cursor.close()
+
+        try:
+            self._run(self.writer_pool, operation)
+            return True
+        except Error as e:
+            logger.error("✗ Error borrando eventos de anomalía de %s: %s", run_id, e)
+            return False
+
+    def ensure_partitions(self, now=None):
+        """Divide pmax para que existan las particiones hasta DB_PARTITIONS_AHEAD meses adelante"""
+        last = add_months(month_start(now or datetime.now()), config.DB_PARTITIONS_AHEAD)
+        created = []
+
+        def operation(connection):
+            cursor = connection.cursor()
+            try:
+                for table in PARTITIONED_TABLES:
+                    names = _partition_names(cursor, table)
+                    if not names:
+                        continue  # Sin particionar: la migración 2 no se aplicó
+                    months = _partition_months(names)
+                    month = add_months(max(months), 1) if months else month_start(now or datetime.now())
+                    missing = []
+                    while month <= last:
+                        missing.append(month)
+                        month = add_months(month, 1)
+                    if not missing:
+                        continue
+                    # pmax normalmente está vacía: reorganizarla es inmediato
+                    clauses = ", ".join(_partition_clause(month) for month in missing)
+                    cursor.execute(f"ALTER TABLE {table} REORGANIZE PARTITION pmax INTO "
+                                   f"({clauses}, PARTITION pmax VALUES LESS THAN (MAXVALUE))")
+                    created.extend(f"{table}.p{month:%Y%m}" for month in missing)
+            finally:
+                cursor.close()
+
+        try:
+            self._run(self.writer_pool, operation)
+        except Error as e:
+            logger.error("✗ Error creando particiones: %s", e)
+        if created:
+            logger.info("✓ Particiones creadas: %s", ', '.join(created))
+        return created
+
+    def drop_partitions_before(self, cutoff, tables=None):
+        """Elimina los meses completos anteriores a cutoff (DROP PARTITION, sin DELETE fila a fila)"""
+        dropped = []
+
+        def operation(connection):
+            cursor = connection.cursor()
+            try:
+                for table in tables or PARTITIONED_TABLES:
+                    expired = [f"p{month:%Y%m}" for month in _partition_months(_partition_names(cursor, table))
+                               if add_months(month, 1) <= cutoff]
+                    if expired:
+                        cursor.execute(f"ALTER TABLE {table} DROP PARTITION {', '.join(expired)}")
+                        dropped.extend(f"{table}.{name}" for name in expired)
+            finally:
+                cursor.close()
+
+        try:
+            self._run(self.writer_pool, operation)
+        except Error as e:
+            logger.error("✗ Error eliminando particiones: %s", e)
+        if dropped:
+            self.cache.clear()
+            logger.info("✓ Particiones eliminadas: %s", ', '.join(dropped))
+        return dropped
+
+    def maintain_partitions(self, now=None):
+        now = now or datetime.now()
+        self.ensure_partitions(now)
+        dropped = []
+        for table, months in config.DB_RETENTION_MONTHS.items():
+            if months is not None and table in PARTITIONED_TABLES:
+                dropped.extend(self.drop_partitions_before(retention_cutoff(months, now), (table,)))
+        return dropped
+
+class BatchWriter:
+    """Escritor en segundo plano: acumula lecturas y las inserta por lotes.
+
+    Hace flush con DBHandler.insert_samples al llegar a batch_size filas o al
+    pasar flush_interval_ms desde la primera fila pendiente (una transacción por lote).
+    Sin spool no hay reintentos: un lote fallido se descarta y, si la DB no da
+    abasto, lo pendiente se acota a max_pending filas descartando las más viejas.
+    """
+
+    def __init__(self, db, batch_size=None, flush_interval_ms=None, max_pending=None):
+        self.db = db
+        self.batch_size = batch_size or config.DB_BATCH_SIZE
+        self.flush_interval = (flush_interval_ms or config.DB_BATCH_INTERVAL_MS) / 1000.0
+        self.max_pending = max_pending or config.DB_MAX_PENDING_ROWS
+        self.rows_written = 0
+        self.batches_written = 0
+        self.failed_batches = 0
+        self.dropped_rows = 0
+        self._overflowing = False
+        self._pending = []
+        self._first_pending_time = None
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def add(self, sample):
+        self.add_many([sample])
+
+    def add_many(self, samples):
+        with self._cond:
+            was_empty = not self._pending
+            if was_empty:
+                self._first_pending_time = time.monotonic()
+            self._pending.extend(samples)
+            overflow = len(self._pending) - self.max_pending
+            if overflow > 0:
+                del self._pending[:overflow]
+                self.dropped_rows += overflow
+                db_dropped_rows.inc(overflow)
+                if not self._overflowing:
+                    logger.warning("⚠ La DB no da abasto: se descartan las lecturas más viejas "
+                                   "(más de %s pendientes)", self.max_pending)
+                    self._overflowing = True
+            elif self._overflowing and len(self._pending) <= self.max_pending // 2:
+                self._overflowing = False
+            # Despierta al hilo al llegar la primera fila (arranca el plazo) o al completar un lote
+            if was_empty or len(self._pending) >= self.batch_size:
+                self._cond.notify()
+
+    def close(self, timeout=None):
+        """Hace flush de lo pendiente y detiene el hilo"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    if len(self._pending) >= self.batch_size:
+                        break
+                    if self._pending:
+                        remaining = self._first_pending_time + self.flush_interval - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    else:
+                        self._cond.wait()
+                batch = self._pending[:self.batch_size]
+                del self._pending[:self.batch_size]
+                if self._pending:
+                    self._first_pending_time = time.monotonic()
+                closing = self._closed
+
+            if batch:
+                self._flush(batch)
+            elif closing:
+                return
+
+    def _flush(self, batch):
+        if self.db.insert_samples(batch):
+            self.rows_written += len(batch)
+            self.batches_written += 1
+            notify_saved(len(batch))
+        else:
+            self.failed_batches += 1
+            self.dropped_rows += len(batch)
+            db_dropped_rows.inc(len(batch))
+            logger.error("✗ Lote de %s lecturas descartado: la DB no lo aceptó", len(batch))
@@ -0,0 +1,33 @@
+# events.py: Capa de callbacks sin Qt (reemplaza pyqtSignal fuera de la GUI)
+
+import threading
+import utils
+
+logger = utils.get_logger(__name__)
+
+
+class Signal:
+    """Señal simple estilo Qt: connect(callback) / emit(*args).
+
+    Los callbacks se ejecutan en el hilo que llama a emit(). La GUI debe
+    reenviarlos a su propio hilo (ver dashboard.AlertBridge).
+    """
+
+    def __init__(self):
+        self._callbacks = ()
+        self._lock = threading.Lock()
+
+    def connect(self, callback):
+        with self._lock:
+            self._callbacks = self._callbacks + (callback,)
+
+    def disconnect(self, callback):
+        with self._lock:
+            self._callbacks = tuple(cb for cb in self._callbacks if cb != callback)
+
+    def emit(self, *args):
+        for callback in self._callbacks:
+            try:
+                callback(*args)
+            except Exception as e:
+                logger.error("✗ Error en callback de señal: %s", e)
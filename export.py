@@ -0,0 +1,144 @@
+# export.py: Exportación de datos históricos a CSV o Parquet con memoria constante
+
+import argparse
+import contextlib
+import csv
+import gzip
+import os
+import sys
+import time
+from datetime import datetime
+import db_handler
+import utils
+
+logger = utils.get_logger(__name__)
+
+FORMATS = ("csv", "parquet")
+
+
+def _format_timestamp(value):
+    return value.isoformat(sep=' ', timespec='milliseconds')
+
+
+@contextlib.contextmanager
+def _partial_file(path):
+    """Ruta path + ".part" que reemplaza a path solo si el export termina sin error"""
+    partial = path + ".part"
+    try:
+        yield partial
+    except BaseException:
+        # Un export cortado no debe quedar con el nombre final (parecería completo)
+        with contextlib.suppress(OSError):
+            os.remove(partial)
+        raise
+    os.replace(partial, path)
+
+
+def export_csv(db, output, start=None, end=None, device_id=None, chunk_size=None):
+    """Escribe sensor_samples en CSV bloque a bloque; output es una ruta (.csv o .csv.gz) o un archivo de texto"""
+    timestamp_index = db_handler.EXPORT_COLUMNS.index('timestamp')
+    if isinstance(output, str):
+        with _partial_file(output) as partial:
+            if output.endswith('.gz'):
+                f = gzip.open(partial, 'wt', newline='', encoding='utf-8', compresslevel=6)
+            else:
+                f = open(partial, 'w', newline='', encoding='utf-8')
+            with f:
+                return export_csv(db, f, start, end, device_id, chunk_size)
+
+    writer = csv.writer(output)
+    writer.writerow(db_handler.EXPORT_COLUMNS)
+    rows = 0
+    for chunk in db.iter_export(start, end, device_id, chunk_size):
+        writer.writerows(
+            row[:timestamp_index] + (_format_timestamp(row[timestamp_index]),) + row[timestamp_index + 1:]
+            for row in chunk
+        )
+        rows += len(chunk)
+        logger.debug("Exportadas %s filas", rows)
+    return rows
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("pyarrow no está instalado (requerido para exportar a Parquet)") from e
+    return pyarrow
+
+
+def parquet_schema(pa):
+    """Esquema en el orden de db_handler.EXPORT_COLUMNS (una columna sin tipo falla aquí, no a mitad del export)"""
+    types = {
+        'id': pa.int64(),
+        'device_id': pa.string(),
+        'timestamp': pa.timestamp('ms'),
+        'device_timestamp': pa.string(),
+        'temperature': pa.float64(),
+        'pressure': pa.float64(),
+        'altitude': pa.float64(),
+        'rssi': pa.int32(),
+        'status': pa.string(),
+    }
+    return pa.schema([(column, types[column]) for column in db_handler.EXPORT_COLUMNS])
+
+
+def export_parquet(db, path, start=None, end=None, device_id=None, chunk_size=None, compression='snappy'):
+    """Escribe sensor_samples en Parquet: cada bloque leído es un row group (columnar)"""
+    pa = _import_pyarrow()
+    schema = parquet_schema(pa)
+    rows = 0
+    with _partial_file(path) as partial:
+        with pa.parquet.ParquetWriter(partial, schema, compression=compression) as writer:
+            for chunk in db.iter_export(start, end, device_id, chunk_size):
+                columns = list(zip(*chunk))
+                if len(columns) != len(schema):
+                    raise ValueError(f"Filas de {len(columns)} columnas para un esquema de {len(schema)}")
+                arrays = [pa.array(values, type=field.type) for values, field in zip(columns, schema)]
+                writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+                rows += len(chunk)
+                logger.debug("Exportadas %s filas", rows)
+    return rows
+
+
+def export(db, path, fmt=None, start=None, end=None, device_id=None, chunk_size=None):
+    """Exporta a path en fmt ("csv" o "parquet"; por defecto según la extensión); retorna las filas escritas"""
+    fmt = fmt or ("parquet" if path.endswith(".parquet") else "csv")
+    if fmt == "parquet":
+        return export_parquet(db, path, start, end, device_id, chunk_size)
+    if fmt == "csv":
+        return export_csv(db, path, start, end, device_id, chunk_size)
+    raise ValueError(f"Formato de exportación desconocido: {fmt!r}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Exporta las lecturas guardadas a CSV o Parquet")
+    parser.add_argument('output', help="Archivo de salida (.csv, .csv.gz o .parquet); '-' para CSV por stdout")
+    parser.add_argument('--format', choices=FORMATS, help="Formato (por defecto según la extensión)")
+    parser.add_argument('--start', type=datetime.fromisoformat, help="Inicio del rango (ISO, p. ej. 2025-01-01)")
+    parser.add_argument('--end', type=datetime.fromisoformat, help="Fin del rango, excluido")
+    parser.add_argument('--device', help="Solo este dispositivo")
+    parser.add_argument('--chunk-size', type=int, help="Filas por bloque (EXPORT_CHUNK_SIZE)")
+    parser.add_argument('--backend', choices=('mysql', 'sqlite'), help="Backend (por defecto DB_BACKEND)")
+    args = parser.parse_args(argv)
+
+    if args.output == '-' and args.format == 'parquet':
+        parser.error("Parquet necesita un archivo de salida")
+    db = db_handler.create_db_handler(args.backend)
+    started = time.perf_counter()
+    try:
+        if args.output == '-':
+            rows = export_csv(db, sys.stdout, args.start, args.end, args.device, args.chunk_size)
+        else:
+            rows = export(db, args.output, args.format, args.start, args.end, args.device, args.chunk_size)
+    finally:
+        db.close()
+    # Con stdout el resumen va a stderr para no mezclarse con los datos
+    print(f"✓ {rows:,} filas exportadas en {time.perf_counter() - started:.1f}s",
+          file=sys.stderr if args.output == '-' else sys.stdout)
+    return rows
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# liveness.py: Seguimiento de heartbeats de miles de dispositivos con una rueda de tiempo
+
+import threading
+import time
+import config
+import utils
+
+logger = utils.get_logger(__name__)
+
+ONLINE = "online"
+OFFLINE = "offline"
+
+
+class LivenessTracker:
+    """Detecta dispositivos online/offline con una rueda de tiempo con hash.
+
+    Cada heartbeat cuesta O(1): actualiza el deadline del dispositivo y lo
+    agrega a la ranura de la rueda correspondiente (las entradas viejas se
+    descartan en forma perezosa al pasar por su ranura). Cada tick solo revisa
+    una ranura, y on_transition(device_id, status) se llama únicamente cuando
+    un dispositivo cambia de estado, nunca en cada tick.
+    """
+
+    def __init__(self, on_transition, timeout=None, tick=1.0, wheel_size=64):
+        self.on_transition = on_transition
+        self.timeout = timeout or config.HEARTBEAT_TIMEOUT
+        self.tick = tick
+        self.wheel = [set() for _ in range(wheel_size)]
+        self.deadlines = {}  # device_id -> tick del deadline vigente
+        self.status = {}  # device_id -> ONLINE / OFFLINE
+        self.current_tick = self._tick_of(time.time())
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _tick_of(self, timestamp):
+        return int(timestamp // self.tick)
+
+    def _schedule(self, device_id, now):
+        deadline = self._tick_of(now + self.timeout) + 1
+        self.deadlines[device_id] = deadline
+        self.wheel[deadline % len(self.wheel)].add(device_id)
+
+    def watch(self, device_id, now=None):
+        """Empieza a vigilar un dispositivo sin marcarlo online (p. ej. al recibir datos)"""
+        with self._lock:
+            if device_id not in self.status:
+                self.status[device_id] = None
+                self._schedule(device_id, now or time.time())
+
+    def beat(self, device_id, now=None):
+        """Registra un heartbeat; emite 'online' solo si el dispositivo no lo estaba"""
+        with self._lock:
+            self._schedule(device_id, now or time.time())
+            changed = self.status.get(device_id) != ONLINE
+            if changed:
+                self.status[device_id] = ONLINE
+        if changed:
+            self.on_transition(device_id, ONLINE)
+
+    def advance(self, now=None):
+        """Procesa las ranuras vencidas hasta 'now' y emite las caídas a offline"""
+        target = self._tick_of(now or time.time())
+        expired = []
+        with self._lock:
+            # Si hubo un salto largo basta con recorrer la rueda una vez
+            start = max(self.current_tick + 1, target - len(self.wheel) + 1)
+            for tick in range(start, target + 1):
+                slot = self.wheel[tick % len(self.wheel)]
+                if not slot:
+                    continue
+                keep = set()
+                for device_id in slot:
+                    deadline = self.deadlines.get(device_id)
+                    if deadline is None or deadline % len(self.wheel) != tick % len(self.wheel):
+                        continue  # Entrada vieja: el dispositivo se reprogramó
+                    if deadline > target:
+                        keep.add(device_id)  # Vence en una vuelta posterior de la rueda
+                        continue
+                    del self.deadlines[device_id]
+                    if self.status.get(device_id) != OFFLINE:
+                        self.status[device_id] = OFFLINE
+                        expired.append(device_id)
+                slot.clear()
+                slot.update(keep)
+            self.current_tick = max(self.current_tick, target)
+        for device_id in expired:
+            self.on_transition(device_id, OFFLINE)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="liveness", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop_event.wait(self.tick):
+            try:
+                self.advance()
+            except Exception as e:
+                logger.error("✗ Error revisando heartbeats: %s", e)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def counts(self):
+        with self._lock:
+            online = sum(1 for st in self.status.values() if st == ONLINE)
+            return online, len(self.status) - online
@@ -6,111 +6,56 @@ import traceback
 def main():
     try:
         print("Iniciando aplicación...")
+        import metrics
+        timer = metrics.StartupTimer()  # Desglose del arranque (también en /metrics)
         print("1. Importando módulos...")
         
-        import threading
-        import time
-        from PyQt6.QtWidgets import QApplication
+        with timer.stage("import PyQt6"):
+            from PyQt6.QtWidgets import QApplication
+            from PyQt6.QtCore import QTimer
         print("   ✓ PyQt6")
         
-        import config
+        with timer.stage("import config"):
+            import config
         print("   ✓ config")
         
-        import mqtt_client
-        print("   ✓ mqtt_client")
+        with timer.stage("import pipeline"):
+            import pipeline
+        print("   ✓ pipeline (mqtt_client, db_handler, anomaly_detection)")
         
-        import db_handler
-        print("   ✓ db_handler")
-        
-        import anomaly_detection
-        print("   ✓ anomaly_detection")
-        
-        import dashboard
+        with timer.stage("import dashboard"):
+            import dashboard
         print("   ✓ dashboard")
         
         print("\n2. Creando aplicación Qt...")
-        app = QApplication(sys.argv)
+        with timer.stage("QApplication"):
+            app = QApplication(sys.argv)
         print("   ✓ QApplication creada")
 
         print("\n3. Creando instancias...")
-        print("   - Creando MQTT Client...")
-        mqtt_instance = mqtt_client.MQTTClient()
-        print("   ✓ MQTT Client")
-        
-        print("   - Creando Anomaly Detector...")
-        anomaly_instance = anomaly_detection.AnomalyDetector()
-        print("   ✓ Anomaly Detector")
-        
-        print("   - Creando DB Handler...")
-        db_instance = db_handler.DBHandler()
-        print("   ✓ DB Handler")
-
-        print("\n4. Iniciando threads...")
-        
-        # Thread MQTT
-        def run_mqtt_thread():
-            mqtt_instance.connect()
-            while True:
-                time.sleep(1)
-        
-        mqtt_thread = threading.Thread(target=run_mqtt_thread, daemon=True)
-        mqtt_thread.start()
-        print("   ✓ Cliente MQTT iniciado")
-
-        # Thread DB saver
-        def run_db_saver_thread():
-            last_data = None
-            last_data_timestamp = time.time()
-            
-            while True:
-                now = time.time()
-                current_minute = time.localtime(now).tm_min
-                
-                if current_minute == 0 and last_data:
-                    if (now - last_data_timestamp) < 30:
-                        db_instance.insert_temperature(
-                            last_data['device_id'], 
-                            last_data['temperature']
-                        )
-                        db_handler.save_queue.put(time.strftime('%Y-%m-%d %H:%M:%S'))
-                        time.sleep(60)
-                
-                try:
-                    new_data = mqtt_client.temperature_queue.get(timeout=0.1)
-                    last_data = new_data
-                    last_data_timestamp = time.time()
-                except:
-                    pass
-                
-                time.sleep(1)
-        
-        db_thread = threading.Thread(target=run_db_saver_thread, daemon=True)
-        db_thread.start()
-        print("   ✓ DB saver iniciado")
+        with timer.stage("Pipeline"):
+            # La DB se conecta en segundo plano: la ventana no espera a MySQL
+            ingestion = pipeline.Pipeline(defer_db=True)
 
-        # Thread Anomaly detector
-        def run_anomaly_thread():
-            while True:
-                try:
-                    data = mqtt_client.temperature_queue.get(timeout=1)
-                    temp = data['temperature']
-                    ts = time.time()
-                    anomaly_instance.process_data(temp, ts)
-                    mqtt_client.temperature_queue.put(data)
-                except:
-                    pass
-                time.sleep(0.1)
-        
-        anomaly_thread = threading.Thread(target=run_anomaly_thread, daemon=True)
-        anomaly_thread.start()
-        print("   ✓ Anomaly detector iniciado")
-
-        print("\n5. Creando GUI...")
-        main_window = dashboard.Dashboard(mqtt_instance, anomaly_instance, db_instance)
+        print("\n4. Creando GUI...")
+        with timer.stage("Dashboard"):
+            main_window = dashboard.Dashboard(
+                ingestion.mqtt_instance, ingestion.anomaly_instance, ingestion.db_instance
+            )
         print("   ✓ Dashboard creado")
         
-        main_window.show()
+        with timer.stage("show"):
+            main_window.show()
         print("   ✓ GUI visible")
+
+        def start_threads():
+            # Se ejecuta con el event loop ya corriendo, después de mostrar la ventana
+            print("\n5. Iniciando threads...")
+            with timer.stage("Pipeline.start"):
+                ingestion.start()
+            print(timer.report())
+
+        QTimer.singleShot(0, start_threads)
         
         print("\n" + "="*60)
         print("✅ DASHBOARD EJECUTÁNDOSE")
@@ -130,5 +75,39 @@ def main():
         input("\nPresiona ENTER para cerrar...")
         sys.exit(1)
 
+def main_headless(workers=None):
+    """Ingestión, detección de anomalías y guardado en DB sin Qt ni display"""
+    import signal
+    import threading
+    import config
+
+    print("Iniciando servicio headless...")
+    workers = config.SHARD_WORKERS if workers is None else workers
+    if workers > 1:
+        # Supervisor + workers por dispositivo: usa todos los núcleos
+        import sharding
+        ingestion = sharding.ShardSupervisor(workers)
+    else:
+        import pipeline
+        ingestion = pipeline.Pipeline()
+    ingestion.start()
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: stop.set())
+    print("✅ SERVICIO HEADLESS EJECUTÁNDOSE (Ctrl+C para detener)")
+    try:
+        while not stop.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ingestion.stop()
+        print("Servicio detenido")
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if "--workers" in sys.argv:
+        main_headless(int(sys.argv[sys.argv.index("--workers") + 1]))
+    elif "--headless" in sys.argv:
+        main_headless()
+    else:
+        main()
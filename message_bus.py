@@ -0,0 +1,156 @@
+# message_bus.py: Bus publish/subscribe con buffer circular acotado por suscriptor
+
+import collections
+import queue
+import threading
+import metrics
+
+# Políticas de desbordamiento cuando el buffer de un suscriptor está lleno
+DROP_OLDEST = "drop_oldest"  # Descarta el dato más antiguo
+BLOCK = "block"  # El publicador espera a que haya espacio
+COALESCE_LATEST = "coalesce_latest"  # Reemplaza el último dato pendiente por el nuevo
+
+OVERFLOW_POLICIES = (DROP_OLDEST, BLOCK, COALESCE_LATEST)
+
+
+class Subscription:
+    """Cola acotada de un consumidor: recibe todos los mensajes publicados, en orden"""
+
+    def __init__(self, bus, name, maxsize, policy, block_timeout):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Política de desbordamiento desconocida: {policy}")
+        if maxsize < 1:
+            raise ValueError("maxsize debe ser >= 1")
+        self.bus = bus
+        self.name = name
+        self.maxsize = maxsize
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.closed = False
+        self.dropped = 0  # Mensajes perdidos por desbordamiento
+        self._buffer = collections.deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+
+    def _offer(self, item):
+        """Llamado por el bus al publicar; aplica la política de desbordamiento"""
+        with self._lock:
+            if self.closed:
+                return
+            if len(self._buffer) >= self.maxsize:
+                if self.policy == DROP_OLDEST:
+                    self._buffer.popleft()
+                    self.dropped += 1
+                elif self.policy == COALESCE_LATEST:
+                    self._buffer[-1] = item
+                    self.dropped += 1
+                    self._not_empty.notify()
+                    return
+                else:
+                    # BLOCK: espera espacio; si se agota el timeout, descarta el nuevo dato
+                    while len(self._buffer) >= self.maxsize and not self.closed:
+                        if not self._not_full.wait(self.block_timeout):
+                            self.dropped += 1
+                            return
+                    if self.closed:
+                        return
+            self._buffer.append(item)
+            self._not_empty.notify()
+
+    def get(self, block=True, timeout=None):
+        """Obtiene un mensaje; lanza queue.Empty igual que queue.Queue"""
+        with self._lock:
+            if not self._wait_for_data(block, timeout):
+                raise queue.Empty
+            item = self._buffer.popleft()
+            self._not_full.notify()
+            return item
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def drain(self, max_items=None, timeout=None, block=None):
+        """Lee en lote todos los mensajes pendientes (hasta max_items).
+
+        Con timeout, espera hasta que llegue al menos un mensaje; sin timeout
+        retorna inmediatamente (posiblemente una lista vacía). Con block=True y
+        sin timeout, espera hasta que haya datos o se cierre la suscripción.
+        """
+        if block is None:
+            block = timeout is not None
+        with self._lock:
+            if not self._wait_for_data(block, timeout):
+                return []
+            count = len(self._buffer)
+            if max_items is not None:
+                count = min(count, max_items)
+            items = [self._buffer.popleft() for _ in range(count)]
+            self._not_full.notify_all()
+            return items
+
+    def _wait_for_data(self, block, timeout):
+        # Debe llamarse con el lock tomado
+        if not block:
+            return bool(self._buffer)
+        if timeout is None:
+            while not self._buffer and not self.closed:
+                self._not_empty.wait()
+        else:
+            self._not_empty.wait_for(lambda: self._buffer or self.closed, timeout)
+        return bool(self._buffer)
+
+    def qsize(self):
+        with self._lock:
+            return len(self._buffer)
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def close(self):
+        """Cierra la suscripción y despierta a los hilos que esperan en ella"""
+        with self._lock:
+            self.closed = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+        self.bus.unsubscribe(self)
+
+
+class MessageBus:
+    """Bus fan-out: cada suscriptor recibe una copia de cada mensaje publicado"""
+
+    def __init__(self, default_maxsize=1000, default_policy=DROP_OLDEST, name=None):
+        self.name = name
+        self.default_maxsize = default_maxsize
+        self.default_policy = default_policy
+        self._subscribers = ()  # Tupla inmutable: publish itera sin tomar el lock
+        self._lock = threading.Lock()
+
+    def subscribe(self, name, maxsize=None, policy=None, block_timeout=None):
+        sub = Subscription(
+            self,
+            name,
+            maxsize or self.default_maxsize,
+            policy or self.default_policy,
+            block_timeout,
+        )
+        with self._lock:
+            self._subscribers = self._subscribers + (sub,)
+        if self.name:
+            labels = {'bus': self.name, 'subscriber': name}
+            metrics.registry.gauge("bus_queue_depth", "Mensajes pendientes por suscriptor",
+                                   labels, fn=sub.qsize)
+            metrics.registry.counter("bus_dropped_total", "Mensajes descartados por desbordamiento",
+                                     labels, fn=lambda: sub.dropped)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers = tuple(s for s in self._subscribers if s is not sub)
+
+    def publish(self, item):
+        for sub in self._subscribers:
+            sub._offer(item)
+
+    def subscribers(self):
+        return self._subscribers
@@ -0,0 +1,288 @@
+# metrics.py: Métricas del pipeline (contadores, gauges, histogramas) en formato Prometheus
+
+import contextlib
+import http.server
+import os
+import threading
+import time
+import config
+import utils
+
+logger = utils.get_logger(__name__)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in sorted(labels.items())) + "}"
+
+
+class Counter:
+    """Contador monótono, incrementado con inc() o leído al exportar (fn) de un total ya llevado en otro lado"""
+
+    def __init__(self, name, help_text, labels=None, fn=None):
+        self.name = name
+        self.help = help_text
+        self.labels = labels or {}
+        self.fn = fn
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self):
+        value = self.value
+        if self.fn is not None:
+            try:
+                value = self.fn()
+            except Exception:
+                value = float('nan')
+        return [(self.name, self.labels, value)]
+
+
+class Gauge:
+    """Gauge con valor fijo (set) o calculado al exportar (fn), p. ej. profundidad de una cola"""
+
+    def __init__(self, name, help_text, labels=None, fn=None):
+        self.name = name
+        self.help = help_text
+        self.labels = labels or {}
+        self.fn = fn
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self):
+        value = self.value
+        if self.fn is not None:
+            try:
+                value = self.fn()
+            except Exception:
+                value = float('nan')
+        return [(self.name, self.labels, value)]
+
+
+class Histogram:
+    """Histograma log-lineal estilo HDR: error relativo acotado y registro O(1).
+
+    Los valores se guardan en unidades enteras (microsegundos por defecto);
+    cada potencia de 2 se divide en 2**precision_bits sub-buckets, así el
+    error relativo de los percentiles es < 1 / 2**precision_bits.
+    """
+
+    QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+    def __init__(self, name, help_text, labels=None, unit_scale=1e6, precision_bits=5):
+        self.name = name
+        self.help = help_text
+        self.labels = labels or {}
+        self.unit_scale = unit_scale
+        self.precision_bits = precision_bits
+        self.sub_buckets = 1 << precision_bits
+        self.counts = {}  # índice de bucket -> cantidad
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def _index(self, units):
+        if units < self.sub_buckets:
+            return units
+        shift = units.bit_length() - self.precision_bits - 1
+        return ((shift + 1) << self.precision_bits) + (units >> shift) - self.sub_buckets
+
+    def _lower_bound(self, index):
+        if index < self.sub_buckets:
+            return index
+        shift = (index >> self.precision_bits) - 1
+        return ((index & (self.sub_buckets - 1)) + self.sub_buckets) << shift
+
+    def record(self, value):
+        units = int(value * self.unit_scale)
+        if units < 0:
+            units = 0
+        index = self._index(units)
+        with self._lock:
+            self.counts[index] = self.counts.get(index, 0) + 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def percentile(self, quantile):
+        with self._lock:
+            if self.count == 0:
+                return 0.0
+            target = quantile * self.count
+            seen = 0
+            for index in sorted(self.counts):
+                seen += self.counts[index]
+                if seen >= target:
+                    return self._lower_bound(index) / self.unit_scale
+            return self.max
+
+    def samples(self):
+        samples = [(self.name, dict(self.labels, quantile=str(q)), self.percentile(q))
+                   for q in self.QUANTILES]
+        samples.append((self.name + "_sum", self.labels, self.sum))
+        samples.append((self.name + "_count", self.labels, self.count))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}  # (nombre, labels) -> métrica
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, help_text, labels, **kwargs):
+        """Retorna la métrica registrada con ese nombre y labels, o la crea.
+
+        Si se vuelve a registrar con fn (p. ej. una suscripción o cliente
+        recreado), la nueva fn reemplaza a la anterior: así el gauge no sigue
+        leyendo un objeto ya descartado.
+        """
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            metric = self.metrics.get(key)
+            if metric is None:
+                metric = self.metrics[key] = cls(name, help_text, labels, **kwargs)
+            elif kwargs.get('fn') is not None:
+                metric.fn = kwargs['fn']
+            return metric
+
+    def counter(self, name, help_text, labels=None, fn=None):
+        return self._get_or_create(Counter, name, help_text, labels, fn=fn)
+
+    def gauge(self, name, help_text, labels=None, fn=None):
+        return self._get_or_create(Gauge, name, help_text, labels, fn=fn)
+
+    def histogram(self, name, help_text, labels=None, **kwargs):
+        return self._get_or_create(Histogram, name, help_text, labels, **kwargs)
+
+    def render(self):
+        """Exporta todas las métricas en formato de texto de Prometheus"""
+        types = {Counter: "counter", Gauge: "gauge", Histogram: "summary"}
+        families = {}  # nombre -> (ayuda, tipo, muestras); cada familia sale contigua
+        with self._lock:
+            metrics = sorted(self.metrics.values(), key=lambda m: m.name)
+        for metric in metrics:
+            family = families.setdefault(metric.name, (metric.help, types[type(metric)], []))
+            family[2].extend(metric.samples())
+            if isinstance(metric, Histogram):
+                # Un summary no admite una serie _max: el máximo se exporta como gauge propio
+                family = families.setdefault(metric.name + "_max",
+                                             (f"Máximo observado de {metric.name}", "gauge", []))
+                family[2].append((metric.name + "_max", metric.labels, metric.max))
+        lines = []
+        for family_name, (help_text, kind, samples) in families.items():
+            lines.append(f"# HELP {family_name} {help_text}")
+            lines.append(f"# TYPE {family_name} {kind}")
+            for name, labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+# Registro global del proceso
+registry = Registry()
+
+
+def stage_latency(stage):
+    """Histograma de latencia desde la recepción MQTT hasta la etapa indicada"""
+    return registry.histogram(
+        "pipeline_latency_seconds", "Latencia desde la recepción MQTT hasta cada etapa",
+        {'stage': stage}
+    )
+
+
+def record_latencies(histogram, readings, now=None):
+    now = now or time.time()
+    for reading in readings:
+        if reading.received_at is not None:
+            histogram.record(now - reading.received_at)
+
+
+class StartupTimer:
+    """Mide cada etapa del arranque (imports, GUI, conexiones) y la publica como gauge"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = []  # [(nombre, segundos)]
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name, seconds):
+        self.stages.append((name, seconds))
+        registry.gauge("startup_seconds", "Duración de cada etapa del arranque",
+                       {'stage': name}).set(seconds)
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def report(self):
+        """Tabla de tiempos por etapa, de mayor a menor"""
+        total = self.elapsed()
+        lines = [f"⏱ Arranque en {total:.2f} s:"]
+        for name, seconds in sorted(self.stages, key=lambda item: -item[1]):
+            share = 100 * seconds / total if total else 0
+            lines.append(f"   {name:<24}{seconds:>8.3f} s{share:>6.1f}%")
+        return "\n".join(lines)
+
+
+class _MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("metrics: " + format, *args)
+
+
+def start_http_server(port=None, host=None):
+    """Sirve /metrics en un hilo propio"""
+    server = http.server.ThreadingHTTPServer(
+        (host or config.METRICS_HOST, port or config.METRICS_PORT), _MetricsRequestHandler
+    )
+    thread = threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True)
+    thread.start()
+    logger.info("✓ Métricas en http://%s:%s/metrics", server.server_address[0], server.server_address[1])
+    return server
+
+
+def dump_to_file(path=None):
+    """Escribe las métricas en un archivo (reemplazo atómico, apto para node_exporter textfile)"""
+    path = path or config.METRICS_FILE
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(registry.render())
+    os.replace(tmp_path, path)
+
+
+def start_file_dumper(path=None, interval=None):
+    interval = interval or config.METRICS_DUMP_INTERVAL
+    stop_event = threading.Event()
+
+    def run():
+        while not stop_event.wait(interval):
+            try:
+                dump_to_file(path)
+            except OSError as e:
+                logger.error("✗ Error escribiendo métricas: %s", e)
+
+    threading.Thread(target=run, name="metrics-dump", daemon=True).start()
+    return stop_event
@@ -0,0 +1,153 @@
+# model_training.py: Entrenamiento de modelos Isolation Forest fuera del hilo de detección
+
+import concurrent.futures
+import multiprocessing
+import threading
+import time
+import zlib
+import config
+import utils
+
+logger = utils.get_logger(__name__)
+
+
+def fit_isolation_forest(data, random_state=42):
+    """Entrena un Isolation Forest (se ejecuta en un proceso del pool)"""
+    from sklearn.ensemble import IsolationForest
+    model = IsolationForest(contamination=0.1, random_state=random_state)
+    model.fit(data.reshape(-1, 1))
+    return model
+
+
+class ModelVersion:
+    __slots__ = ('model', 'version', 'trained_at')
+
+    def __init__(self, model, version, trained_at):
+        self.model = model
+        self.version = version
+        self.trained_at = trained_at
+
+
+class ModelTrainer:
+    """Reentrena modelos por clave (dispositivo o flota) en un ProcessPoolExecutor.
+
+    La detección sigue usando la versión actual mientras el reentrenamiento
+    corre en otro proceso; al terminar, la nueva versión se publica con una
+    sola asignación en el diccionario (swap atómico). Cada clave tiene su
+    propio calendario de reentrenamiento, desfasado por un jitter estable para
+    que muchos dispositivos no reentrenen todos a la vez.
+
+    Nada se entrena en el hilo de detección: el primer modelo de una clave
+    también se pide al pool y, mientras no exista, get_model retorna None
+    (el detector no genera alertas hasta tenerlo). Si el modelo supera
+    staleness_budget segundos se pide otro aunque no toque, y se sigue
+    usando el viejo hasta que llegue.
+    """
+
+    def __init__(self, max_workers=None, retrain_interval=None, staleness_budget=None):
+        self.retrain_interval = retrain_interval or config.MODEL_RETRAIN_INTERVAL
+        self.staleness_budget = staleness_budget or config.MODEL_STALENESS_BUDGET
+        self.max_workers = max_workers or config.MODEL_TRAINING_WORKERS
+        self._executor = None
+        self._models = {}  # clave -> ModelVersion
+        self._inflight = {}  # clave -> Future
+        self._next_due = {}  # clave -> timestamp del próximo reentrenamiento
+        self._versions = 0
+        self._shutting_down = False
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        if self._executor is None:
+            # "spawn" evita hacer fork de un proceso con hilos de MQTT/DB activos
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def _jitter(self, key):
+        return (zlib.crc32(str(key).encode()) % 1000) / 1000.0 * self.retrain_interval
+
+    def get_model(self, key, data_fn, now=None):
+        """Retorna el modelo vigente de key (None si todavía no hay) y agenda un entrenamiento si corresponde.
+
+        data_fn() solo se llama cuando hay que entrenar y debe retornar un
+        ndarray 1-D con los datos de entrenamiento.
+        """
+        now = now or time.time()
+        current = self._models.get(key)
+        if key not in self._inflight:
+            if current is not None and now - current.trained_at > self.staleness_budget:
+                logger.warning("⚠ Modelo ML '%s' desactualizado (%.0fs), se pide otro al pool",
+                               key, now - current.trained_at)
+                self._submit(key, data_fn(), now)
+            elif now >= self._next_due.get(key, 0):
+                self._submit(key, data_fn(), now)
+        return None if current is None else current.model
+
+    def _submit(self, key, data, now):
+        with self._lock:
+            self._next_due[key] = now + self.retrain_interval
+            try:
+                future = self._get_executor().submit(fit_isolation_forest, data)
+            except concurrent.futures.process.BrokenProcessPool as e:
+                # Un proceso del pool murió: se recrea el pool en el próximo intento
+                logger.error("✗ Pool de entrenamiento caído, se recreará: %s", e)
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+                return
+            except Exception as e:
+                logger.error("✗ Error enviando reentrenamiento de '%s': %s", key, e)
+                return
+            self._inflight[key] = future
+        future.add_done_callback(lambda f: self._on_done(key, f, now))
+
+    def _on_done(self, key, future, submitted_at):
+        with self._lock:
+            self._inflight.pop(key, None)
+        if self._shutting_down:
+            return  # El pool se cerró con el entrenamiento en curso
+        try:
+            model = future.result()
+        except Exception as e:
+            logger.error("✗ Error reentrenando modelo '%s': %s", key, e)
+            return
+        current = self._models.get(key)
+        # Descarta resultados más viejos que la versión vigente
+        if current is not None and current.trained_at > submitted_at:
+            return
+        version = self._publish(key, model, submitted_at)
+        logger.info("🤖 Modelo ML '%s' reentrenado (v%s, %.1fs)",
+                    key, version.version, time.time() - submitted_at)
+
+    def _publish(self, key, model, trained_at):
+        with self._lock:
+            self._versions += 1
+            version = ModelVersion(model, self._versions, trained_at)
+            if key not in self._next_due:
+                self._next_due[key] = trained_at + self.retrain_interval + self._jitter(key)
+            self._models[key] = version  # Swap atómico: los lectores ven la versión vieja o la nueva
+        return version
+
+    def current_version(self, key):
+        current = self._models.get(key)
+        return current.version if current is not None else None
+
+    def shutdown(self):
+        self._shutting_down = True
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+_default_trainer = None
+_default_trainer_lock = threading.Lock()
+
+
+def get_default_trainer():
+    """Trainer compartido por los detectores del proceso (un solo pool)"""
+    global _default_trainer
+    with _default_trainer_lock:
+        if _default_trainer is None:
+            _default_trainer = ModelTrainer()
+        return _default_trainer
@@ -0,0 +1,228 @@
+# mqtt_async.py: Núcleo de ingestión MQTT sobre asyncio (sin el hilo de red de paho)
+
+import asyncio
+import concurrent.futures
+import threading
+import time
+from paho.mqtt import client as mqtt
+import config
+import metrics
+import mqtt_client
+import utils
+
+logger = utils.get_logger(__name__)
+
+reader_pauses = metrics.registry.counter(
+    "mqtt_reader_pauses_total", "Pausas de lectura del socket por cola de ingestión llena")
+
+
+class AsyncMQTTClient(mqtt_client.MQTTClient):
+    """MQTTClient cuyo socket atiende un event loop de asyncio en un hilo propio.
+
+    En lugar de loop_start(), el loop llama a loop_read/loop_write cuando el
+    socket está listo y a loop_misc (keepalive) una vez por segundo, junto con
+    la rueda de heartbeats. on_message solo encola (tópico, payload, hora de
+    recepción) en una cola acotada; una tarea pasa los lotes a un hilo de
+    decodificación, que publica en el bus, de donde las etapas de DB y
+    anomalías toman los datos. Una publicación que espera (política "block"
+    del bus) frena a ese hilo, nunca al event loop.
+
+    Backpressure: si la cola se llena, se deja de leer el socket hasta que
+    baje de la marca inferior. Los mensajes esperan en el broker y en TCP en
+    vez de acumularse en memoria, y el keepalive nunca espera a un consumidor.
+    """
+
+    def __init__(self, queue_size=None, batch_size=None):
+        super().__init__()
+        self.queue_size = queue_size or config.MQTT_INGEST_QUEUE_SIZE
+        self.low_watermark = int(self.queue_size * config.MQTT_INGEST_LOW_WATERMARK)
+        self.batch_size = batch_size or config.MQTT_DECODE_BATCH
+        self.loop = None
+        self.queue = None
+        self.connected = False
+        self._session_ok = False  # Hubo CONNACK exitoso en la conexión actual
+        self._sock = None
+        self._reading_paused = False
+        self._spill = []  # Mensajes del último paquete leído con la cola ya llena
+        self._stopping = None
+        self._disconnected = None
+        self._thread = None
+        self.client.on_disconnect = self.on_disconnect
+        self.client.on_socket_open = self.on_socket_open
+        self.client.on_socket_close = self.on_socket_close
+        self.client.on_socket_register_write = self.on_socket_register_write
+        self.client.on_socket_unregister_write = self.on_socket_unregister_write
+        metrics.registry.gauge("mqtt_ingest_queue_depth", "Mensajes crudos esperando decodificación",
+                               fn=lambda: self.queue.qsize() if self.queue is not None else 0)
+
+    def connect(self):
+        """Arranca el event loop de ingestión (conecta y reconecta con backoff)"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._thread_main, name="mqtt-asyncio", daemon=True)
+            self._thread.start()
+
+    def disconnect(self, timeout=5):
+        if self.loop is not None and self._stopping is not None:
+            self.loop.call_soon_threadsafe(self._stopping.set)
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _thread_main(self):
+        asyncio.run(self._main())
+
+    async def _main(self):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(self.queue_size)
+        self._stopping = asyncio.Event()
+        # Un solo hilo: los lotes se publican de a uno y en orden de llegada
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="mqtt-decode")
+        decoder = asyncio.create_task(self._decode_worker(executor))
+        housekeeping = asyncio.create_task(self._housekeeping())
+        if config.MQTT_USERNAME and config.MQTT_PASSWORD:
+            self.client.username_pw_set(config.MQTT_USERNAME, config.MQTT_PASSWORD)
+
+        delay = config.MQTT_RECONNECT_BASE_DELAY
+        while not self._stopping.is_set():
+            self._disconnected = asyncio.Event()
+            self._session_ok = False
+            try:
+                # Abre el socket (breve); on_socket_open lo registra en el loop
+                self.client.connect(config.MQTT_BROKER, config.MQTT_PORT, 60)
+            except OSError as e:
+                logger.error("Error conectando al broker MQTT: %s (reintento en %.1fs)", e, delay)
+            else:
+                await self._wait_any(self._stopping, self._disconnected)
+            if self._stopping.is_set():
+                break
+            if self._session_ok:
+                delay = config.MQTT_RECONNECT_BASE_DELAY  # Se cayó una sesión sana: reconecta ya
+                continue
+            await self._wait_any(self._stopping, timeout=delay)
+            delay = min(delay * 2, config.MQTT_RECONNECT_MAX_DELAY)
+
+        # Cierre ordenado: DISCONNECT al broker y procesa lo que quedó en cola
+        if self._sock is not None:
+            self.client.disconnect()
+            await self._wait_any(self._disconnected, timeout=1.0)
+        housekeeping.cancel()
+        for item in self._spill:
+            await self.queue.put(item)
+        self._spill = []
+        await self.queue.put(None)
+        await decoder
+        executor.shutdown()
+
+    @staticmethod
+    async def _wait_any(*events, timeout=None):
+        waiters = [asyncio.ensure_future(event.wait()) for event in events]
+        try:
+            await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+
+    async def _housekeeping(self):
+        """Keepalive de MQTT y vencimiento de heartbeats, una vez por tick"""
+        while True:
+            await asyncio.sleep(self.liveness.tick)
+            if self._sock is not None:
+                self.client.loop_misc()
+            try:
+                self.liveness.advance()
+            except Exception as e:
+                logger.error("✗ Error revisando heartbeats: %s", e)
+
+    async def _decode_worker(self, executor):
+        while True:
+            item = await self.queue.get()
+            batch = []
+            stop = False
+            while item is not None:
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+            else:
+                stop = True
+            # Mientras el hilo decodifica y publica, el loop sigue con el socket y el keepalive
+            await self.loop.run_in_executor(executor, self._dispatch_batch, batch)
+            self._refill()
+            if stop:
+                return
+
+    def _dispatch_batch(self, batch):
+        for topic, payload, received_at in batch:
+            try:
+                self.dispatch(topic, payload, received_at)
+            except Exception as e:
+                # Un mensaje con error no debe detener la decodificación del resto
+                logger.error("✗ Error procesando mensaje de %s: %s", topic, e)
+
+    # === Callbacks de paho (se ejecutan en el hilo del event loop) ===
+
+    def on_connect(self, client, userdata, flags, rc):
+        self.connected = rc == 0
+        self._session_ok = self._session_ok or self.connected
+        super().on_connect(client, userdata, flags, rc)
+
+    def on_disconnect(self, client, userdata, rc):
+        self.connected = False
+        if rc != 0:
+            logger.warning("⚠ Desconectado del broker MQTT (rc=%s), reconectando...", rc)
+        if self._disconnected is not None:
+            self._disconnected.set()
+
+    def on_message(self, client, userdata, msg):
+        item = (msg.topic, msg.payload, time.time())
+        if self._spill or self.queue.full():
+            self._spill.append(item)
+            self._pause_reading()
+        else:
+            self.queue.put_nowait(item)
+
+    def on_socket_open(self, client, userdata, sock):
+        self._sock = sock
+        self._reading_paused = False
+        self.loop.add_reader(sock, self._on_readable)
+
+    def on_socket_close(self, client, userdata, sock):
+        self.loop.remove_reader(sock)
+        self.loop.remove_writer(sock)
+        self._sock = None
+        if self._disconnected is not None:
+            self._disconnected.set()
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self.loop.add_writer(sock, self.client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self.loop.remove_writer(sock)
+
+    def _on_readable(self):
+        # loop_read procesa un paquete por llamada: drena hasta un lote por evento
+        for _ in range(self.batch_size):
+            if self._reading_paused or self._sock is None:
+                break
+            if self.client.loop_read() != mqtt.MQTT_ERR_SUCCESS:
+                break
+
+    # === Backpressure ===
+
+    def _pause_reading(self):
+        if not self._reading_paused and self._sock is not None:
+            self.loop.remove_reader(self._sock)
+            self._reading_paused = True
+            reader_pauses.inc()
+            logger.debug("Cola de ingestión llena: lectura del socket en pausa")
+
+    def _refill(self):
+        """Pasa los mensajes retenidos a la cola y reanuda la lectura bajo la marca inferior"""
+        while self._spill and not self.queue.full():
+            self.queue.put_nowait(self._spill.pop(0))
+        if (self._reading_paused and not self._spill and self._sock is not None
+                and self.queue.qsize() <= self.low_watermark):
+            self.loop.add_reader(self._sock, self._on_readable)
+            self._reading_paused = False
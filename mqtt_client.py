@@ -1,82 +1,210 @@
 # mqtt_client.py: Manejo de conexión MQTT
 
-import json
 import time
-import threading
 import queue
 from paho.mqtt import client as mqtt
-from PyQt6.QtCore import QTimer, pyqtSignal, QObject
 import config
+import utils
+import events
+import liveness
+import message_bus
+import metrics
+import payload_codec
 
-# Queues para pasar datos a otros módulos (thread-safe)
-temperature_queue = queue.Queue()  # Para nuevos datos de temperatura
-heartbeat_status_queue = queue.Queue()  # Para status: "online" o "offline"
+logger = utils.get_logger(__name__)
 
-class MQTTClient(QObject):
-    # Signals para alertas (usaremos en GUI más adelante)
-    alert_signal = pyqtSignal(str)  # Para emitir alertas como "offline"
+# Bus fan-out para nuevos datos de temperatura: cada consumidor (GUI, DB,
+# anomalías) se suscribe y recibe todas las lecturas, en orden
+temperature_bus = message_bus.MessageBus(
+    default_maxsize=config.BUS_BUFFER_SIZE,
+    default_policy=config.BUS_OVERFLOW_POLICY,
+    name="temperature"
+)
+# Queue para pasar status a la GUI (thread-safe). Acotada como save_queue: sin
+# GUI (headless, workers) nadie la vacía y se descartan las transiciones más viejas
+heartbeat_status_queue = queue.Queue(maxsize=1000)  # Transiciones: (device_id, "online" | "offline")
 
+# Métricas de recepción y decodificación
+messages_received = {
+    kind: metrics.registry.counter("mqtt_messages_received_total", "Mensajes MQTT recibidos",
+                                   {'kind': kind})
+    for kind in ("sensor_data", "heartbeat")
+}
+decode_errors = metrics.registry.counter("mqtt_decode_errors_total", "Payloads inválidos")
+decode_seconds = metrics.registry.histogram("mqtt_decode_seconds", "Tiempo de decodificación por mensaje")
+publish_seconds = metrics.registry.histogram("bus_publish_seconds", "Tiempo de publicación en el bus")
+metrics.registry.gauge("heartbeat_status_queue_depth", "Transiciones pendientes para la GUI",
+                       fn=heartbeat_status_queue.qsize)
+heartbeat_status_dropped = metrics.registry.counter("heartbeat_status_dropped_total",
+                                                    "Transiciones descartadas con la queue de la GUI llena")
+
+def notify_status(device_id, status):
+    """Encola una transición para la GUI; si la queue está llena descarta la más vieja"""
+    while True:
+        try:
+            heartbeat_status_queue.put_nowait((device_id, status))
+            return
+        except queue.Full:
+            try:
+                heartbeat_status_queue.get_nowait()
+                heartbeat_status_dropped.inc()
+            except queue.Empty:
+                pass
+
+class DeviceState:
+    """Estado por dispositivo (una entrada por refrigerador)"""
+    __slots__ = ('device_id', 'last_temperature_data', 'last_heartbeat')
+
+    def __init__(self, device_id):
+        self.device_id = device_id
+        self.last_temperature_data = None  # Último dato de temperatura recibido
+        self.last_heartbeat = 0  # Timestamp del último heartbeat
+
+class TopicRouter:
+    """Enruta tópicos MQTT con comodines (+, #) a un handler y un device_id.
+
+    El primer '+' del patrón captura el device_id. El resultado de cada tópico
+    concreto se cachea, así que el enrutamiento es O(1) tras el primer mensaje.
+    """
+
+    def __init__(self):
+        self.routes = []  # [(partes_del_patrón, handler)]
+        self._cache = {}  # tópico -> (device_id, handler) o None
+
+    def add_route(self, pattern, handler):
+        self.routes.append((pattern.split('/'), handler))
+        self._cache.clear()
+
+    def route(self, topic):
+        try:
+            return self._cache[topic]
+        except KeyError:
+            pass
+        result = None
+        topic_parts = topic.split('/')
+        for pattern_parts, handler in self.routes:
+            device_id = self._match(pattern_parts, topic_parts)
+            if device_id is not False:
+                result = (device_id, handler)
+                break
+        self._cache[topic] = result
+        return result
+
+    @staticmethod
+    def _match(pattern_parts, topic_parts):
+        """Retorna el device_id capturado (o None), o False si no coincide"""
+        device_id = None
+        for i, part in enumerate(pattern_parts):
+            if part == '#':
+                return device_id
+            if i >= len(topic_parts):
+                return False
+            if part == '+':
+                if device_id is None:
+                    device_id = topic_parts[i]
+            elif part != topic_parts[i]:
+                return False
+        return device_id if len(pattern_parts) == len(topic_parts) else False
+
+class MQTTClient:
     def __init__(self):
-        super().__init__()
+        # Signal para alertas como "offline" (sin Qt: la GUI se suscribe si existe)
+        self.alert_signal = events.Signal()
         self.client = mqtt.Client()
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
-        self.last_heartbeat = 0  # Timestamp del último heartbeat
-        self.last_temperature_data = None  # Último dato de temperatura recibido
-        self.heartbeat_timer = QTimer(self)
-        self.heartbeat_timer.timeout.connect(self.check_heartbeat)
-        self.heartbeat_timer.start(5000)  # Chequea cada 5 seg
+        self.devices = {}  # device_id -> DeviceState
+        self.last_temperature_data = None  # Último dato recibido de cualquier dispositivo
+        self.router = TopicRouter()
+        self.router.add_route(config.MQTT_TOPIC_TEMPERATURE, self.handle_temperature)
+        self.router.add_route(config.MQTT_TOPIC_HEARTBEAT, self.handle_heartbeat)
+        # Rueda de tiempo de heartbeats: solo reporta transiciones online/offline
+        self.liveness = liveness.LivenessTracker(self.on_liveness_transition)
 
     def connect(self):
         if config.MQTT_USERNAME and config.MQTT_PASSWORD:
             self.client.username_pw_set(config.MQTT_USERNAME, config.MQTT_PASSWORD)
         self.client.connect(config.MQTT_BROKER, config.MQTT_PORT, 60)
         self.client.loop_start()  # Inicia loop en background
+        self.start_heartbeat_monitor()
+
+    def start_heartbeat_monitor(self):
+        """Chequea heartbeats periódicamente en un hilo propio (sin QTimer)"""
+        self.liveness.start()
+
+    def disconnect(self):
+        self.liveness.stop()
+        self.client.loop_stop()
+        self.client.disconnect()
 
     def on_connect(self, client, userdata, flags, rc):
         if rc == 0:
-            print("Conectado al broker MQTT")
+            logger.info("Conectado al broker MQTT")
             client.subscribe(config.MQTT_TOPIC_TEMPERATURE)
             client.subscribe(config.MQTT_TOPIC_HEARTBEAT)
         else:
-            print(f"Error de conexión: {rc}")
+            logger.error("Error de conexión: %s", rc)
 
     def on_message(self, client, userdata, msg):
+        self.dispatch(msg.topic, msg.payload)
+
+    def dispatch(self, topic, payload, received_at=None):
+        """Enruta y procesa un mensaje (received_at: hora de recepción si se encoló antes)"""
+        route = self.router.route(topic)
+        if route is None:
+            return
+        device_id, handler = route
         try:
-            payload = json.loads(msg.payload.decode())
-            if msg.topic == config.MQTT_TOPIC_TEMPERATURE:
-                self.handle_temperature(payload)
-            elif msg.topic == config.MQTT_TOPIC_HEARTBEAT:
-                self.handle_heartbeat(payload)
-        except json.JSONDecodeError:
-            print("Error parsing JSON")
-
-    def handle_temperature(self, data):
-        # Extrae datos relevantes
-        self.last_temperature_data = {
-            'device_id': data.get('device_id'),
-            'timestamp': data.get('timestamp'),
-            'temperature': data.get('temperature'),
-            'pressure': data.get('pressure'),
-            'altitude': data.get('altitude'),
-            'rssi': data.get('rssi'),
-            'status': data.get('status')
-        }
-        # Pasa a queue para GUI/DB
-        temperature_queue.put(self.last_temperature_data)
-        print(f"Nuevo dato de temperatura: {self.last_temperature_data['temperature']}°C")
-
-    def handle_heartbeat(self, data):
+            handler(device_id, payload, received_at)
+        except payload_codec.DecodeError as e:
+            decode_errors.inc()
+            logger.error("Error decodificando payload de %s: %s", topic, e)
+
+    def get_device(self, device_id):
+        state = self.devices.get(device_id)
+        if state is None:
+            state = self.devices[device_id] = DeviceState(device_id)
+            # Si nunca envía heartbeat, se reporta offline al vencer el timeout
+            self.liveness.watch(device_id)
+        return state
+
+    def handle_temperature(self, device_id, payload, received_at=None):
+        messages_received["sensor_data"].inc()
+        # Decodifica directo a un SensorReading (JSON o trama binaria)
+        started = time.perf_counter()
+        reading = payload_codec.decode_sensor(payload, device_id, received_at or time.time())
+        decoded = time.perf_counter()
+        decode_seconds.record(decoded - started)
+        state = self.get_device(reading.device_id)
+        state.last_temperature_data = reading
+        self.last_temperature_data = reading
+        # Publica en el bus para GUI/DB/anomalías
+        temperature_bus.publish(reading)
+        publish_seconds.record(time.perf_counter() - decoded)
+        logger.debug("Nuevo dato de temperatura [%s]: %s°C", reading.device_id, reading.temperature)
+
+    def handle_heartbeat(self, device_id, payload, received_at=None):
+        messages_received["heartbeat"].inc()
+        data = payload_codec.decode_json(payload)
+        if not isinstance(data, dict):
+            raise payload_codec.DecodeError("El payload JSON no es un objeto")
+        device_id = device_id or data.get('device_id')
         if data.get('status') == 'alive':
-            self.last_heartbeat = time.time()  # Actualiza timestamp
-            heartbeat_status_queue.put("online")
-            print("Heartbeat recibido: Dispositivo alive")
+            now = received_at or time.time()
+            self.get_device(device_id).last_heartbeat = now  # Actualiza timestamp
+            self.liveness.beat(device_id, now)
 
     def check_heartbeat(self):
-        if time.time() - self.last_heartbeat > config.HEARTBEAT_TIMEOUT:
-            heartbeat_status_queue.put("offline")
-            self.alert_signal.emit("Dispositivo offline: No se recibe heartbeat")
-            print("Alerta: Dispositivo offline")
+        """Procesa los heartbeats vencidos (normalmente lo hace el hilo del tracker)"""
+        self.liveness.advance()
+
+    def on_liveness_transition(self, device_id, status):
+        notify_status(device_id, status)
+        if status == liveness.OFFLINE:
+            self.alert_signal.emit(f"Dispositivo {device_id} offline: No se recibe heartbeat")
+            logger.warning("Alerta: Dispositivo %s offline", device_id)
+        else:
+            logger.info("Heartbeat recibido: Dispositivo %s online", device_id)
 
 def run_mqtt():
     mqtt_client = MQTTClient()
@@ -0,0 +1,227 @@
+# payload_codec.py: Decodificación de payloads MQTT (JSON rápido o binario compacto)
+
+import math
+import struct
+
+# Backend JSON: usa el más rápido disponible (orjson > ujson > json)
+try:
+    import orjson as _json_backend
+    JSON_BACKEND = "orjson"
+
+    def json_loads(payload):
+        return _json_backend.loads(payload)  # Acepta bytes directamente
+
+    def json_dumps(obj):
+        return _json_backend.dumps(obj)
+except ImportError:
+    try:
+        import ujson as _json_backend
+        JSON_BACKEND = "ujson"
+    except ImportError:
+        import json as _json_backend
+        JSON_BACKEND = "json"
+
+    def json_loads(payload):
+        if isinstance(payload, (bytes, bytearray, memoryview)):
+            payload = bytes(payload).decode()
+        return _json_backend.loads(payload)
+
+    def json_dumps(obj):
+        return _json_backend.dumps(obj).encode()
+
+
+class DecodeError(ValueError):
+    """Payload inválido (JSON mal formado, trama binaria incorrecta o campos fuera de esquema)"""
+
+
+# Límites de las columnas de sensor_samples: lo que no cabe se rechaza al decodificar
+DEVICE_ID_MAX_LENGTH = 50   # VARCHAR(50)
+STATUS_MAX_LENGTH = 20      # VARCHAR(20)
+RSSI_RANGE = (-2**31, 2**31 - 1)  # INT
+TIMESTAMP_RANGE = (0, 2**63 - 1)  # Se guarda como texto en VARCHAR(32)
+
+
+def _float_field(name, value):
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        raise DecodeError(f"Campo {name} no numérico: {value!r}")
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise DecodeError(f"Campo {name} no numérico: {value!r}") from None
+    if not math.isfinite(value):
+        raise DecodeError(f"Campo {name} no finito: {value!r}")
+    return value
+
+
+def _int_field(name, value, bounds):
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        raise DecodeError(f"Campo {name} no entero: {value!r}")
+    try:
+        value = int(value)
+    except (TypeError, ValueError, OverflowError):
+        raise DecodeError(f"Campo {name} no entero: {value!r}") from None
+    if not bounds[0] <= value <= bounds[1]:
+        raise DecodeError(f"Campo {name} fuera de rango: {value}")
+    return value
+
+
+def _text_field(name, value, max_length, required=False):
+    if value is None:
+        if required:
+            raise DecodeError(f"Falta el campo {name}")
+        return None
+    if not isinstance(value, str) or (required and not value):
+        raise DecodeError(f"Campo {name} inválido: {value!r}")
+    if len(value) > max_length:
+        raise DecodeError(f"Campo {name} excede {max_length} caracteres: {value[:max_length]!r}…")
+    return value
+
+
+class SensorReading:
+    """Lectura de sensor sin diccionario por mensaje (__slots__)"""
+    __slots__ = ('device_id', 'timestamp', 'temperature', 'pressure', 'altitude',
+                 'rssi', 'status', 'received_at')
+
+    def __init__(self, device_id, timestamp=None, temperature=None, pressure=None,
+                 altitude=None, rssi=None, status=None, received_at=None):
+        self.device_id = device_id
+        self.timestamp = timestamp
+        self.temperature = temperature
+        self.pressure = pressure
+        self.altitude = altitude
+        self.rssi = rssi
+        self.status = status
+        self.received_at = received_at  # Hora de recepción (base para DB y latencias)
+
+    @classmethod
+    def from_dict(cls, data, device_id=None, received_at=None):
+        """Construye la lectura desde JSON, normalizando tipos y longitudes.
+
+        Lanza DecodeError si algún campo no se puede convertir o no cabe en
+        su columna, para que el mensaje se descarte en la ingesta.
+        """
+        return cls(
+            _text_field('device_id', device_id or data.get('device_id'), DEVICE_ID_MAX_LENGTH, required=True),
+            _int_field('timestamp', data.get('timestamp'), TIMESTAMP_RANGE),
+            _float_field('temperature', data.get('temperature')),
+            _float_field('pressure', data.get('pressure')),
+            _float_field('altitude', data.get('altitude')),
+            _int_field('rssi', data.get('rssi'), RSSI_RANGE),
+            _text_field('status', data.get('status'), STATUS_MAX_LENGTH),
+            received_at if received_at is not None else data.get('received_at'),
+        )
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def to_tuple(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    @classmethod
+    def from_tuple(cls, values):
+        return cls(*values)
+
+    @classmethod
+    def from_record(cls, values):
+        """Como from_tuple, pero valida los campos igual que from_dict"""
+        if not isinstance(values, list) or len(values) != len(cls.__slots__):
+            raise DecodeError(f"Registro de spool con forma inválida: {values!r}")
+        return cls.from_dict(dict(zip(cls.__slots__, values)))
+
+    def __repr__(self):
+        return f"SensorReading({self.device_id!r}, temperature={self.temperature!r})"
+
+
+# === Formato binario (opcional para el firmware ESP32) ===
+# Trama little-endian de 22 bytes, el device_id viaja en el tópico:
+#   magic "FR" | versión u8 | timestamp u32 | temperatura f32 | presión f32 |
+#   altitud f32 | rssi i16 | status u8
+# Los campos flotantes ausentes se envían como NaN.
+BINARY_MAGIC = b'FR'
+BINARY_VERSION = 1
+BINARY_LAYOUT = struct.Struct('<2sBIfffhB')
+STATUS_CODES = {0: None, 1: 'ok', 2: 'warning', 3: 'error'}
+STATUS_VALUES = {value: code for code, value in STATUS_CODES.items()}
+
+
+def _optional(value):
+    return None if math.isnan(value) else value
+
+
+def decode_binary(payload, device_id, received_at=None):
+    if len(payload) != BINARY_LAYOUT.size:
+        raise DecodeError(f"Trama binaria de {len(payload)} bytes (se esperaban {BINARY_LAYOUT.size})")
+    magic, version, timestamp, temperature, pressure, altitude, rssi, status = \
+        BINARY_LAYOUT.unpack(payload)
+    if version != BINARY_VERSION:
+        raise DecodeError(f"Versión de trama binaria no soportada: {version}")
+    return SensorReading(
+        _text_field('device_id', device_id, DEVICE_ID_MAX_LENGTH, required=True),
+        timestamp, _float_field('temperature', _optional(temperature)),
+        _float_field('pressure', _optional(pressure)), _float_field('altitude', _optional(altitude)),
+        rssi, STATUS_CODES.get(status), received_at
+    )
+
+
+def encode_binary(reading):
+    """Codifica una lectura en el formato binario (referencia para el firmware y pruebas)"""
+    nan = float('nan')
+    return BINARY_LAYOUT.pack(
+        BINARY_MAGIC, BINARY_VERSION,
+        int(reading.timestamp or 0),
+        nan if reading.temperature is None else reading.temperature,
+        nan if reading.pressure is None else reading.pressure,
+        nan if reading.altitude is None else reading.altitude,
+        int(reading.rssi or 0),
+        STATUS_VALUES.get(reading.status, 0),
+    )
+
+
+def decode_json(payload):
+    try:
+        return json_loads(payload)
+    except ValueError as e:
+        raise DecodeError(f"Error parsing JSON: {e}") from e
+
+
+def decode_sensor(payload, device_id=None, received_at=None):
+    """Decodifica un payload de sensor_data (binario si empieza con el magic, si no JSON)"""
+    if payload[:2] == BINARY_MAGIC and device_id is not None:
+        return decode_binary(payload, device_id, received_at)
+    data = decode_json(payload)
+    if not isinstance(data, dict):
+        raise DecodeError("El payload JSON no es un objeto")
+    return SensorReading.from_dict(data, device_id, received_at)
+
+
+# Registros del spool: un byte de versión seguido de la lectura como lista JSON
+# posicional (orden de __slots__). Los spools de versiones anteriores no tienen
+# ese byte: un objeto JSON (formato original) o la lista sin versión
+RECORD_VERSION = 2
+_RECORD_TAG = bytes([RECORD_VERSION])
+
+
+def encode_record(reading):
+    """Serialización compacta para el spool en disco"""
+    return _RECORD_TAG + json_dumps(reading.to_tuple())
+
+
+def decode_record(payload):
+    """Decodifica un registro del spool; lanza DecodeError si no respeta el esquema.
+
+    Los registros se validan otra vez al leerlos: un spool escrito por una
+    versión anterior puede contener lecturas que hoy se rechazarían al ingresar.
+    """
+    if payload[:1] == _RECORD_TAG:
+        return SensorReading.from_record(decode_json(payload[1:]))
+    # Registro sin versión, escrito antes de actualizar y todavía en disco
+    data = decode_json(payload)
+    if isinstance(data, dict):
+        return SensorReading.from_dict(data)
+    if isinstance(data, list):
+        return SensorReading.from_record(data)
+    raise DecodeError(f"Registro de spool desconocido: {bytes(payload[:16])!r}")
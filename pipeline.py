@@ -0,0 +1,132 @@
+# pipeline.py: Pipeline de ingestión (MQTT -> anomalías -> DB) sin dependencias de Qt
+
+import threading
+import config
+import mqtt_client
+import mqtt_async
+import db_handler
+import anomaly_detection
+import metrics
+import model_training
+import spool
+import stage_runner
+
+class Pipeline:
+    """Crea las instancias y los hilos de ingestión, detección y guardado.
+
+    Lo usan tanto la GUI (main.main) como el modo headless (main.main_headless);
+    el Dashboard se conecta como un suscriptor más del bus.
+    """
+
+    def __init__(self, db=None, defer_db=False):
+        self.threads = []
+        self.metrics_server = None
+        self.stages = []
+        self.maintenance = None
+
+        print("   - Creando MQTT Client...")
+        if config.MQTT_ASYNC:
+            # El socket lo atiende un event loop de asyncio con backpressure
+            self.mqtt_instance = mqtt_async.AsyncMQTTClient()
+        else:
+            self.mqtt_instance = mqtt_client.MQTTClient()
+        print("   ✓ MQTT Client")
+
+        print("   - Creando Anomaly Detector...")
+        self.anomaly_instance = anomaly_detection.FleetAnomalyDetector()
+        print("   ✓ Anomaly Detector")
+
+        print("   - Creando DB Handler...")
+        # Cualquier StorageBackend sirve (p. ej. el almacén del benchmark); con
+        # defer_db la conexión y el esquema se verifican en segundo plano
+        if db is not None:
+            self.db_instance = db
+        elif defer_db:
+            self.db_instance = db_handler.DeferredStorage()
+        else:
+            self.db_instance = db_handler.create_db_handler()
+        if config.SPOOL_ENABLED:
+            # Las lecturas pasan por el spool en disco: sobreviven a caídas de la DB
+            self.batch_writer = spool.SpooledBatchWriter(self.db_instance)
+        else:
+            self.batch_writer = db_handler.BatchWriter(self.db_instance)
+        print("   ✓ DB Handler")
+
+        # Suscripciones al bus: cada etapa recibe todas las lecturas, en orden
+        self.db_subscription = mqtt_client.temperature_bus.subscribe(
+            "db", block_timeout=config.BUS_BLOCK_TIMEOUT
+        )
+        self.anomaly_subscription = mqtt_client.temperature_bus.subscribe(
+            "anomaly", block_timeout=config.BUS_BLOCK_TIMEOUT
+        )
+
+    def start(self, connect_mqtt=True):
+        if config.METRICS_ENABLED:
+            try:
+                self.metrics_server = metrics.start_http_server()
+            except OSError as e:
+                print(f"   ⚠ No se pudo iniciar el endpoint de métricas: {e}")
+        if config.METRICS_FILE:
+            metrics.start_file_dumper()
+
+        if connect_mqtt:
+            self._start_thread(self.run_mqtt_thread)
+            print("   ✓ Cliente MQTT iniciado")
+
+        self.stages = [
+            stage_runner.StageRunner(
+                "db", self.db_subscription, self.save_batch
+            ).start(),
+            stage_runner.StageRunner(
+                "anomaly", self.anomaly_subscription, self.process_anomaly_batch,
+                max_batch=config.ANOMALY_MAX_BATCH
+            ).start(),
+        ]
+        print("   ✓ DB saver iniciado")
+        print("   ✓ Anomaly detector iniciado")
+
+        if config.DB_MAINTENANCE_INTERVAL:
+            # Particiones de los próximos meses y retención de las vencidas
+            self.maintenance = db_handler.start_maintenance_job(self.db_instance)
+
+    def stop(self):
+        # Primero deja de recibir, luego vacía las etapas y el escritor
+        try:
+            self.mqtt_instance.disconnect()
+        except Exception as e:
+            print(f"✗ Error desconectando MQTT: {e}")
+        for stage in self.stages:
+            stage.stop(timeout=5)
+        self.batch_writer.close(timeout=5)
+        if self.maintenance is not None:
+            self.maintenance.set()
+        self.db_instance.close()
+        model_training.get_default_trainer().shutdown()
+        if self.metrics_server is not None:
+            self.metrics_server.shutdown()
+
+    def stage_stats(self):
+        return [stage.stats() for stage in self.stages]
+
+    def _start_thread(self, target):
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    # Thread MQTT
+    def run_mqtt_thread(self):
+        self.mqtt_instance.connect()
+
+    # Etapa DB: pasa todas las lecturas al escritor por lotes
+    def save_batch(self, batch):
+        self.batch_writer.add_many(batch)
+
+    # Etapa de anomalías: evalúa cada micro-lote de la flota de una vez
+    def process_anomaly_batch(self, batch):
+        batch = [r for r in batch if r.temperature is not None]
+        if batch:
+            self.anomaly_instance.process_batch(
+                [r.device_id for r in batch],
+                [r.temperature for r in batch],
+                [r.received_at for r in batch],
+            )
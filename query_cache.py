@@ -0,0 +1,184 @@
+# query_cache.py: Caché LRU de consultas históricas con invalidación por inserción
+
+import collections
+import threading
+import time
+from datetime import datetime, timedelta
+import config
+import metrics
+
+cache_hits = metrics.registry.counter("query_cache_hits_total", "Consultas respondidas desde la caché")
+cache_misses = metrics.registry.counter("query_cache_misses_total", "Consultas enviadas completas a la DB")
+cache_tail_fetches = metrics.registry.counter(
+    "query_cache_tail_fetches_total", "Consultas que solo pidieron a la DB las filas nuevas")
+cache_evictions = metrics.registry.counter("query_cache_evictions_total", "Entradas desalojadas o invalidadas")
+
+
+def day_range(start_date=None, end_date=None):
+    """Rango [inicio, fin) en datetime de un filtro por días (end_date incluye todo ese día)"""
+    start = end = None
+    if start_date is not None:
+        start = start_date if isinstance(start_date, datetime) else datetime(
+            start_date.year, start_date.month, start_date.day)
+    if end_date is not None:
+        end = end_date if isinstance(end_date, datetime) else datetime(
+            end_date.year, end_date.month, end_date.day) + timedelta(days=1)
+    return start, end
+
+
+class CacheEntry:
+    __slots__ = ('rows', 'device_id', 'start', 'end', 'newest', 'time_key',
+                 'descending', 'limit', 'tail_pending', 'expires')
+
+    def __init__(self, rows, device_id, start, end, time_key, descending, limit, expires=None):
+        self.rows = rows
+        self.device_id = device_id
+        self.start = start
+        self.end = end
+        self.time_key = time_key
+        self.descending = descending
+        self.limit = limit
+        self.tail_pending = False
+        self.expires = expires  # time.monotonic() de vencimiento (None: rango cerrado, no vence)
+        times = [row[time_key] for row in rows]
+        self.newest = max(times) if times else None
+
+    def overlaps(self, device_ids, oldest, newest):
+        if self.device_id is not None and self.device_id not in device_ids:
+            return False
+        if self.start is not None and newest < self.start:
+            return False
+        return self.end is None or oldest < self.end
+
+
+class QueryCache:
+    """Caché LRU de resultados ordenados por tiempo (filas crudas, páginas o rollups).
+
+    Las entradas de rangos cerrados no vencen: solo se tocan cuando se
+    inserta un lote que cae en su rango. Las de rangos abiertos (sin fin o
+    con fin futuro) vencen a los QUERY_CACHE_OPEN_TTL seg., porque otro
+    proceso (servicio headless, workers) puede insertar sin invalidar esta
+    caché. Si todas las filas nuevas son posteriores a lo cacheado (el
+    caso normal para rangos que incluyen el presente), la entrada queda
+    marcada y la próxima consulta pide a la DB solo la cola desde el último
+    timestamp cacheado (inclusive, así se actualiza el último bucket de un
+    rollup) y la combina con lo que ya tenía. Un lote con filas más viejas
+    (p. ej. al vaciar el spool tras una caída) invalida la entrada. Un
+    resultado de más de max_rows filas no se cachea.
+    """
+
+    def __init__(self, max_entries=None, max_rows=None):
+        self.max_entries = max_entries or config.QUERY_CACHE_MAX_ENTRIES
+        self.max_rows = max_rows or config.QUERY_CACHE_MAX_ROWS
+        self._entries = collections.OrderedDict()  # clave -> CacheEntry (más reciente al final)
+        self._rows = 0
+        self._version = 0  # Número de invalidaciones hechas
+        # Últimas invalidaciones, para aplicarlas a consultas que estaban en vuelo
+        self._recent = collections.deque(maxlen=64)  # (device_ids, oldest, newest)
+        self._lock = threading.Lock()
+
+    def fetch(self, key, fetch, device_id=None, start=None, end=None, time_key='timestamp',
+              descending=False, limit=None):
+        """Resultado de fetch(since) para key; since=None pide el rango completo.
+
+        fetch(since) debe agregar 'tiempo >= since' a la consulta original
+        (mismo orden y mismo limit).
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires is not None and time.monotonic() >= entry.expires:
+                self._remove(key)
+                cache_evictions.inc()
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                if not entry.tail_pending:
+                    cache_hits.inc()
+                    return list(entry.rows)
+            version = self._version
+
+        if entry is not None and entry.newest is not None:
+            tail = fetch(entry.newest)
+            cache_tail_fetches.inc()
+            rows = self._merge(entry, tail)
+            expires = entry.expires  # La cola no trae filas viejas de otros procesos: no renueva
+        else:
+            rows = fetch(None)
+            cache_misses.inc()
+            expires = None
+            if end is None or end > datetime.now():
+                expires = time.monotonic() + config.QUERY_CACHE_OPEN_TTL
+
+        with self._lock:
+            if len(rows) > self.max_rows:
+                # Desalojaría todo lo demás y a sí mismo: se responde sin cachear
+                self._remove(key)
+                return list(rows)
+            new_entry = CacheEntry(rows, device_id, start, end, time_key, descending, limit, expires)
+            if self._apply_missed(new_entry, version):
+                self._store(key, new_entry)
+            else:
+                self._remove(key)
+        return list(rows)
+
+    def _apply_missed(self, entry, version):
+        """Aplica a entry las invalidaciones ocurridas durante su consulta; False si no sirve"""
+        missed = self._version - version
+        if missed == 0:
+            return True
+        if missed > len(self._recent):
+            return False
+        for device_ids, oldest, newest in list(self._recent)[-missed:]:
+            if entry.overlaps(device_ids, oldest, newest):
+                if entry.newest is None or oldest < entry.newest:
+                    return False
+                entry.tail_pending = True
+        return True
+
+    @staticmethod
+    def _merge(entry, tail):
+        kept = [row for row in entry.rows if row[entry.time_key] < entry.newest]
+        if entry.descending:
+            rows = tail + kept
+        else:
+            rows = kept + tail
+        if entry.limit is not None:
+            rows = rows[:entry.limit]
+        return rows
+
+    def _store(self, key, entry):
+        self._remove(key)
+        self._entries[key] = entry
+        self._rows += len(entry.rows)
+        while self._entries and (len(self._entries) > self.max_entries or self._rows > self.max_rows):
+            self._remove(next(iter(self._entries)))
+            cache_evictions.inc()
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._rows -= len(entry.rows)
+
+    def invalidate(self, device_ids, oldest, newest):
+        """Marca o descarta las entradas afectadas por un lote insertado en [oldest, newest]"""
+        with self._lock:
+            self._version += 1
+            self._recent.append((device_ids, oldest, newest))
+            for key, entry in list(self._entries.items()):
+                if not entry.overlaps(device_ids, oldest, newest):
+                    continue
+                if entry.newest is not None and oldest >= entry.newest:
+                    entry.tail_pending = True
+                else:
+                    self._remove(key)
+                    cache_evictions.inc()
+
+    def clear(self):
+        with self._lock:
+            self._version += len(self._recent) + 1  # Descarta también las consultas en vuelo
+            self._recent.clear()
+            self._entries.clear()
+            self._rows = 0
+
+    def __len__(self):
+        return len(self._entries)
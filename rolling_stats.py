@@ -0,0 +1,135 @@
+# rolling_stats.py: Estadísticas incrementales O(1) sobre una ventana deslizante
+
+import collections
+import math
+from array import array
+
+
+class RollingStats:
+    """Ventana deslizante de tamaño fijo con estadísticas en tiempo constante.
+
+    - EWMA sobre la ventana actual con la muestra más antigua como semilla
+      (los pesos de anomaly_detection.ewma_weights), con desalojo exacto.
+    - Media y varianza poblacional (como np.std) con Welford deslizante.
+    - Mínimo y máximo con deques monótonos (O(1) amortizado).
+
+    Los valores viven en un array('d') circular preasignado. Cada window_size
+    muestras se recalculan las sumas desde el buffer para acotar el error de
+    redondeo acumulado (O(1) amortizado).
+    """
+
+    def __init__(self, window_size, alpha=0.3):
+        if window_size < 1:
+            raise ValueError("window_size debe ser >= 1")
+        self.window_size = window_size
+        self.alpha = alpha
+        self._decay = 1.0 - alpha
+        self._evict_weight = alpha * self._decay ** window_size
+        self._values = array('d', bytes(8 * window_size))
+        self._head = 0  # Próxima posición de escritura (= la más antigua si está llena)
+        self.count = 0
+        self._seq = 0  # Total de muestras recibidas
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._ewma_tail = 0.0  # sum(alpha * decay^(n-1-i) * x_i) sobre la ventana
+        self._min_deque = collections.deque()  # (seq, valor), valores crecientes
+        self._max_deque = collections.deque()  # (seq, valor), valores decrecientes
+
+    @property
+    def full(self):
+        return self.count == self.window_size
+
+    def push(self, value):
+        value = float(value)
+        n = self.window_size
+        if self.count < n:
+            self._values[self._head] = value
+            self._head = (self._head + 1) % n
+            self.count += 1
+            delta = value - self._mean
+            self._mean += delta / self.count
+            self._m2 += delta * (value - self._mean)
+            self._ewma_tail = self._decay * self._ewma_tail + self.alpha * value
+        else:
+            old = self._values[self._head]
+            self._values[self._head] = value
+            self._head = (self._head + 1) % n
+            delta = value - old
+            old_mean = self._mean
+            self._mean += delta / n
+            self._m2 += delta * (value - self._mean + old - old_mean)
+            self._ewma_tail = (self._decay * self._ewma_tail + self.alpha * value
+                               - self._evict_weight * old)
+
+        self._seq += 1
+        if self._seq % n == 0:
+            self._recompute()
+
+        seq = self._seq
+        min_deque = self._min_deque
+        while min_deque and min_deque[-1][1] >= value:
+            min_deque.pop()
+        min_deque.append((seq, value))
+        if min_deque[0][0] <= seq - n:
+            min_deque.popleft()
+
+        max_deque = self._max_deque
+        while max_deque and max_deque[-1][1] <= value:
+            max_deque.pop()
+        max_deque.append((seq, value))
+        if max_deque[0][0] <= seq - n:
+            max_deque.popleft()
+
+    def _recompute(self):
+        """Recalcula media, M2 y EWMA desde el buffer (corrige deriva numérica)"""
+        values = self.values()
+        mean = math.fsum(values) / len(values)
+        self._mean = mean
+        self._m2 = math.fsum((v - mean) ** 2 for v in values)
+        tail = 0.0
+        for v in values:
+            tail = self._decay * tail + self.alpha * v
+        self._ewma_tail = tail
+
+    def values(self):
+        """Valores de la ventana en orden cronológico"""
+        if self.count < self.window_size:
+            return self._values[:self.count]
+        return self._values[self._head:] + self._values[:self._head]
+
+    @property
+    def oldest(self):
+        if self.count < self.window_size:
+            return self._values[0]
+        return self._values[self._head]
+
+    @property
+    def ewma(self):
+        if self.count == 0:
+            return 0.0
+        return self._ewma_tail + self._decay ** self.count * self.oldest
+
+    @property
+    def mean(self):
+        return self._mean
+
+    @property
+    def variance(self):
+        if self.count == 0:
+            return 0.0
+        # Residuo de redondeo en ventanas constantes: reporta 0 exacto como np.std
+        if self._m2 <= 1e-12 * (self.count * self._mean * self._mean + 1.0):
+            return 0.0
+        return self._m2 / self.count
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    @property
+    def min(self):
+        return self._min_deque[0][1] if self._min_deque else None
+
+    @property
+    def max(self):
+        return self._max_deque[0][1] if self._max_deque else None
@@ -0,0 +1,410 @@
+# sharding.py: Supervisor multiproceso con workers particionados por dispositivo
+
+import bisect
+import hashlib
+import multiprocessing
+import os
+import queue
+import signal
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+import config
+import metrics
+import mqtt_client
+import mqtt_async
+import pipeline
+import utils
+
+logger = utils.get_logger(__name__)
+
+# Cabecera del anillo: posiciones absolutas de escritura (head) y lectura (tail)
+# y una marca de "consumidor dormido"; los datos empiezan en RING_DATA_OFFSET
+POSITION = struct.Struct('<Q')
+WAITING = struct.Struct('<I')
+HEAD_OFFSET = 0
+TAIL_OFFSET = 8
+WAITING_OFFSET = 16
+RING_DATA_OFFSET = 64
+RECORD_LENGTH = struct.Struct('<I')
+WRAP_MARKER = 0xFFFFFFFF  # El resto del anillo quedó sin usar: el registro sigue al inicio
+# Trama de un mensaje MQTT en el anillo: hora de recepción, largo del tópico, tópico y payload
+FRAME_HEADER = struct.Struct('<dH')
+
+
+def _hash(key):
+    """Hash estable entre procesos (hash() de Python cambia en cada proceso)"""
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little')
+
+
+class HashRing:
+    """Hash consistente con nodos virtuales: asigna cada device_id a un worker.
+
+    La asignación es la misma en cada arranque, y al cambiar la cantidad de
+    workers solo cambian de dueño ~1/N de los dispositivos.
+    """
+
+    def __init__(self, nodes, replicas=None):
+        self.replicas = replicas or config.SHARD_VIRTUAL_NODES
+        points = sorted((_hash(f"{node}#{i}"), node) for node in nodes for i in range(self.replicas))
+        self._keys = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+        self._cache = {}  # device_id -> nodo
+
+    def node_for(self, key):
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        index = bisect.bisect(self._keys, _hash(key or "")) % len(self._keys)
+        node = self._cache[key] = self._nodes[index]
+        return node
+
+
+class SharedRing:
+    """Buffer circular en memoria compartida, de un productor y un consumidor.
+
+    Guarda registros de largo variable con prefijo de largo; un registro nunca
+    se parte: si no cabe al final, se marca el resto como salto y se escribe
+    al inicio. El productor solo escribe head y el consumidor solo tail, así
+    que no hace falta un lock entre procesos. El consumidor avisa en la
+    cabecera cuando va a dormir y solo entonces el productor señala el Event;
+    la espera tiene timeout por si un aviso se cruza.
+    """
+
+    def __init__(self, capacity=None, data_event=None, name=None):
+        self.capacity = capacity or config.SHARD_RING_SIZE
+        self.data_event = data_event if data_event is not None else multiprocessing.Event()
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=RING_DATA_OFFSET + self.capacity)
+            self.shm.buf[:RING_DATA_OFFSET] = bytes(RING_DATA_OFFSET)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        # Copias locales: cada lado es el único que escribe su posición
+        self._head = POSITION.unpack_from(self.shm.buf, HEAD_OFFSET)[0]
+        self._tail = POSITION.unpack_from(self.shm.buf, TAIL_OFFSET)[0]
+
+    @classmethod
+    def attach(cls, name, capacity, data_event):
+        """Abre desde otro proceso un anillo creado por el supervisor"""
+        return cls(capacity, data_event, name)
+
+    def put(self, record):
+        """Agrega un registro; retorna False si no hay espacio (no bloquea)"""
+        size = RECORD_LENGTH.size + len(record)
+        if size > self.capacity // 2:
+            raise ValueError(f"Registro de {len(record)} bytes excede el anillo")
+        buf = self.shm.buf
+        head = self._head
+        tail = POSITION.unpack_from(buf, TAIL_OFFSET)[0]
+        offset = head % self.capacity
+        contiguous = self.capacity - offset
+        needed = size if size <= contiguous else contiguous + size
+        if self.capacity - (head - tail) < needed:
+            return False
+        if size > contiguous:
+            if contiguous >= RECORD_LENGTH.size:
+                RECORD_LENGTH.pack_into(buf, RING_DATA_OFFSET + offset, WRAP_MARKER)
+            head += contiguous
+            offset = 0
+        start = RING_DATA_OFFSET + offset
+        RECORD_LENGTH.pack_into(buf, start, len(record))
+        buf[start + RECORD_LENGTH.size:start + size] = record
+        # Los datos quedan escritos antes de publicar el nuevo head
+        self._head = head + size
+        POSITION.pack_into(buf, HEAD_OFFSET, self._head)
+        if WAITING.unpack_from(buf, WAITING_OFFSET)[0]:
+            self.data_event.set()
+        return True
+
+    def get_many(self, max_records, timeout=None):
+        """Lee hasta max_records; con timeout, espera hasta que haya al menos uno"""
+        records = self._read(max_records)
+        if records or not timeout:
+            return records
+        buf = self.shm.buf
+        WAITING.pack_into(buf, WAITING_OFFSET, 1)
+        records = self._read(max_records)  # Revisa de nuevo tras anunciar la espera
+        if not records:
+            self.data_event.wait(timeout)
+        WAITING.pack_into(buf, WAITING_OFFSET, 0)
+        self.data_event.clear()
+        return records or self._read(max_records)
+
+    def _read(self, max_records):
+        buf = self.shm.buf
+        head = POSITION.unpack_from(buf, HEAD_OFFSET)[0]
+        tail = self._tail
+        records = []
+        while tail < head and len(records) < max_records:
+            offset = tail % self.capacity
+            contiguous = self.capacity - offset
+            if contiguous < RECORD_LENGTH.size:
+                tail += contiguous
+                continue
+            start = RING_DATA_OFFSET + offset
+            length = RECORD_LENGTH.unpack_from(buf, start)[0]
+            if length == WRAP_MARKER:
+                tail += contiguous
+                continue
+            begin = start + RECORD_LENGTH.size
+            records.append(bytes(buf[begin:begin + length]))
+            tail += RECORD_LENGTH.size + length
+        if tail != self._tail:
+            # Libera el espacio leído una sola vez por lote
+            self._tail = tail
+            POSITION.pack_into(buf, TAIL_OFFSET, tail)
+        return records
+
+    def depth(self):
+        """Bytes escritos y todavía no leídos"""
+        buf = self.shm.buf
+        return POSITION.unpack_from(buf, HEAD_OFFSET)[0] - POSITION.unpack_from(buf, TAIL_OFFSET)[0]
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def encode_frame(topic, payload, received_at):
+    topic = topic.encode()
+    return FRAME_HEADER.pack(received_at, len(topic)) + topic + bytes(payload)
+
+
+def decode_frame(frame):
+    """Retorna (tópico, payload, hora de recepción), en el orden de MQTTClient.dispatch"""
+    received_at, topic_length = FRAME_HEADER.unpack_from(frame)
+    start = FRAME_HEADER.size
+    topic = frame[start:start + topic_length].decode()
+    return topic, frame[start + topic_length:], received_at
+
+
+def config_snapshot():
+    """Valores actuales de config (los procesos spawn reimportan config.py y perderían los cambios en runtime)"""
+    return {name: value for name, value in vars(config).items() if name.isupper()}
+
+
+def run_worker(index, ring_name, ring_capacity, data_event, health_queue, stop_event, settings):
+    """Proceso worker: consume su anillo con un Pipeline propio (decodificación, anomalías y DB)"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # El supervisor coordina el cierre
+    for name, value in settings.items():
+        setattr(config, name, value)
+    # El endpoint de métricas es del supervisor y los mensajes llegan por el
+    # anillo (sin conexión MQTT); cada worker necesita su propio spool
+    config.METRICS_ENABLED = False
+    config.METRICS_FILE = None
+    config.MQTT_ASYNC = False
+    config.SPOOL_DIR = os.path.join(config.SPOOL_DIR, f"worker-{index}")
+    if index:
+        config.DB_MAINTENANCE_INTERVAL = 0  # Las particiones las mantiene solo el worker 0
+
+    ring = SharedRing.attach(ring_name, ring_capacity, data_event)
+    # La DB conecta en segundo plano: si no está disponible, el worker sigue
+    # consumiendo su anillo (y el spool guarda las lecturas) en vez de caerse
+    ingestion = pipeline.Pipeline(defer_db=True)
+    ingestion.start(connect_mqtt=False)
+    client = ingestion.mqtt_instance
+    client.start_heartbeat_monitor()
+    received = 0
+    next_report = 0.0
+    try:
+        while True:
+            frames = ring.get_many(config.SHARD_READ_BATCH, timeout=config.SHARD_POLL_INTERVAL)
+            for frame in frames:
+                client.dispatch(*decode_frame(frame))
+            received += len(frames)
+            now = time.monotonic()
+            if now >= next_report:
+                health_queue.put(_health_report(index, ring, ingestion, received))
+                next_report = now + config.SHARD_HEALTH_INTERVAL
+            if not frames and stop_event.is_set():
+                break
+    finally:
+        ingestion.stop()
+        health_queue.put(_health_report(index, ring, ingestion, received))
+        ring.close()
+
+
+def _health_report(index, ring, ingestion, received):
+    return {
+        'worker': index,
+        'pid': os.getpid(),
+        'time': time.time(),
+        'received': received,
+        'ring_bytes': ring.depth(),
+        'devices': len(ingestion.mqtt_instance.devices),
+        'decode_errors': mqtt_client.decode_errors.value,
+        'rows_written': ingestion.batch_writer.rows_written,
+        'stages': ingestion.stage_stats(),
+    }
+
+
+class ShardSupervisor:
+    """Recibe MQTT en un proceso y reparte los mensajes entre N workers por device_id.
+
+    El supervisor solo enruta: toma el device_id del tópico, elige el worker
+    con hash consistente y copia el mensaje crudo a su anillo en memoria
+    compartida. Cada worker decodifica, evalúa anomalías y guarda en la DB
+    con su propio Pipeline, así que todos los mensajes de un dispositivo (y
+    su heartbeat) llegan en orden al mismo proceso. No se usan suscripciones
+    compartidas del broker ($share): reparten por mensaje, no por dispositivo.
+
+    Los workers reportan su estado por una cola; si uno muere o deja de
+    reportar, el supervisor lo reinicia y el nuevo retoma el mismo anillo.
+    """
+
+    def __init__(self, workers=None, ring_capacity=None):
+        self.workers = workers or config.SHARD_WORKERS
+        self.ring_capacity = ring_capacity or config.SHARD_RING_SIZE
+        self.block_timeout = config.BUS_BLOCK_TIMEOUT
+        self.context = multiprocessing.get_context("spawn")
+        self.hash_ring = HashRing(range(self.workers))
+        self.health_queue = self.context.Queue()
+        self.stop_event = self.context.Event()
+        self.rings = [SharedRing(self.ring_capacity, self.context.Event()) for _ in range(self.workers)]
+        self.processes = [None] * self.workers
+        self.health = [None] * self.workers  # Último reporte de cada worker
+        self.restarts = 0
+        self.metrics_server = None
+        self._last_seen = [0.0] * self.workers
+        self._stopping = False
+        self._monitor = threading.Thread(target=self._run_monitor, name="shard-monitor", daemon=True)
+
+        self._routed = []
+        self._dropped = []
+        for index, ring in enumerate(self.rings):
+            labels = {'worker': str(index)}
+            self._routed.append(metrics.registry.counter(
+                "shard_messages_routed_total", "Mensajes enviados a cada worker", labels))
+            self._dropped.append(metrics.registry.counter(
+                "shard_messages_dropped_total", "Mensajes descartados con el anillo lleno", labels))
+            metrics.registry.gauge("shard_ring_bytes", "Bytes pendientes en el anillo de cada worker",
+                                   labels, fn=ring.depth)
+            metrics.registry.gauge("shard_worker_up", "1 si el proceso del worker está vivo", labels,
+                                   fn=lambda index=index: int(self._is_alive(index)))
+        self._restart_counter = metrics.registry.counter(
+            "shard_worker_restarts_total", "Workers reiniciados por caída o falta de reportes")
+
+        print("   - Creando MQTT Client (supervisor)...")
+        if config.MQTT_ASYNC:
+            self.mqtt_instance = mqtt_async.AsyncMQTTClient()
+        else:
+            self.mqtt_instance = mqtt_client.MQTTClient()
+        # El supervisor no decodifica: reemplaza dispatch por el reparto a los anillos
+        self.mqtt_instance.dispatch = self.forward
+        print("   ✓ MQTT Client")
+
+    def start(self, connect_mqtt=True):
+        if config.METRICS_ENABLED:
+            try:
+                self.metrics_server = metrics.start_http_server()
+            except OSError as e:
+                print(f"   ⚠ No se pudo iniciar el endpoint de métricas: {e}")
+        if config.METRICS_FILE:
+            metrics.start_file_dumper()
+
+        for index in range(self.workers):
+            self._spawn(index)
+        print(f"   ✓ {self.workers} workers iniciados")
+        self._monitor.start()
+        if connect_mqtt:
+            self.mqtt_instance.connect()
+            print("   ✓ Cliente MQTT iniciado")
+
+    def stop(self, timeout=10):
+        """Deja de recibir, espera a que cada worker vacíe su anillo y libera la memoria compartida"""
+        try:
+            self.mqtt_instance.disconnect()
+        except Exception as e:
+            print(f"✗ Error desconectando MQTT: {e}")
+        self._stopping = True
+        if self._monitor.is_alive():
+            self._monitor.join()
+        self.stop_event.set()
+        deadline = time.monotonic() + timeout
+        for index, process in enumerate(self.processes):
+            if process is None:
+                continue
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning("⚠ Worker %s no terminó a tiempo, se fuerza el cierre", index)
+                process.terminate()
+                process.join()
+        self._collect_reports()
+        for ring in self.rings:
+            ring.close()
+        if self.metrics_server is not None:
+            self.metrics_server.shutdown()
+
+    def forward(self, topic, payload, received_at=None):
+        """Copia el mensaje al anillo del worker dueño del dispositivo"""
+        route = self.mqtt_instance.router.route(topic)
+        if route is None:
+            return
+        worker = self.hash_ring.node_for(route[0])
+        ring = self.rings[worker]
+        frame = encode_frame(topic, payload, received_at or time.time())
+        if not ring.put(frame):
+            # Anillo lleno: espera al worker hasta block_timeout y luego descarta
+            deadline = time.monotonic() + self.block_timeout
+            while not ring.put(frame):
+                if time.monotonic() >= deadline:
+                    self._dropped[worker].inc()
+                    return
+                time.sleep(0.001)
+        self._routed[worker].inc()
+
+    def stats(self):
+        return [report for report in self.health if report is not None]
+
+    def _spawn(self, index):
+        ring = self.rings[index]
+        process = self.context.Process(
+            target=run_worker, name=f"shard-worker-{index}",
+            args=(index, ring.name, ring.capacity, ring.data_event, self.health_queue, self.stop_event,
+                  config_snapshot()),
+        )
+        process.start()
+        self.processes[index] = process
+        self._last_seen[index] = time.monotonic()  # El arranque cuenta como reporte
+
+    def _is_alive(self, index):
+        process = self.processes[index]
+        return process is not None and process.is_alive()
+
+    def _run_monitor(self):
+        while not self._stopping:
+            self._collect_reports(timeout=config.SHARD_HEALTH_INTERVAL)
+            if not self._stopping:
+                self._check_workers()
+
+    def _collect_reports(self, timeout=None):
+        """Guarda los reportes pendientes (con timeout, espera el primero)"""
+        try:
+            report = self.health_queue.get(timeout=timeout) if timeout else self.health_queue.get_nowait()
+            while True:
+                self.health[report['worker']] = report
+                self._last_seen[report['worker']] = time.monotonic()
+                report = self.health_queue.get_nowait()
+        except queue.Empty:
+            pass
+
+    def _check_workers(self):
+        now = time.monotonic()
+        for index, process in enumerate(self.processes):
+            if not process.is_alive():
+                logger.error("✗ Worker %s terminó (código %s), reiniciando...", index, process.exitcode)
+            elif now - self._last_seen[index] > config.SHARD_HEALTH_TIMEOUT:
+                logger.error("✗ Worker %s sin reportes hace %.0fs, reiniciando...",
+                             index, now - self._last_seen[index])
+                process.terminate()
+                process.join()
+            else:
+                continue
+            self.restarts += 1
+            self._restart_counter.inc()
+            self._spawn(index)
@@ -0,0 +1,371 @@
+# spool.py: Spool local en disco (write-ahead) entre la etapa MQTT y la base de datos
+
+import base64
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+import config
+import db_handler
+import metrics
+import payload_codec
+import utils
+
+logger = utils.get_logger(__name__)
+
+# Cabecera de cada registro: largo del payload y CRC32 del payload
+RECORD_HEADER = struct.Struct('<II')
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".log"
+OFFSETS_FILE = "offsets.json"
+DEAD_LETTER_FILE = "dead-letter.jsonl"  # Registros rechazados por su contenido (no se reintentan)
+
+spool_dead_letters = metrics.registry.counter("spool_dead_letters_total",
+                                              "Registros del spool apartados en el archivo de rechazados")
+
+
+class Segment:
+    """Archivo de tamaño fijo mapeado en memoria; los ceros marcan el final de los datos"""
+
+    def __init__(self, path, seq, size):
+        self.path = path
+        self.seq = seq
+        exists = os.path.exists(path)
+        self.file = open(path, 'r+b' if exists else 'w+b')
+        if not exists or os.path.getsize(path) < size:
+            self.file.truncate(size)
+        self.size = os.path.getsize(path)
+        self.map = mmap.mmap(self.file.fileno(), self.size)
+        self.write_pos = self._scan_end()
+
+    def _scan_end(self):
+        """Busca el final de los datos válidos (registro vacío, incompleto o con CRC inválido)"""
+        pos = 0
+        while True:
+            record = self.read_at(pos)
+            if record is None:
+                return pos
+            pos = record[1]
+
+    def read_at(self, pos):
+        """Retorna (payload, siguiente posición) o None si no hay un registro válido en pos"""
+        if pos + RECORD_HEADER.size > self.size:
+            return None
+        length, crc = RECORD_HEADER.unpack_from(self.map, pos)
+        end = pos + RECORD_HEADER.size + length
+        if length == 0 or end > self.size:
+            return None
+        payload = self.map[pos + RECORD_HEADER.size:end]
+        if zlib.crc32(payload) != crc:
+            return None
+        return payload, end
+
+    def append(self, payload):
+        """Escribe el payload y luego la cabecera: un registro a medias queda con cabecera en cero"""
+        end = self.write_pos + RECORD_HEADER.size + len(payload)
+        if end > self.size:
+            return False
+        self.map[self.write_pos + RECORD_HEADER.size:end] = payload
+        RECORD_HEADER.pack_into(self.map, self.write_pos, len(payload), zlib.crc32(payload))
+        self.write_pos = end
+        return True
+
+    def flush(self):
+        self.map.flush()
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+
+class Spool:
+    """Log append-only en segmentos mmap con offsets confirmados a prueba de caídas.
+
+    El escritor agrega registros al segmento actual y rota al llenarse. El
+    lector avanza un cursor en memoria; solo commit() persiste la posición
+    (escritura atómica con os.replace) y borra los segmentos ya consumidos.
+    Tras un reinicio, la lectura retoma desde el último offset confirmado.
+    """
+
+    def __init__(self, directory=None, segment_size=None, fsync=None):
+        self.directory = directory or config.SPOOL_DIR
+        self.segment_size = segment_size or config.SPOOL_SEGMENT_SIZE
+        self.fsync = config.SPOOL_FSYNC if fsync is None else fsync
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._data_available = threading.Condition(self._lock)
+        self.segments = {}  # seq -> Segment
+
+        for seq in self._existing_segments():
+            self.segments[seq] = Segment(self._segment_path(seq), seq, self.segment_size)
+        self.committed = self._load_offsets()
+        if not self.segments:
+            self.segments[self.committed[0]] = Segment(
+                self._segment_path(self.committed[0]), self.committed[0], self.segment_size
+            )
+        self.current = self.segments[max(self.segments)]
+        self.read_position = self.committed
+
+    def _segment_path(self, seq):
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{seq:010d}{SEGMENT_SUFFIX}")
+
+    def _existing_segments(self):
+        seqs = []
+        for name in os.listdir(self.directory):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                seqs.append(int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]))
+        return sorted(seqs)
+
+    def _load_offsets(self):
+        path = os.path.join(self.directory, OFFSETS_FILE)
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            return (data['segment'], data['offset'])
+        except (OSError, ValueError, KeyError):
+            first = min(self.segments) if self.segments else 0
+            return (first, 0)
+
+    def _save_offsets(self, position):
+        path = os.path.join(self.directory, OFFSETS_FILE)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'segment': position[0], 'offset': position[1]}, f)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def append(self, payloads):
+        """Agrega una lista de registros (bytes) al spool"""
+        with self._lock:
+            for payload in payloads:
+                if len(payload) + RECORD_HEADER.size > self.segment_size:
+                    raise ValueError(f"Registro de {len(payload)} bytes excede el segmento")
+                if not self.current.append(payload):
+                    self._rotate()
+                    self.current.append(payload)
+            if self.fsync:
+                self.current.flush()
+            self._data_available.notify_all()
+
+    def _rotate(self):
+        if self.fsync:
+            self.current.flush()
+        seq = self.current.seq + 1
+        self.current = self.segments[seq] = Segment(self._segment_path(seq), seq, self.segment_size)
+
+    def read(self, max_records, timeout=None):
+        """Lee hasta max_records desde el cursor de lectura.
+
+        Retorna (payloads, posición final); la posición debe pasarse a commit()
+        una vez que los registros quedaron guardados en la DB.
+        """
+        entries, position = self.read_entries(max_records, timeout)
+        return [payload for payload, _ in entries], position
+
+    def read_entries(self, max_records, timeout=None):
+        """Como read(), pero con la posición posterior a cada registro: [(payload, posición)]"""
+        with self._lock:
+            if timeout is not None and not self._has_data():
+                self._data_available.wait(timeout)
+            entries = []
+            seq, pos = self.read_position
+            while len(entries) < max_records:
+                segment = self.segments.get(seq)
+                if segment is None:
+                    break
+                record = segment.read_at(pos) if pos < segment.write_pos else None
+                if record is None:
+                    if seq < self.current.seq:
+                        seq, pos = seq + 1, 0  # Fin de un segmento ya rotado
+                        continue
+                    break
+                pos = record[1]
+                entries.append((record[0], (seq, pos)))
+            self.read_position = (seq, pos)
+            return entries, (seq, pos)
+
+    def _has_data(self):
+        seq, pos = self.read_position
+        return seq < self.current.seq or pos < self.current.write_pos
+
+    def rewind(self):
+        """Vuelve el cursor de lectura al último offset confirmado (p. ej. tras un error de DB)"""
+        with self._lock:
+            self.read_position = self.committed
+
+    def commit(self, position):
+        """Confirma la posición y elimina los segmentos completamente consumidos"""
+        with self._lock:
+            self._save_offsets(position)
+            self.committed = position
+            for seq in [s for s in self.segments if s < position[0]]:
+                segment = self.segments.pop(seq)
+                segment.close()
+                os.remove(segment.path)
+
+    def dead_letter(self, rejected):
+        """Agrega [(payload, motivo)] al archivo de rechazados (una línea JSON por registro).
+
+        Se llama antes de commit(): ante una caída entre ambos, el registro
+        puede quedar dos veces en el archivo, pero nunca se pierde.
+        """
+        if not rejected:
+            return
+        path = os.path.join(self.directory, DEAD_LETTER_FILE)
+        with self._lock, open(path, 'a') as f:
+            for payload, reason in rejected:
+                f.write(json.dumps({
+                    'rejected_at': time.time(),
+                    'reason': reason,
+                    'record': base64.b64encode(bytes(payload)).decode('ascii'),
+                }) + "\n")
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        spool_dead_letters.inc(len(rejected))
+
+    def pending_segments(self):
+        with self._lock:
+            return len(self.segments)
+
+    def close(self):
+        with self._lock:
+            for segment in self.segments.values():
+                segment.flush()
+                segment.close()
+            self.segments = {}
+
+
+class SpooledBatchWriter:
+    """Igual que db_handler.BatchWriter, pero con el spool en disco como buffer.
+
+    add_many() solo escribe en el spool local (no depende de la DB). Un hilo
+    lee lotes del spool, los inserta con DBHandler.insert_samples y confirma el
+    offset; si la DB falla, reintenta con backoff sin perder datos y, al
+    volver, reproduce el atraso en lotes completos. Los registros que fallan
+    por su contenido (no decodifican o la DB los rechaza estando disponible)
+    van al archivo de rechazados del spool y el offset avanza: no bloquean al resto.
+    """
+
+    def __init__(self, db, spool=None, batch_size=None, flush_interval_ms=None):
+        self.db = db
+        self.spool = spool or Spool()
+        self.batch_size = batch_size or config.DB_BATCH_SIZE
+        self.flush_interval = (flush_interval_ms or config.DB_BATCH_INTERVAL_MS) / 1000.0
+        self.rows_written = 0
+        self.batches_written = 0
+        self.failed_batches = 0
+        self.dead_letters = 0
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def add(self, sample):
+        self.add_many([sample])
+
+    def add_many(self, samples):
+        self.spool.append([payload_codec.encode_record(sample) for sample in samples])
+
+    def close(self, timeout=None):
+        self._closed.set()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            # Sigue dentro de read/commit (p. ej. un insert lento): cerrar los mmap lo rompería.
+            # Lo no confirmado sigue en disco y se reproduce al reiniciar
+            logger.warning("⚠ El escritor del spool no terminó en %s s; el spool queda abierto", timeout)
+            return
+        self.spool.close()
+
+    def _run(self):
+        delay = config.DB_RECONNECT_BASE_DELAY
+        while True:
+            entries, position = self._collect_batch()
+            if not entries:
+                if self._closed.is_set():
+                    return
+                continue
+            try:
+                stored = self._store(entries, position)
+            except Exception as e:
+                # Un error inesperado no detiene el hilo: el lote sigue en el spool
+                logger.exception("✗ Error inesperado guardando un lote del spool: %s", e)
+                stored = False
+            if stored:
+                delay = config.DB_RECONNECT_BASE_DELAY
+                continue
+            # La DB no está disponible: los datos siguen en el spool
+            self.failed_batches += 1
+            self.spool.rewind()
+            if self._closed.wait(delay):
+                return
+            delay = min(delay * 2, config.DB_RECONNECT_MAX_DELAY)
+
+    def _store(self, entries, position):
+        """Guarda un lote leído del spool; retorna False si hay que reintentarlo más tarde"""
+        decoded = []  # (payload, posición, lectura o None, motivo del rechazo)
+        for payload, end in entries:
+            try:
+                decoded.append((payload, end, payload_codec.decode_record(payload), None))
+            except payload_codec.DecodeError as e:
+                decoded.append((payload, end, None, f"decode: {e}"))
+        batch = [reading for _, _, reading, _ in decoded if reading is not None]
+        if not batch or self.db.insert_samples(batch):
+            self._saved(len(batch))
+            self._commit([(payload, reason) for payload, _, reading, reason in decoded if reading is None],
+                         position)
+            return True
+        if not self.db.is_available():
+            return False
+        # La DB responde pero rechazó el lote: se reintenta lectura por lectura para apartar las inválidas
+        logger.warning("⚠ La DB rechazó un lote de %s lecturas, se separan las inválidas", len(batch))
+        rejected, committed = [], None
+        for payload, end, reading, reason in decoded:
+            if reading is not None:
+                if self.db.insert_samples([reading]):
+                    self._saved(1)
+                    committed = end
+                    continue
+                if not self.db.is_available():
+                    # Se cayó a mitad de camino: confirma lo ya guardado y reintenta el resto
+                    if committed is not None:
+                        self._commit(rejected, committed)
+                    return False
+                reason = "db: lectura rechazada por la base de datos"
+            rejected.append((payload, reason))
+            committed = end
+        self._commit(rejected, committed)
+        return True
+
+    def _saved(self, rows):
+        if rows:
+            self.rows_written += rows
+            self.batches_written += 1
+            db_handler.notify_saved(rows)
+
+    def _commit(self, rejected, position):
+        """Aparta los registros rechazados y confirma el offset (en ese orden)"""
+        if rejected:
+            self.spool.dead_letter(rejected)
+            self.dead_letters += len(rejected)
+            logger.error("✗ %s registros del spool apartados en %s: %s",
+                         len(rejected), DEAD_LETTER_FILE, rejected[0][1])
+        self.spool.commit(position)
+
+    def _collect_batch(self):
+        """Junta hasta batch_size registros o lo que llegue en flush_interval"""
+        entries, position = self.spool.read_entries(self.batch_size, timeout=self.flush_interval)
+        deadline = time.monotonic() + self.flush_interval
+        while entries and len(entries) < self.batch_size and not self._closed.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            more, more_position = self.spool.read_entries(self.batch_size - len(entries), timeout=remaining)
+            if more:
+                entries.extend(more)
+                position = more_position
+        return entries, position
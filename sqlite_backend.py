@@ -0,0 +1,608 @@
+# sqlite_backend.py: Backend de almacenamiento embebido (SQLite en modo WAL, tablas por mes)
+
+import contextlib
+import sqlite3
+import threading
+import time
+from datetime import date, datetime
+import config
+import db_handler
+import query_cache
+import utils
+
+logger = utils.get_logger(__name__)
+
+PARTITION_PREFIX = "sensor_samples_"
+# Los rollups 1m y 1h también van en una tabla por mes (sensor_rollup_1m_YYYYMM)
+ROLLUP_PREFIXES = {name: db_handler.ROLLUPS[name][0] + "_" for name in db_handler.PARTITIONED_ROLLUPS}
+
+
+# Los timestamps se guardan como milisegundos epoch enteros (misma precisión
+# que DATETIME(3) en MySQL): comparan exacto al usarlos como cursor de paginación
+
+def _to_millis(value):
+    """Convierte datetime/date/segundos epoch a milisegundos (hora local, como DBHandler)"""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        value = value.timestamp()
+    elif isinstance(value, date):
+        value = datetime(value.year, value.month, value.day).timestamp()
+    return round(value * 1000)
+
+
+def _from_millis(value):
+    return datetime.fromtimestamp(value / 1000)
+
+
+def _partition_name(millis, prefix=PARTITION_PREFIX):
+    return prefix + _from_millis(millis).strftime('%Y%m')
+
+
+def _month_range(name):
+    """[inicio, fin) en milisegundos del mes de una partición (prefijo_YYYYMM)"""
+    year, month = int(name[-6:-2]), int(name[-2:])
+    start = datetime(year, month, 1)
+    end = datetime(year + month // 12, month % 12 + 1, 1)
+    return _to_millis(start), _to_millis(end)
+
+
+class SQLiteHandler(db_handler.StorageBackend):
+    """Almacenamiento en un archivo SQLite, sin servidor, con la misma interfaz que DBHandler.
+
+    Las muestras crudas y los rollups 1m/1h se guardan en una tabla por mes
+    (sensor_samples_YYYYMM, sensor_rollup_1m_YYYYMM...): las consultas por
+    rango solo tocan los meses involucrados y borrar datos viejos es un DROP TABLE. Las escrituras van por una única conexión (SQLite
+    admite un solo escritor) y cada lote es una transacción; en modo WAL las
+    lecturas usan conexiones propias por hilo y no bloquean a la escritura.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path=None):
+        self.path = path or config.SQLITE_PATH
+        self.in_memory = self.path == ":memory:"
+        self.last_saved_hour = None
+        self._hour_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._local = threading.local()
+        self._readers = {}  # ident del hilo -> su conexión de lectura (se cierran en close)
+        self._readers_lock = threading.Lock()
+        self.partitions = set()
+        self.cache = query_cache.QueryCache()
+        self.writer = self._open()
+        self.create_tables()
+        logger.info("✓ SQLite abierto en %s (%s particiones)", self.path, len(self.partitions))
+
+    def _open(self):
+        connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        if not self.in_memory:
+            connection.execute("PRAGMA journal_mode=WAL")
+            # En WAL, NORMAL solo sincroniza en los checkpoints: no corrompe ante cortes
+            connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("PRAGMA busy_timeout=5000")
+        return connection
+
+    def _reader(self):
+        """Conexión de lectura del hilo actual (la base en memoria se comparte con el escritor)"""
+        if self.in_memory:
+            return self.writer
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = self._open()
+            with self._readers_lock:
+                # De paso cierra las conexiones de hilos que ya terminaron
+                alive = {thread.ident for thread in threading.enumerate()}
+                for ident in [ident for ident in self._readers if ident not in alive]:
+                    self._readers.pop(ident).close()
+                previous = self._readers.get(threading.get_ident())
+                if previous is not None:
+                    previous.close()  # Ident reutilizado de un hilo terminado
+                self._readers[threading.get_ident()] = connection
+        return connection
+
+    def _read(self, query, params):
+        if self.in_memory:
+            with self._write_lock:
+                return self.writer.execute(query, params).fetchall()
+        return self._reader().execute(query, params).fetchall()
+
+    def create_tables(self):
+        with self._write_lock:
+            self.writer.execute("""
+                CREATE TABLE IF NOT EXISTS hourly_temperatures (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    device_id TEXT NOT NULL,
+                    timestamp INTEGER NOT NULL,
+                    temperature REAL NOT NULL
+                )
+            """)
+            for name, (table, _, _) in db_handler.ROLLUPS.items():
+                if name not in ROLLUP_PREFIXES:
+                    self._create_rollup_table(table)
+            self.writer.execute("""
+                CREATE TABLE IF NOT EXISTS anomaly_events (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    run_id TEXT NOT NULL,
+                    device_id TEXT NOT NULL,
+                    started_at INTEGER NOT NULL,
+                    ended_at INTEGER NOT NULL,
+                    recovered_at INTEGER,
+                    duration_seconds REAL NOT NULL,
+                    sample_count INTEGER NOT NULL,
+                    peak_temperature REAL NOT NULL,
+                    max_abs_z REAL NOT NULL,
+                    min_ml_score REAL NOT NULL,
+                    severity TEXT NOT NULL,
+                    z_threshold REAL NOT NULL,
+                    window_size INTEGER NOT NULL
+                )
+            """)
+            self.writer.execute(
+                "CREATE INDEX IF NOT EXISTS idx_anomaly_device_start ON anomaly_events (device_id, started_at)")
+            self.writer.execute("CREATE INDEX IF NOT EXISTS idx_anomaly_run ON anomaly_events (run_id)")
+            tables = {name for (name,) in self.writer.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()}
+            prefixes = (PARTITION_PREFIX, *ROLLUP_PREFIXES.values())
+            self.partitions = {name for name in tables if name[:-6] in prefixes and name[-6:].isdigit()}
+            self._split_legacy_rollups(tables)
+
+    def _create_rollup_table(self, table):
+        self.writer.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                device_id TEXT NOT NULL,
+                bucket_start INTEGER NOT NULL,
+                min_temp REAL NOT NULL,
+                max_temp REAL NOT NULL,
+                sum_temp REAL NOT NULL,
+                sample_count INTEGER NOT NULL,
+                last_temp REAL NOT NULL,
+                last_ts INTEGER NOT NULL,
+                PRIMARY KEY (device_id, bucket_start)
+            ) WITHOUT ROWID
+        """)
+
+    def _split_legacy_rollups(self, tables):
+        """Reparte por mes los rollups 1m/1h de archivos creados cuando eran una sola tabla"""
+        for name, prefix in ROLLUP_PREFIXES.items():
+            table = db_handler.ROLLUPS[name][0]
+            if table not in tables:
+                continue
+            created = []
+            self.writer.execute("BEGIN IMMEDIATE")
+            try:
+                low, high = self.writer.execute(
+                    f"SELECT MIN(bucket_start), MAX(bucket_start) FROM {table}").fetchone()
+                month = None if low is None else db_handler.month_start(_from_millis(low))
+                while month is not None and _to_millis(month) <= high:
+                    following = db_handler.add_months(month, 1)
+                    partition = _partition_name(_to_millis(month), prefix)
+                    if self._ensure_partition(partition):
+                        created.append(partition)
+                    self.writer.execute(f"""
+                        INSERT INTO {partition} SELECT * FROM {table}
+                        WHERE bucket_start >= ? AND bucket_start < ?
+                    """, (_to_millis(month), _to_millis(following)))
+                    month = following
+                self.writer.execute(f"DROP TABLE {table}")
+                self.writer.execute("COMMIT")
+            except BaseException:
+                self.writer.execute("ROLLBACK")
+                self.partitions.difference_update(created)
+                raise
+            logger.info("✓ Rollup %s repartido en %s tablas mensuales", table, len(created))
+
+    def _ensure_partition(self, name):
+        """Crea la tabla del mes si no existe (con el lock de escritura tomado); True si la creó"""
+        if name in self.partitions:
+            return False
+        if not name.startswith(PARTITION_PREFIX):
+            self._create_rollup_table(name)
+            self.partitions.add(name)
+            return True
+        self.writer.execute(f"""
+            CREATE TABLE IF NOT EXISTS {name} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                device_id TEXT NOT NULL,
+                timestamp INTEGER NOT NULL,
+                device_timestamp TEXT,
+                temperature REAL,
+                pressure REAL,
+                altitude REAL,
+                rssi INTEGER,
+                status TEXT
+            )
+        """)
+        self.writer.execute(f"CREATE INDEX IF NOT EXISTS idx_{name}_device_ts ON {name} (device_id, timestamp)")
+        self.writer.execute(f"CREATE INDEX IF NOT EXISTS idx_{name}_ts ON {name} (timestamp)")
+        self.partitions.add(name)
+        return True
+
+    def _partitions(self, start=None, end=None, newest_first=False, prefix=PARTITION_PREFIX):
+        """Particiones de prefix que se solapan con [start, end), en orden cronológico"""
+        selected = []
+        for name in sorted(self.partitions, reverse=newest_first):
+            if name[:-6] != prefix:
+                continue
+            month_start, month_end = _month_range(name)
+            if start is not None and month_end <= start:
+                continue
+            if end is not None and month_start >= end:
+                continue
+            selected.append(name)
+        return selected
+
+    def insert_temperature(self, device_id, temperature):
+        now = datetime.now()
+        hour_timestamp = now.replace(minute=0, second=0, microsecond=0)
+
+        with self._hour_lock:
+            # Evita duplicados en la misma hora
+            if self.last_saved_hour == hour_timestamp:
+                logger.warning("⚠ Ya guardado en esta hora, omitiendo...")
+                return
+            try:
+                with self._write_lock:
+                    self.writer.execute(
+                        "INSERT INTO hourly_temperatures (device_id, timestamp, temperature) VALUES (?, ?, ?)",
+                        (device_id, _to_millis(hour_timestamp), temperature)
+                    )
+                self.last_saved_hour = hour_timestamp
+                logger.info("✓ Guardado en DB: %s°C a las %s", temperature, hour_timestamp.strftime('%H:%M'))
+                return True
+            except sqlite3.Error as e:
+                logger.error("✗ Error insertando en DB: %s", e)
+                return False
+
+    def insert_samples(self, samples):
+        """Inserta un lote en una sola transacción, repartido por partición mensual, y actualiza los rollups"""
+        if not samples:
+            return True
+        started = time.perf_counter()
+        try:
+            by_partition = {}
+            rollup_source = []
+            for s in samples:
+                received_at = _to_millis(s.received_at or time.time())
+                row = (
+                    s.device_id,
+                    received_at,
+                    None if s.timestamp is None else str(s.timestamp),
+                    s.temperature,
+                    s.pressure,
+                    s.altitude,
+                    s.rssi,
+                    s.status,
+                )
+                by_partition.setdefault(_partition_name(received_at), []).append(row)
+                rollup_source.append((s.device_id, _from_millis(received_at), None, s.temperature))
+
+            with self._write_lock:
+                self.writer.execute("BEGIN IMMEDIATE")
+                created = []
+                try:
+                    for name, rows in by_partition.items():
+                        if self._ensure_partition(name):
+                            created.append(name)
+                        self.writer.executemany(f"""
+                            INSERT INTO {name}
+                                (device_id, timestamp, device_timestamp, temperature,
+                                 pressure, altitude, rssi, status)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                        """, rows)
+                    for resolution, (table, _, truncate) in db_handler.ROLLUPS.items():
+                        prefix = ROLLUP_PREFIXES.get(resolution)
+                        by_table = {}
+                        for device_id, bucket, low, high, total, count, last, last_ts \
+                                in db_handler.aggregate_rollup_rows(rollup_source, truncate):
+                            bucket = _to_millis(bucket)
+                            target = table if prefix is None else _partition_name(bucket, prefix)
+                            by_table.setdefault(target, []).append(
+                                (device_id, bucket, low, high, total, count, last, _to_millis(last_ts)))
+                        for target, rollup_rows in by_table.items():
+                            if prefix is not None and self._ensure_partition(target):
+                                created.append(target)
+                            # En el UPDATE las columnas sin prefijo tienen el valor anterior
+                            self.writer.executemany(f"""
+                                INSERT INTO {target}
+                                    (device_id, bucket_start, min_temp, max_temp, sum_temp,
+                                     sample_count, last_temp, last_ts)
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                                ON CONFLICT (device_id, bucket_start) DO UPDATE SET
+                                    min_temp = MIN(min_temp, excluded.min_temp),
+                                    max_temp = MAX(max_temp, excluded.max_temp),
+                                    sum_temp = sum_temp + excluded.sum_temp,
+                                    sample_count = sample_count + excluded.sample_count,
+                                    last_temp = CASE WHEN excluded.last_ts >= last_ts
+                                                     THEN excluded.last_temp ELSE last_temp END,
+                                    last_ts = MAX(last_ts, excluded.last_ts)
+                            """, rollup_rows)
+                    self.writer.execute("COMMIT")
+                except BaseException:
+                    self.writer.execute("ROLLBACK")
+                    # Las tablas creadas en la transacción revertida ya no existen
+                    self.partitions.difference_update(created)
+                    raise
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            # TypeError/ValueError: valores que no se pueden guardar ni agregar en los rollups
+            db_handler.db_failed_batches.inc()
+            logger.error("✗ Error insertando lote en DB (%s filas): %s", len(samples), e)
+            return False
+        db_handler.record_batch_metrics(samples, time.perf_counter() - started)
+        timestamps = [row[1] for row in rollup_source]
+        self.cache.invalidate({row[0] for row in rollup_source}, min(timestamps), max(timestamps))
+        return True
+
+    def _sample_rows(self, rows):
+        return [
+            {'id': row[0], 'device_id': row[1], 'timestamp': _from_millis(row[2]),
+             'temperature': row[3]}
+            for row in rows
+        ]
+
+    def get_historical_data(self, start_date=None, end_date=None):
+        start, end = query_cache.day_range(start_date, end_date)
+        try:
+            return self.cache.fetch(
+                ('history', start_date, end_date),
+                lambda since: self._query_historical_data(start, end, since),
+                start=start, end=end, descending=True
+            )
+        except sqlite3.Error as e:
+            logger.error("✗ Error obteniendo datos históricos: %s", e)
+            return []
+
+    def _query_historical_data(self, start, end, since=None):
+        start, end = self._millis_range(start, end, since)
+        result = []
+        for name in self._partitions(start, end, newest_first=True):
+            query = f"SELECT id, device_id, timestamp, temperature FROM {name}"
+            conditions, params = self._range_conditions(start, end)
+            if conditions:
+                query += " WHERE " + " AND ".join(conditions)
+            query += " ORDER BY timestamp DESC"
+            result.extend(self._sample_rows(self._read(query, params)))
+        return result
+
+    @staticmethod
+    def _millis_range(start, end, since=None):
+        """Rango [start, end) en milisegundos; since (cola de la caché) acota el inicio"""
+        if since is not None and (start is None or since > start):
+            start = since
+        return _to_millis(start), _to_millis(end)
+
+    @staticmethod
+    def _range_conditions(start, end):
+        conditions, params = [], []
+        if start is not None:
+            conditions.append("timestamp >= ?")
+            params.append(start)
+        if end is not None:
+            conditions.append("timestamp < ?")
+            params.append(end)
+        return conditions, params
+
+    def get_historical_page(self, start_date=None, end_date=None, after=None,
+                            limit=500, device_id=None):
+        """Página por clave (timestamp, id) descendente; recorre los meses del más nuevo al más viejo"""
+        start, end = query_cache.day_range(start_date, end_date)
+        if after is not None:
+            # Las páginas siguientes solo contienen filas más viejas que el cursor
+            end = after[0] if end is None else min(end, after[0])
+        try:
+            return self.cache.fetch(
+                ('page', start_date, end_date, after, limit, device_id),
+                lambda since: self._query_historical_page(start, end, after, limit, device_id, since),
+                device_id=device_id, start=start, end=end, descending=True, limit=limit
+            )
+        except sqlite3.Error as e:
+            logger.error("✗ Error obteniendo página de datos históricos: %s", e)
+            return []
+
+    def _query_historical_page(self, start, end, after, limit, device_id, since=None):
+        start, end = self._millis_range(start, end, since)
+        if after is not None:
+            after_timestamp, after_id = _to_millis(after[0]), after[1]
+            # Incluye las filas con el mismo timestamp que el cursor y menor id
+            end = after_timestamp + 1
+        page = []
+        for name in self._partitions(start, end, newest_first=True):
+            conditions, params = self._range_conditions(start, end)
+            if device_id:
+                conditions.append("device_id = ?")
+                params.append(device_id)
+            if after is not None:
+                conditions.append("(timestamp < ? OR (timestamp = ? AND id < ?))")
+                params.extend([after_timestamp, after_timestamp, after_id])
+            query = f"SELECT id, device_id, timestamp, temperature FROM {name}"
+            if conditions:
+                query += " WHERE " + " AND ".join(conditions)
+            query += " ORDER BY timestamp DESC, id DESC LIMIT ?"
+            params.append(limit - len(page))
+            page.extend(self._sample_rows(self._read(query, params)))
+            if len(page) >= limit:
+                break
+        return page
+
+    def get_series(self, device_id, start, end, max_points=2000):
+        """Igual que DBHandler.get_series: datos crudos si caben en max_points, si no el rollup más fino"""
+        resolution = db_handler.choose_resolution(start, end, max_points)
+        try:
+            return resolution, self.cache.fetch(
+                ('series', device_id, start, end, resolution),
+                lambda since: self._query_series(device_id, start, end, resolution, since),
+                device_id=device_id, start=start, end=end, time_key='bucket_start'
+            )
+        except sqlite3.Error as e:
+            logger.error("✗ Error obteniendo serie (%s): %s", resolution, e)
+            return resolution, []
+
+    def _query_series(self, device_id, start, end, resolution, since=None):
+        start_ms, end_ms = self._millis_range(start, end, since)
+        if resolution == 'raw':
+            rows = []
+            for name in self._partitions(start_ms, end_ms):
+                rows.extend(self._read(f"""
+                    SELECT timestamp, temperature, temperature, temperature, 1, temperature
+                    FROM {name}
+                    WHERE device_id = ? AND timestamp >= ? AND timestamp < ?
+                        AND temperature IS NOT NULL
+                    ORDER BY timestamp
+                """, (device_id, start_ms, end_ms)))
+        else:
+            prefix = ROLLUP_PREFIXES.get(resolution)
+            if prefix is None:
+                tables = [db_handler.ROLLUPS[resolution][0]]
+            else:
+                tables = self._partitions(start_ms, end_ms, prefix=prefix)
+            rows = []
+            for name in tables:
+                rows.extend(self._read(f"""
+                    SELECT bucket_start, min_temp, max_temp, sum_temp / sample_count,
+                           sample_count, last_temp
+                    FROM {name}
+                    WHERE device_id = ? AND bucket_start >= ? AND bucket_start < ?
+                    ORDER BY bucket_start
+                """, (device_id, start_ms, end_ms)))
+        return [
+            {'bucket_start': _from_millis(row[0]), 'min': row[1], 'max': row[2],
+             'avg': row[3], 'count': row[4], 'last': row[5]}
+            for row in rows
+        ]
+
+    def iter_samples(self, start=None, end=None, device_id=None, chunk_size=None):
+        """Como DBHandler.iter_samples, un mes a la vez (cada dispositivo sigue en orden cronológico)"""
+        chunk_size = chunk_size or config.BACKFILL_CHUNK_SIZE
+        start_ms, end_ms = self._millis_range(start, end)
+        for name in self._partitions(start_ms, end_ms):
+            after = None
+            while True:
+                conditions, params = self._range_conditions(start_ms, end_ms)
+                conditions.append("temperature IS NOT NULL")
+                if device_id:
+                    conditions.append("device_id = ?")
+                    params.append(device_id)
+                if after is not None:
+                    conditions.append("(device_id, timestamp, id) > (?, ?, ?)")
+                    params.extend(after)
+                params.append(chunk_size)
+                rows = self._read(f"""
+                    SELECT id, device_id, timestamp, temperature FROM {name}
+                    WHERE {" AND ".join(conditions)}
+                    ORDER BY device_id, timestamp, id LIMIT ?
+                """, params)
+                if rows:
+                    yield [(row[0], row[1], _from_millis(row[2]), row[3]) for row in rows]
+                if len(rows) < chunk_size:
+                    break
+                last_id, last_device, last_timestamp, _ = rows[-1]
+                after = (last_device, last_timestamp, last_id)
+
+    def iter_export(self, start=None, end=None, device_id=None, chunk_size=None):
+        """Como DBHandler.iter_export: un cursor por mes, leído de a chunk_size filas"""
+        chunk_size = chunk_size or config.EXPORT_CHUNK_SIZE
+        start_ms, end_ms = self._millis_range(start, end)
+        for name in self._partitions(start_ms, end_ms):
+            conditions, params = self._range_conditions(start_ms, end_ms)
+            if device_id:
+                conditions.append("device_id = ?")
+                params.append(device_id)
+            query = f"SELECT {', '.join(db_handler.EXPORT_COLUMNS)} FROM {name}"
+            if conditions:
+                query += " WHERE " + " AND ".join(conditions)
+            query += " ORDER BY timestamp, id"
+            # La base en memoria comparte la conexión del escritor: se lee con su lock
+            lock = self._write_lock if self.in_memory else contextlib.nullcontext()
+            with lock:
+                cursor = self._reader().execute(query, params)
+            try:
+                while True:
+                    with lock:
+                        rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    yield [(row[0], row[1], _from_millis(row[2])) + row[3:] for row in rows]
+            finally:
+                cursor.close()
+
+    def insert_anomaly_events(self, anomaly_events):
+        if not anomaly_events:
+            return True
+        rows = [
+            (e['run_id'], e['device_id'], _to_millis(e['started_at']), _to_millis(e['ended_at']),
+             _to_millis(e['recovered_at']), e['duration_seconds'], e['sample_count'],
+             e['peak_temperature'], e['max_abs_z'], e['min_ml_score'], e['severity'],
+             e['z_threshold'], e['window_size'])
+            for e in anomaly_events
+        ]
+        try:
+            with self._write_lock:
+                self.writer.execute("BEGIN IMMEDIATE")
+                try:
+                    self.writer.executemany("""
+                        INSERT INTO anomaly_events
+                            (run_id, device_id, started_at, ended_at, recovered_at, duration_seconds,
+                             sample_count, peak_temperature, max_abs_z, min_ml_score, severity,
+                             z_threshold, window_size)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """, rows)
+                    self.writer.execute("COMMIT")
+                except BaseException:
+                    self.writer.execute("ROLLBACK")
+                    raise
+            return True
+        except sqlite3.Error as e:
+            logger.error("✗ Error guardando eventos de anomalía (%s): %s", len(rows), e)
+            return False
+
+    def delete_anomaly_events(self, run_id):
+        try:
+            with self._write_lock:
+                self.writer.execute("DELETE FROM anomaly_events WHERE run_id = ?", (run_id,))
+            return True
+        except sqlite3.Error as e:
+            logger.error("✗ Error borrando eventos de anomalía de %s: %s", run_id, e)
+            return False
+
+    def drop_partitions_before(self, cutoff, tables=None):
+        """Elimina los meses completos anteriores a cutoff (retención barata: DROP TABLE)"""
+        cutoff = _to_millis(cutoff)
+        prefixes = tuple(table + "_" for table in tables or db_handler.PARTITIONED_TABLES)
+        dropped = []
+        with self._write_lock:
+            for name in sorted(self.partitions):
+                if name[:-6] in prefixes and _month_range(name)[1] <= cutoff:
+                    self.writer.execute(f"DROP TABLE IF EXISTS {name}")
+                    self.partitions.discard(name)
+                    dropped.append(name)
+        if dropped:
+            self.cache.clear()
+            logger.info("✓ Particiones eliminadas: %s", ', '.join(dropped))
+        return dropped
+
+    def maintain_partitions(self, now=None):
+        # Las tablas de cada mes se crean al insertar: solo queda aplicar la retención
+        dropped = []
+        for table, months in config.DB_RETENTION_MONTHS.items():
+            if months is not None and table in db_handler.PARTITIONED_TABLES:
+                dropped.extend(self.drop_partitions_before(db_handler.retention_cutoff(months, now), (table,)))
+        return dropped
+
+    def is_available(self):
+        """Verifica que se pueda tomar el lock de escritura del archivo"""
+        try:
+            with self._write_lock:
+                self.writer.execute("BEGIN IMMEDIATE")
+                self.writer.execute("ROLLBACK")
+        except sqlite3.Error:
+            return False
+        return True
+
+    def close(self):
+        with self._readers_lock:
+            readers = list(self._readers.values())
+            self._readers.clear()
+        for connection in readers:
+            connection.close()
+        with self._write_lock:
+            self.writer.close()
@@ -0,0 +1,85 @@
+# stage_runner.py: Ejecución de etapas del pipeline guiada por eventos
+
+import threading
+import time
+import metrics
+import utils
+
+logger = utils.get_logger(__name__)
+
+
+class StageRunner:
+    """Hilo que consume una suscripción del bus y procesa lotes con handler(batch).
+
+    Espera bloqueado hasta que haya datos (sin sleeps ni polling), procesa
+    todo lo pendiente en lotes de hasta max_batch elementos y se detiene
+    limpiamente al cerrar la suscripción, tras procesar lo que quedaba.
+    Los errores del handler se cuentan y se reportan sin detener la etapa.
+    """
+
+    def __init__(self, name, subscription, handler, max_batch=None):
+        self.name = name
+        self.subscription = subscription
+        self.handler = handler
+        self.max_batch = max_batch
+        # Contadores por etapa
+        self.processed = 0
+        self.batches = 0
+        self.errors = 0
+        self.last_error = None
+        self.busy_seconds = 0.0
+        labels = {'stage': name}
+        self._batch_seconds = metrics.registry.histogram(
+            "stage_batch_seconds", "Duración del procesamiento de cada lote", labels)
+        self._processed_counter = metrics.registry.counter(
+            "stage_processed_total", "Mensajes procesados por etapa", labels)
+        self._error_counter = metrics.registry.counter(
+            "stage_errors_total", "Errores por etapa", labels)
+        self._latency = metrics.stage_latency(name)
+        self._thread = threading.Thread(target=self._run, name=f"stage-{name}", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """Cierra la entrada, espera a que se procese lo pendiente y termina"""
+        self.subscription.close()
+        self._thread.join(timeout)
+
+    def is_alive(self):
+        return self._thread.is_alive()
+
+    def _run(self):
+        while True:
+            batch = self.subscription.drain(self.max_batch, block=True)
+            if not batch:
+                if self.subscription.closed:
+                    return
+                continue
+            metrics.record_latencies(self._latency, batch)
+            started = time.perf_counter()
+            try:
+                self.handler(batch)
+            except Exception as e:
+                self.errors += 1
+                self._error_counter.inc()
+                self.last_error = e
+                logger.exception("✗ Error en etapa '%s' (%s errores): %s", self.name, self.errors, e)
+            elapsed = time.perf_counter() - started
+            self._batch_seconds.record(elapsed)
+            self._processed_counter.inc(len(batch))
+            self.busy_seconds += elapsed
+            self.processed += len(batch)
+            self.batches += 1
+
+    def stats(self):
+        return {
+            'name': self.name,
+            'processed': self.processed,
+            'batches': self.batches,
+            'errors': self.errors,
+            'queue_depth': self.subscription.qsize(),
+            'dropped': self.subscription.dropped,
+            'busy_seconds': self.busy_seconds,
+        }
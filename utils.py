@@ -1,16 +1,25 @@
 # utils.py: Funciones auxiliares
 
-import json
 from datetime import datetime
 import logging
+import payload_codec
+
+import config
 
 # Configura logging básico
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logging.basicConfig(
+    level=getattr(logging, config.LOG_LEVEL, logging.INFO),
+    format='%(asctime)s - %(levelname)s - %(name)s - %(message)s'
+)
+
+def get_logger(name):
+    """Logger por módulo; el nivel global se controla con config.LOG_LEVEL"""
+    return logging.getLogger(name)
 
 def parse_mqtt_payload(payload):
     try:
-        return json.loads(payload)
-    except json.JSONDecodeError:
+        return payload_codec.decode_json(payload)
+    except payload_codec.DecodeError:
         logging.error("Error parsing JSON")
         return None
 
@@ -1,32 +1,338 @@
 # widgets.py: Widgets personalizados para la GUI
 
+import time
 from PyQt6.QtWidgets import QWidget, QVBoxLayout
+from PyQt6.QtCore import (Qt, QAbstractTableModel, QModelIndex, QObject, QRunnable,
+                          QThreadPool, QTimer, pyqtSignal)
+from PyQt6.QtGui import QColor
+import numpy as np
 import pyqtgraph as pg
+import config
+import query_cache
+import utils
+
+logger = utils.get_logger(__name__)
+
+class TimeSeriesBuffer:
+    """Buffer circular preasignado de (timestamp, valor) con arrays NumPy"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.times = np.empty(capacity)
+        self.values = np.empty(capacity)
+        self.head = 0  # Próxima posición de escritura
+        self.count = 0
+
+    def append(self, timestamp, value):
+        self.times[self.head] = timestamp
+        self.values[self.head] = value
+        self.head = (self.head + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def view(self, since=None):
+        """Retorna (times, values) en orden cronológico, desde 'since' si se indica"""
+        if self.count < self.capacity:
+            times = self.times[:self.count]
+            values = self.values[:self.count]
+        else:
+            times = np.concatenate((self.times[self.head:], self.times[:self.head]))
+            values = np.concatenate((self.values[self.head:], self.values[:self.head]))
+        if since is not None and len(times):
+            start = np.searchsorted(times, since)
+            times = times[start:]
+            values = values[start:]
+        return times, values
+
+
+def decimate_minmax(times, values, buckets):
+    """Reduce la serie a ~2*buckets puntos conservando el mín. y máx. de cada tramo"""
+    n = len(values)
+    if n <= 2 * buckets:
+        return times, values
+    per_bucket = n // buckets
+    usable = per_bucket * buckets
+    # Los tramos terminan en el dato más reciente; el resto (lo más antiguo) va sin decimar
+    t = times[n - usable:].reshape(buckets, per_bucket)
+    v = values[n - usable:].reshape(buckets, per_bucket)
+    rows = np.arange(buckets)
+    i_min = v.argmin(axis=1)
+    i_max = v.argmax(axis=1)
+    # Mantiene el orden temporal dentro de cada tramo
+    first = np.minimum(i_min, i_max)
+    second = np.maximum(i_min, i_max)
+    out_t = np.empty(2 * buckets)
+    out_v = np.empty(2 * buckets)
+    out_t[0::2] = t[rows, first]
+    out_t[1::2] = t[rows, second]
+    out_v[0::2] = v[rows, first]
+    out_v[1::2] = v[rows, second]
+    if n > usable:
+        out_t = np.concatenate((times[:n - usable], out_t))
+        out_v = np.concatenate((values[:n - usable], out_v))
+    return out_t, out_v
+
 
 class TemperaturePlot(QWidget):
-    def __init__(self):
+    """Gráfico multi-dispositivo y multi-canal con timestamps reales.
+
+    Cada (dispositivo, canal) guarda sus datos en un TimeSeriesBuffer; el
+    redibujado se hace con un QTimer limitado a PLOT_MAX_FPS, solo para las
+    series con datos nuevos, y con decimación mín/máx al ancho en píxeles.
+    """
+
+    CHANNELS = {
+        'temperature': 'Temperatura (°C)',
+        'pressure': 'Presión (hPa)',
+        'rssi': 'RSSI (dBm)',
+    }
+
+    def __init__(self, channels=('temperature', 'pressure', 'rssi'), window_seconds=None,
+                 buffer_points=None, max_devices=None):
         super().__init__()
         self.layout = QVBoxLayout(self)
-        self.plot_widget = pg.PlotWidget()
+        self.plot_widget = pg.GraphicsLayoutWidget()
         self.layout.addWidget(self.plot_widget)
-        
         self.plot_widget.setBackground('w')
-        self.plot_widget.setLabel('left', 'Temperatura (°C)')
-        self.plot_widget.setLabel('bottom', 'Tiempo (segundos)')
-        self.plot_widget.showGrid(x=True, y=True)
         
-        self.curve = self.plot_widget.plot(pen='b')  # Línea azul para temperatura
-        self.data_x = []  # Tiempos relativos
-        self.data_y = []  # Temperaturas
-        self.max_points = 100  # Limita a últimos 100 puntos
-
-    def update_plot(self, new_temp):
-        current_time = len(self.data_x) * 15  # Asume 15 seg por punto
-        self.data_x.append(current_time)
-        self.data_y.append(new_temp)
+        self.window_seconds = window_seconds or config.PLOT_WINDOW_SECONDS
+        self.buffer_points = buffer_points or config.PLOT_BUFFER_POINTS
+        self.max_devices = max_devices or config.PLOT_MAX_DEVICES
+
+        self.plots = {}
+        for row, channel in enumerate(channels):
+            plot = self.plot_widget.addPlot(
+                row=row, col=0, axisItems={'bottom': pg.DateAxisItem(orientation='bottom')}
+            )
+            plot.setLabel('left', self.CHANNELS.get(channel, channel))
+            plot.showGrid(x=True, y=True)
+            if row > 0:
+                plot.setXLink(self.plots[channels[0]])
+            self.plots[channel] = plot
+        self.plots[channels[-1]].setLabel('bottom', 'Tiempo')
         
-        if len(self.data_x) > self.max_points:
-            self.data_x = self.data_x[-self.max_points:]
-            self.data_y = self.data_y[-self.max_points:]
+        self.devices = []  # Orden de llegada, define el color de cada dispositivo
+        self.series = {}  # (device_id, canal) -> [TimeSeriesBuffer, curva]
+        self.dirty = set()
         
-        self.curve.setData(self.data_x, self.data_y)
\ No newline at end of file
+        # Redibujado limitado a un presupuesto por frame
+        self.redraw_timer = QTimer(self)
+        self.redraw_timer.timeout.connect(self.redraw)
+        self.redraw_timer.start(int(1000 / config.PLOT_MAX_FPS))
+
+    def _series(self, device_id, channel):
+        key = (device_id, channel)
+        series = self.series.get(key)
+        if series is None:
+            if device_id not in self.devices:
+                if len(self.devices) >= self.max_devices:
+                    return None
+                self.devices.append(device_id)
+            color = pg.intColor(self.devices.index(device_id), hues=max(self.max_devices, 9))
+            curve = self.plots[channel].plot(pen=pg.mkPen(color, width=1), name=str(device_id))
+            curve.setClipToView(True)
+            series = self.series[key] = [TimeSeriesBuffer(self.buffer_points), curve]
+        return series
+
+    def add_reading(self, reading):
+        """Agrega todos los canales graficados de una lectura del bus"""
+        timestamp = reading.received_at or time.time()
+        for channel in self.plots:
+            value = getattr(reading, channel, None)
+            if value is not None:
+                self.update_plot(value, timestamp, reading.device_id, channel)
+
+    def update_plot(self, new_value, timestamp=None, device_id=None, channel='temperature'):
+        series = self._series(device_id, channel)
+        if series is None:
+            return
+        series[0].append(time.time() if timestamp is None else timestamp, new_value)
+        self.dirty.add((device_id, channel))
+
+    def redraw(self):
+        if not self.dirty:
+            return
+        since = time.time() - self.window_seconds
+        for key in self.dirty:
+            buffer, curve = self.series[key]
+            times, values = buffer.view(since)
+            buckets = max(int(self.plots[key[1]].vb.width()), 100)
+            times, values = decimate_minmax(times, values, buckets)
+            curve.setData(times, values, skipFiniteCheck=True)
+        self.dirty.clear()
+
+
+class _PageSignals(QObject):
+    # (generación, filas) — se emite desde el hilo del pool
+    page_ready = pyqtSignal(int, list)
+
+
+class _PageLoader(QRunnable):
+    """Consulta una página de la DB fuera del hilo de la GUI"""
+
+    def __init__(self, signals, generation, fetch_page):
+        super().__init__()
+        self.signals = signals
+        self.generation = generation
+        self.fetch_page = fetch_page
+
+    def run(self):
+        try:
+            rows = self.fetch_page()
+        except Exception as e:
+            logger.error("✗ Error cargando página histórica: %s", e)
+            rows = []
+        self.signals.page_ready.emit(self.generation, rows)
+
+
+class HistoricalTableModel(QAbstractTableModel):
+    """Modelo de tabla histórica que carga páginas bajo demanda al hacer scroll.
+
+    Las vistas llaman canFetchMore/fetchMore al llegar al final; cada página se
+    pide a DBHandler.get_historical_page (paginación por clave) en un
+    QThreadPool, y las filas se agregan cuando llegan al hilo de la GUI.
+    """
+
+    HEADERS = ["ID", "Device ID", "Fecha/Hora", "Temperatura (°C)"]
+    loaded = pyqtSignal(int, bool)  # (filas cargadas, quedan más)
+
+    def __init__(self, db=None, page_size=500, parent=None):
+        super().__init__(parent)
+        self.db = db
+        self.page_size = page_size
+        self.rows = []  # (id, device_id, timestamp, temperature)
+        self.query = None
+        self.generation = 0  # Invalida páginas de consultas anteriores
+        self.has_more = False
+        self.loading = False
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self.signals = _PageSignals()
+        self.signals.page_ready.connect(self._on_page_ready)
+
+    def set_query(self, start_date, end_date, device_id=None):
+        """Reinicia la tabla con un nuevo rango y carga la primera página"""
+        self.beginResetModel()
+        self.generation += 1
+        self.rows = []
+        self.query = {'start_date': start_date, 'end_date': end_date, 'device_id': device_id}
+        self.has_more = self.db is not None
+        self.loading = False
+        self.endResetModel()
+        self.fetchMore(QModelIndex())
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return self.HEADERS[section]
+        return super().headerData(section, orientation, role)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or role != Qt.ItemDataRole.DisplayRole:
+            return None
+        value = self.rows[index.row()][index.column()]
+        if index.column() == 3:
+            return "" if value is None else f"{value:.2f}"
+        return str(value)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.has_more and not self.loading
+
+    def fetchMore(self, parent=QModelIndex()):
+        if not self.canFetchMore(parent):
+            return
+        self.loading = True
+        after = None
+        if self.rows:
+            last = self.rows[-1]
+            after = (last[2], last[0])
+        query = dict(self.query, after=after, limit=self.page_size)
+        db = self.db
+        self.pool.start(_PageLoader(self.signals, self.generation,
+                                    lambda: db.get_historical_page(**query)))
+
+    def _on_page_ready(self, generation, page):
+        if generation != self.generation:
+            return  # Respuesta de una consulta ya reemplazada
+        self.loading = False
+        self.has_more = len(page) == self.page_size
+        if page:
+            first = len(self.rows)
+            self.beginInsertRows(QModelIndex(), first, first + len(page) - 1)
+            self.rows.extend(
+                (r['id'], r['device_id'], r['timestamp'], r['temperature']) for r in page
+            )
+            self.endInsertRows()
+        self.loaded.emit(len(self.rows), self.has_more)
+
+class HistoricalPlot(QWidget):
+    """Gráfico de temperatura de un rango histórico, vía DBHandler.get_series.
+
+    La DB elige la resolución (datos crudos o rollup 1m/1h/1d) para que cada
+    dispositivo devuelva a lo sumo ~un punto por píxel: se dibuja el promedio
+    y la banda mín/máx de cada bucket. Las series se piden en un QThreadPool,
+    como las páginas de HistoricalTableModel.
+    """
+
+    def __init__(self, db=None, max_devices=None):
+        super().__init__()
+        self.db = db
+        self.max_devices = max_devices or config.PLOT_MAX_DEVICES
+        self.layout = QVBoxLayout(self)
+        self.plot_widget = pg.PlotWidget(axisItems={'bottom': pg.DateAxisItem(orientation='bottom')})
+        self.plot_widget.setBackground('w')
+        self.plot_widget.setLabel('left', TemperaturePlot.CHANNELS['temperature'])
+        self.plot_widget.setLabel('bottom', 'Tiempo')
+        self.plot_widget.showGrid(x=True, y=True)
+        self.plot_widget.addLegend()
+        self.layout.addWidget(self.plot_widget)
+
+        self.generation = 0  # Invalida series de consultas anteriores
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self.signals = _PageSignals()
+        self.signals.page_ready.connect(self._on_series_ready)
+
+    def set_query(self, start_date, end_date, device_ids):
+        """Limpia el gráfico y pide la serie de cada dispositivo en [start_date, end_date]"""
+        self.generation += 1
+        self.plot_widget.clear()
+        device_ids = list(device_ids)[:self.max_devices]
+        if self.db is None or not device_ids:
+            return
+        start, end = query_cache.day_range(start_date, end_date)
+        max_points = max(int(self.plot_widget.getViewBox().width()), 100)
+        db = self.db
+
+        def fetch():
+            series = []
+            for device_id in device_ids:
+                resolution, points = db.get_series(device_id, start, end, max_points)
+                series.append((device_id, resolution, points))
+            return series
+
+        self.pool.start(_PageLoader(self.signals, self.generation, fetch))
+
+    def _on_series_ready(self, generation, series):
+        if generation != self.generation:
+            return  # Respuesta de una consulta ya reemplazada
+        hues = max(self.max_devices, 9)
+        for index, (device_id, resolution, points) in enumerate(series):
+            if not points:
+                continue
+            times = np.array([p['bucket_start'].timestamp() for p in points])
+            color = pg.intColor(index, hues=hues)
+            self.plot_widget.plot(times, np.array([float(p['avg']) for p in points]),
+                                  pen=pg.mkPen(color, width=1), name=f"{device_id} ({resolution})")
+            if resolution != 'raw':
+                low = pg.PlotDataItem(times, np.array([float(p['min']) for p in points]))
+                high = pg.PlotDataItem(times, np.array([float(p['max']) for p in points]))
+                band = QColor(color)
+                band.setAlpha(50)
+                self.plot_widget.addItem(pg.FillBetweenItem(low, high, brush=band))
+        logger.info("✓ Serie histórica cargada para %s dispositivos", len(series))